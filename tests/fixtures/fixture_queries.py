@@ -0,0 +1,19 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def strict_query_budget(settings):
+    """Превышение бюджета запросов или N+1 во вьюхе роняет тест."""
+    settings.QUERY_BUDGET_STRICT = True
+    # Миниатюры строятся сразу после коммита, а не в фоновом потоке,
+    # который иначе пишет в MEDIA_ROOT уже после конца теста.
+    settings.THUMBNAIL_PREGENERATE_SYNC = True
+
+
+@pytest.fixture
+def query_log():
+    """Журнал SQL-запросов, выполненных внутри теста."""
+    from core.querycount import QueryLog
+
+    with QueryLog() as log:
+        yield log
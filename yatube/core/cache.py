@@ -0,0 +1,160 @@
+"""Инвалидация кеша через счётчики поколений.
+
+У каждого пространства имён (например, `posts`) в кеше лежит номер
+поколения, который входит в ключи зависящих от него записей. Любое
+изменение данных увеличивает номер, и старые записи перестают
+читаться сразу, без ожидания истечения таймаута.
+
+Те же поколения дают валидаторы условных GET: ETag из номеров
+поколений и Last-Modified из времени их последней смены, так что
+ответ 304 не стоит ни одного SQL-запроса.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
+
+GENERATION_KEY = 'generation:{namespace}'
+CHANGED_KEY = 'generation_changed:{namespace}'
+
+
+def _initial_generation():
+    # Поколение от текущего времени не совпадёт ни с одним прежним,
+    # даже если счётчик был вытеснен из кеша.
+    return int(time.time() * 1000)
+
+
+def get_generation(namespace):
+    key = GENERATION_KEY.format(namespace=namespace)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _initial_generation(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def get_last_changed(namespace):
+    """Время последней смены поколения, в секундах эпохи.
+
+    Если отметка вытеснена из кеша, временем изменения считается
+    текущее: клиент лишний раз получит ответ целиком, но не
+    устаревший.
+    """
+    key = CHANGED_KEY.format(namespace=namespace)
+    changed = cache.get(key)
+    if changed is None:
+        cache.add(key, time.time(), None)
+        changed = cache.get(key)
+    return changed
+
+
+def _incr(namespace):
+    key = GENERATION_KEY.format(namespace=namespace)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_generation(), None)
+    cache.set(CHANGED_KEY.format(namespace=namespace), time.time(), None)
+
+
+def bump_generation(*namespaces):
+    """Увеличивает поколение сейчас и ещё раз после коммита.
+
+    Второй шаг нужен, чтобы страница, собранная параллельным запросом
+    до коммита, не осталась в кеше под новым поколением.
+    """
+    for namespace in namespaces:
+        _incr(namespace)
+        transaction.on_commit(lambda namespace=namespace: _incr(namespace))
+
+
+def cache_page_by_generation(timeout, namespaces, key_prefix=''):
+    """Как `cache_page`, но ключ включает поколения `namespaces`.
+
+    `namespaces` — список имён или функция от аргументов вьюхи,
+    возвращающая такой список.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            names = namespaces
+            if callable(names):
+                names = names(request, *args, **kwargs)
+            # Имена нужны в ключе: у разных читателей номера поколений
+            # подписок могут совпасть.
+            prefix = ':'.join([key_prefix] + [
+                '%s=%s' % (name, get_generation(name)) for name in names
+            ])
+            cached_view = cache_page(timeout, key_prefix=prefix)(view_func)
+            return cached_view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def generation_etag(request, names, key_prefix=''):
+    """Сильный ETag ответа на `request` при текущих поколениях `names`."""
+    parts = [key_prefix, request.get_full_path()] + [
+        '%s=%s' % (name, get_generation(name)) for name in names
+    ]
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()
+
+
+def condition_by_generation(namespaces, key_prefix=''):
+    """Как `condition`, но валидаторы берутся из поколений `namespaces`.
+
+    `namespaces` — список имён или функция от аргументов вьюхи.
+    ETag зависит от полного пути запроса, поэтому у каждой страницы
+    ленты он свой; на `If-None-Match` с текущим ETag вьюха не
+    вызывается.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            names = namespaces
+            if callable(names):
+                names = names(request, *args, **kwargs)
+            etag = generation_etag(request, names, key_prefix)
+            last_modified = max(
+                (get_last_changed(name) for name in names), default=None
+            )
+            conditional_view = condition(
+                etag_func=lambda *args, **kwargs: etag,
+                last_modified_func=lambda *args, **kwargs: (
+                    None if last_modified is None
+                    else datetime.fromtimestamp(last_modified, timezone.utc)
+                ),
+            )(view_func)
+            return conditional_view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def cache_control_by_user(max_age):
+    """Cache-Control для страниц, зависящих от читателя.
+
+    Анонимные страницы одинаковы для всех и кешируются публично на
+    `max_age` секунд; страницы вошедшего пользователя — только его
+    браузером, с перепроверкой по валидаторам на каждый запрос.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            response = view_func(request, *args, **kwargs)
+            if request.user.is_authenticated:
+                patch_cache_control(
+                    response, private=True, no_cache=True, max_age=0
+                )
+            else:
+                patch_cache_control(response, public=True, max_age=max_age)
+            # Expires от `cache_page` пережил бы перепроверку.
+            if response.has_header('Expires'):
+                del response['Expires']
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,8 @@
+from posts import follow_graph
+
+
+def following(request):
+    """Добавляет граф подписок текущего пользователя."""
+    return {
+        'follow_graph': follow_graph.for_request(request)
+    }
@@ -0,0 +1,106 @@
+"""Бэкенд SQLite с настройками для продакшена.
+
+Отличия от `django.db.backends.sqlite3`:
+
+* при открытии соединения выполняются PRAGMA из `OPTIONS['pragmas']`
+  поверх `PRAGMAS`: WAL, чтобы читатели не ждали писателя, и размеры
+  кеша страниц и mmap;
+* транзакции `atomic` открываются `BEGIN IMMEDIATE`: блокировка на
+  запись берётся сразу и ждёт `busy_timeout`, а не падает с
+  «database is locked» при попытке повысить уже начатое чтение;
+* одиночные запросы вне транзакции при «database is locked»
+  повторяются с растущей паузой. Внутри транзакции повтор одного
+  запроса неверен, и ошибка уходит вызывающему коду.
+
+`OPTIONS` бэкенда: `pragmas` (словарь), `transaction_mode`
+(`IMMEDIATE`, `DEFERRED` или `EXCLUSIVE`), `lock_retries` и
+`lock_retry_delay` (секунды до первого повтора); остальные ключи
+передаются в `sqlite3.connect`.
+"""
+import logging
+import random
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+logger = logging.getLogger(__name__)
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    # В режиме WAL NORMAL не портит базу при сбое, теряются лишь
+    # последние транзакции при отключении питания.
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+BACKEND_OPTIONS = (
+    'pragmas', 'transaction_mode', 'lock_retries', 'lock_retry_delay',
+)
+
+
+def is_locked(error):
+    return (
+        isinstance(error, base.Database.OperationalError)
+        and 'locked' in str(error)
+    )
+
+
+class CursorWrapper(base.SQLiteCursorWrapper):
+    def execute(self, query, params=None):
+        db = self.db
+        if not db.autocommit:
+            return super().execute(query, params)
+        delay = db.lock_retry_delay
+        for attempt in range(db.lock_retries + 1):
+            try:
+                return super().execute(query, params)
+            except base.Database.OperationalError as error:
+                if not is_locked(error) or attempt == db.lock_retries:
+                    raise
+            logger.warning('База заблокирована, повтор через %.3f с', delay)
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay *= 2
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _backend_options(self):
+        options = self.settings_dict['OPTIONS']
+        mode = options.get('transaction_mode', 'IMMEDIATE').upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                'transaction_mode должен быть одним из %s.'
+                % ', '.join(TRANSACTION_MODES)
+            )
+        return (
+            {**PRAGMAS, **options.get('pragmas', {})},
+            mode,
+            int(options.get('lock_retries', 3)),
+            float(options.get('lock_retry_delay', 0.05)),
+        )
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        for name in BACKEND_OPTIONS:
+            params.pop(name, None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        (pragmas, self.transaction_mode, self.lock_retries,
+         self.lock_retry_delay) = self._backend_options()
+        connection = super().get_new_connection(conn_params)
+        for name, value in pragmas.items():
+            if value is not None:
+                connection.execute('PRAGMA %s = %s' % (name, value))
+        return connection
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=CursorWrapper)
+        cursor.db = self
+        return cursor
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN %s' % self.transaction_mode)
@@ -0,0 +1,17 @@
+"""Поле и lookup для виртуальных таблиц полнотекстового поиска SQLite."""
+from django.db import models
+
+
+class FullTextField(models.TextField):
+    """Столбец таблицы FTS5; поддерживает lookup `match`."""
+
+
+@FullTextField.register_lookup
+class Match(models.Lookup):
+    """`столбец MATCH запрос`: поиск по индексу FTS5 вместо LIKE."""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return '%s MATCH %s' % (lhs, rhs), lhs_params + rhs_params
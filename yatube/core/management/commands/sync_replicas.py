@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import replicas
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу SQLite в файлы реплик '
+            '(settings.REPLICA_DATABASES) через backup API.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', action='append', dest='databases',
+            help='Только эта реплика; можно указать несколько раз.',
+        )
+        parser.add_argument(
+            '--interval', type=float,
+            help='Повторять каждые столько секунд, пока не прервут.',
+        )
+
+    def sync_all(self, aliases):
+        source = settings.DATABASES['default']['NAME']
+        for alias in aliases:
+            started = time.perf_counter()
+            replicas.sync(source, settings.DATABASES[alias]['NAME'])
+            self.stdout.write('%s: %.2f с' % (
+                alias, time.perf_counter() - started
+            ))
+
+    def handle(self, *args, **options):
+        aliases = options['databases'] or settings.REPLICA_DATABASES
+        unknown = set(aliases) - set(settings.REPLICA_DATABASES)
+        if unknown:
+            raise CommandError(
+                'Не реплики: %s' % ', '.join(sorted(unknown))
+            )
+        if not aliases:
+            raise CommandError(
+                'Реплик нет; задайте их число в YATUBE_REPLICAS.'
+            )
+        self.sync_all(aliases)
+        while options['interval']:
+            time.sleep(options['interval'])
+            self.sync_all(aliases)
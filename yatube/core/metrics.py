@@ -0,0 +1,197 @@
+"""Гистограммы времени обработки запросов по фазам.
+
+Время запроса раскладывается на фазы: SQL (`db`), рендеринг шаблонов
+(`template`), обращения к кешу (`cache`), построение миниатюр
+(`thumbnail`) и всё остальное — код вьюхи (`view`). Фазы не
+пересекаются: пока идёт вложенная фаза, время внешней не течёт, так
+что SQL из шаблона попадает в `db`, а не в `template`.
+
+Гистограммы копятся в памяти процесса по имени вьюхи
+(`resolver_match.view_name`) и отдаются в текстовом формате Prometheus
+вьюхой `core.views.metrics_view` или периодически пишутся в файл для
+textfile-коллектора node_exporter (`METRICS_FILE`).
+"""
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+PHASES = ('view', 'db', 'template', 'cache', 'thumbnail')
+
+_state = threading.local()
+
+
+class Histogram:
+    """Гистограмма с общими для всех наборов меток границами корзин."""
+
+    def __init__(self, name, help_text, labels, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def _format_labels(self, key, **extra):
+        pairs = list(zip(self.labels, key)) + list(extra.items())
+        return ','.join(
+            '%s="%s"' % (name, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"'))
+            for name, value in pairs
+        )
+
+    def expose(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.help_text),
+            '# TYPE %s histogram' % self.name,
+        ]
+        with self._lock:
+            series = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self._series.items()
+            )
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket{%s} %s' % (
+                    self.name, self._format_labels(key, le=bound), cumulative
+                ))
+            lines.append('%s_bucket{%s} %s' % (
+                self.name, self._format_labels(key, le='+Inf'), count
+            ))
+            labels = self._format_labels(key)
+            lines.append('%s_sum{%s} %r' % (self.name, labels, total))
+            lines.append('%s_count{%s} %s' % (self.name, labels, count))
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'yatube_request_seconds',
+    'Полное время обработки запроса.',
+    ('view', 'method', 'status'),
+)
+PHASE_SECONDS = Histogram(
+    'yatube_request_phase_seconds',
+    'Время запроса по фазам: view, db, template, cache, thumbnail.',
+    ('view', 'phase'),
+)
+BACKGROUND_SECONDS = Histogram(
+    'yatube_background_phase_seconds',
+    'Время фаз вне запросов, например в пуле миниатюр.',
+    ('phase',),
+)
+REGISTRY = (REQUEST_SECONDS, PHASE_SECONDS, BACKGROUND_SECONDS)
+
+
+class RequestTimer:
+    """Счётчик времени фаз одного запроса."""
+
+    def __init__(self):
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self._stack = []
+        self._started = time.perf_counter()
+        self._mark = self._started
+        self._current = 'view'
+
+    def _switch(self, phase):
+        now = time.perf_counter()
+        self.phases[self._current] += now - self._mark
+        self._mark = now
+        self._current = phase
+
+    def enter(self, phase):
+        self._stack.append(self._current)
+        self._switch(phase)
+
+    def leave(self):
+        self._switch(self._stack.pop())
+
+    def finish(self):
+        self._switch(self._current)
+        return time.perf_counter() - self._started
+
+
+@contextmanager
+def request_timer():
+    timer = _state.timer = RequestTimer()
+    try:
+        yield timer
+    finally:
+        _state.timer = None
+
+
+@contextmanager
+def timed(phase):
+    """Относит время блока к фазе `phase` текущего запроса.
+
+    Вне запроса время пишется в `yatube_background_phase_seconds`.
+    """
+    timer = getattr(_state, 'timer', None)
+    if timer is None:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            BACKGROUND_SECONDS.observe(
+                time.perf_counter() - started, phase=phase
+            )
+        return
+    timer.enter(phase)
+    try:
+        yield
+    finally:
+        timer.leave()
+
+
+def time_queries(execute, sql, params, many, context):
+    """Обёртка `execute_wrapper`, относящая SQL к фазе `db`."""
+    with timed('db'):
+        return execute(sql, params, many, context)
+
+
+def record(view, method, status, timer, total):
+    REQUEST_SECONDS.observe(total, view=view, method=method, status=status)
+    for phase, seconds in timer.phases.items():
+        PHASE_SECONDS.observe(seconds, view=view, phase=phase)
+
+
+def expose():
+    """Все метрики процесса в текстовом формате Prometheus."""
+    lines = []
+    for histogram in REGISTRY:
+        lines.extend(histogram.expose())
+    return '\n'.join(lines) + '\n'
+
+
+def dump(path):
+    """Атомарно записывает метрики в файл `path`."""
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        file.write(expose())
+    os.chmod(temp_path, 0o644)
+    os.replace(temp_path, path)
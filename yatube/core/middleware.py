@@ -0,0 +1,151 @@
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from core import metrics, replicas
+from core.cache import get_last_changed
+from core.querycount import QueryBudgetExceeded, QueryLog
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+class QueryBudgetMiddleware:
+    """Считает SQL-запросы каждого запроса и ищет в них N+1.
+
+    Бюджет берётся из декоратора `query_budget` вьюхи, иначе из
+    `QUERY_BUDGET_DEFAULT`. Нарушения пишутся в лог, а при
+    `QUERY_BUDGET_STRICT` (в тестах) превращаются в исключение.
+    Стоит первым в `MIDDLEWARE`, чтобы учитывать запросы сессии.
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_BUDGET_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryLog() as log:
+            response = self.get_response(request)
+        budget = getattr(request, '_query_budget', None)
+        if budget is None:
+            budget = settings.QUERY_BUDGET_DEFAULT
+        problems = log.problems(
+            budget,
+            settings.QUERY_REPEAT_THRESHOLD,
+            settings.QUERY_BUDGET_IGNORE,
+        )
+        if problems:
+            message = '%s %s: %s' % (
+                request.method, request.path, '; '.join(problems)
+            )
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(len(log))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = getattr(view_func, 'query_budget', None)
+
+
+class MetricsMiddleware:
+    """Записывает время запроса по фазам в гистограммы `core.metrics`.
+
+    При заданном `METRICS_FILE` раз в `METRICS_DUMP_INTERVAL` секунд
+    сбрасывает метрики процесса в файл; `{pid}` в имени разводит
+    воркеры по разным файлам.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self._dump_lock = threading.Lock()
+        self._next_dump = 0
+
+    def __call__(self, request):
+        with ExitStack() as stack:
+            timer = stack.enter_context(metrics.request_timer())
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(metrics.time_queries)
+                )
+            response = self.get_response(request)
+        total = timer.finish()
+        match = getattr(request, 'resolver_match', None)
+        metrics.record(
+            match.view_name if match else 'unresolved',
+            request.method,
+            response.status_code,
+            timer,
+            total,
+        )
+        if settings.METRICS_FILE:
+            self.dump()
+        return response
+
+    def dump(self):
+        now = time.monotonic()
+        if now < self._next_dump or not self._dump_lock.acquire(False):
+            return
+        try:
+            self._next_dump = now + settings.METRICS_DUMP_INTERVAL
+            metrics.dump(settings.METRICS_FILE.format(pid=os.getpid()))
+        except OSError:
+            logger.exception('Не удалось записать метрики')
+        finally:
+            self._dump_lock.release()
+
+
+class ReplicaMiddleware:
+    """Отправляет чтения вьюх с `replica_reads` на свежую реплику.
+
+    После запроса с записью ставит cookie со временем записи, чтобы
+    следующие страницы этого читателя не читались со снимка, сделанного
+    раньше неё (read-your-writes).
+    """
+
+    def __init__(self, get_response):
+        if not settings.REPLICA_DATABASES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with replicas.reading_from(None):
+            response = self.get_response(request)
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(
+                settings.REPLICA_COOKIE_NAME, '%.3f' % time.time(),
+                max_age=settings.REPLICA_MAX_LAG, httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    def fresh_since(self, request):
+        try:
+            written = float(
+                request.COOKIES.get(settings.REPLICA_COOKIE_NAME, 0)
+            )
+        except ValueError:
+            written = 0
+        return max([written] + [
+            get_last_changed(namespace)
+            for namespace in settings.REPLICA_FRESHNESS_NAMESPACES
+        ])
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method in SAFE_METHODS and getattr(
+            view_func, 'replica_reads', False
+        ):
+            replicas.read_from(
+                replicas.choose_replica(self.fresh_since(request))
+            )
@@ -0,0 +1,117 @@
+"""Учёт SQL-запросов запроса и поиск N+1.
+
+`QueryLog` записывает все запросы ко всем базам внутри блока `with`.
+Запросы, отличающиеся только параметрами, сводятся к одной «форме»;
+форма, повторённая много раз за один запрос, — почти всегда N+1:
+обращение к связанному объекту в цикле шаблона или вьюхи.
+
+Вьюха объявляет свой бюджет декоратором `query_budget`, а
+`core.middleware.QueryBudgetMiddleware` проверяет его на каждом
+запросе.
+"""
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LIST = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+SPACES = re.compile(r'\s+')
+# Управление транзакцией — не отдельная работа базы.
+TRANSACTION = re.compile(
+    r'(BEGIN|COMMIT|ROLLBACK)\b|(RELEASE |ROLLBACK TO )?SAVEPOINT\b'
+)
+
+_state = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Вьюха сделала больше запросов, чем объявила, или попала в N+1."""
+
+
+def query_budget(limit):
+    """Объявляет, сколько SQL-запросов вьюха может сделать за запрос."""
+    def decorator(view_func):
+        view_func.query_budget = limit
+        return view_func
+    return decorator
+
+
+@contextmanager
+def uncounted():
+    """Не учитывать запросы блока: фоновая работа, выполненная на месте."""
+    previous = getattr(_state, 'paused', False)
+    _state.paused = True
+    try:
+        yield
+    finally:
+        _state.paused = previous
+
+
+def shape(sql):
+    """SQL без значений параметров: одинаков для запросов в цикле."""
+    sql = LITERAL.sub('?', sql)
+    sql = IN_LIST.sub('(...)', sql)
+    return SPACES.sub(' ', sql).strip()
+
+
+class QueryLog:
+    def __init__(self):
+        self.queries = []
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_state, 'paused', False):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    def __len__(self):
+        return len(self.queries)
+
+    def counted(self, ignore=()):
+        """Запросы без точек сохранения и без содержащих строку из `ignore`."""
+        return [
+            sql for sql, _ in self.queries
+            if not TRANSACTION.match(sql)
+            and not any(part in sql for part in ignore)
+        ]
+
+    def repeated(self, threshold, ignore=()):
+        """Формы запросов, выполненные не меньше `threshold` раз."""
+        counts = Counter(shape(sql) for sql in self.counted(ignore))
+        return [
+            (sql, count) for sql, count in counts.most_common()
+            if count >= threshold
+        ]
+
+    def problems(self, budget=None, repeat_threshold=None, ignore=()):
+        """Описания нарушений бюджета и повторов; пустой список — норма.
+
+        Запросы, содержащие строку из `ignore`, не учитываются.
+        """
+        problems = []
+        count = len(self.counted(ignore))
+        if budget is not None and count > budget:
+            problems.append('запросов: %s при бюджете %s' % (count, budget))
+        if repeat_threshold:
+            problems.extend(
+                'N+1, %s раз: %s' % (repeats, sql)
+                for sql, repeats in self.repeated(repeat_threshold, ignore)
+            )
+        return problems
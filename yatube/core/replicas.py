@@ -0,0 +1,119 @@
+"""Чтение с реплик базы и запись в основную.
+
+Реплика — копия файла SQLite основной базы, которую обновляет команда
+`sync_replicas` через backup API. Рядом с репликой лежит файл-отметка
+`<реплика>.synced`, время изменения которого — момент начала снимка:
+всё, что закоммичено раньше, в реплике есть.
+
+Запросы к вьюхам с `replica_reads` читают с реплики, только если она
+не старше всех записей, которые запрос должен увидеть:
+
+* изменений в пространствах имён кеша `REPLICA_FRESHNESS_NAMESPACES`
+  (`core.cache.get_last_changed`), иначе устаревшая страница попала
+  бы в кеш под новым поколением;
+* собственной последней записи читателя: её время лежит в cookie,
+  которую `ReplicaMiddleware` ставит после каждого POST.
+
+Иначе, как и при отставании больше `REPLICA_MAX_LAG`, чтение идёт в
+основную базу.
+"""
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+SYNCED_SUFFIX = '.synced'
+
+_state = threading.local()
+
+
+def replica_reads(view_func):
+    """Разрешает вьюхе читать с реплики; ставится на вьюхи без записи."""
+    view_func.replica_reads = True
+    return view_func
+
+
+def synced_at(path):
+    """Время снимка реплики в файле `path`; None, если снимка не было."""
+    try:
+        return os.stat(path + SYNCED_SUFFIX).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def choose_replica(fresh_since, now=None):
+    """Случайная реплика со снимком не раньше `fresh_since`."""
+    now = time.time() if now is None else now
+    fresh_since = max(fresh_since, now - settings.REPLICA_MAX_LAG)
+    fresh = []
+    for alias in settings.REPLICA_DATABASES:
+        synced = synced_at(settings.DATABASES[alias]['NAME'])
+        if synced is not None and synced >= fresh_since:
+            fresh.append(alias)
+    return random.choice(fresh) if fresh else None
+
+
+def read_from(alias):
+    """Направляет дальнейшие чтения потока в базу `alias`."""
+    _state.alias = alias
+
+
+@contextmanager
+def reading_from(alias):
+    """Направляет чтения блока в базу `alias` (None — в основную)."""
+    previous = getattr(_state, 'alias', None)
+    read_from(alias)
+    try:
+        yield
+    finally:
+        read_from(previous)
+
+
+class PrimaryReplicaRouter:
+    """Запись всегда в основную базу, чтение — куда велел `reading_from`.
+
+    Модели из `REPLICA_PRIMARY_APPS` (сессии, пользователи) читаются
+    только из основной базы: вход и выход не должны ждать реплики.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = getattr(_state, 'alias', None)
+        if alias and model._meta.app_label not in (
+            settings.REPLICA_PRIMARY_APPS
+        ):
+            return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Без явного ответа Django писал бы в базу, из которой объект
+        # прочитан, то есть в реплику.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def sync(source, target):
+    """Копирует базу `source` в `target` и ставит отметку снимка."""
+    started = time.time()
+    primary = sqlite3.connect(source, timeout=30)
+    replica = sqlite3.connect(target, timeout=30)
+    try:
+        primary.backup(replica)
+    finally:
+        replica.close()
+        primary.close()
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target) or '.')
+    os.close(fd)
+    os.utime(temp_path, (started, started))
+    os.replace(temp_path, target + SYNCED_SUFFIX)
+    return started
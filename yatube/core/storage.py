@@ -0,0 +1,58 @@
+"""Хранилище файлов с адресацией по содержимому.
+
+Файл сохраняется под SHA-256 своего содержимого, поэтому одинаковые
+загрузки занимают место на диске один раз и получают одно имя, а
+значит, и общие миниатюры sorl-thumbnail. Удалять такие файлы можно
+только когда на них больше никто не ссылается (см. `posts.blobs`).
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # Одинаковое имя означает одинаковое содержимое: суффиксы
+        # для «свободного» имени не нужны.
+        return name
+
+    def _save(self, name, content):
+        directory, basename = posixpath.split(name)
+        extension = os.path.splitext(basename)[1].lower()
+        full_directory = self.path(directory)
+        os.makedirs(full_directory, exist_ok=True)
+        # Хешируем и пишем за один проход во временный файл рядом
+        # с целевым каталогом, затем переименовываем атомарно.
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=full_directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            hexdigest = digest.hexdigest()
+            name = posixpath.join(
+                directory, hexdigest[:2], hexdigest + extension
+            )
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                os.remove(temp_path)
+                return name
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            # mkstemp создаёт файл с правами 0600, а медиа отдаёт
+            # веб-сервер.
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            # Параллельная запись того же файла безопасна: содержимое
+            # одинаковое, и replace лишь заменит его копией.
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
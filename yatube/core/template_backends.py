@@ -0,0 +1,23 @@
+from django.template.backends.django import DjangoTemplates, Template
+
+from core.metrics import timed
+
+
+class TimedTemplate(Template):
+    """Шаблон, время рендеринга которого идёт в фазу `template`."""
+
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Бэкенд Django-шаблонов с учётом времени для `core.metrics`."""
+
+    def from_string(self, template_code):
+        template = super().from_string(template_code)
+        return TimedTemplate(template.template, self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
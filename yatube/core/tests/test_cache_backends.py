@@ -0,0 +1,87 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from core.cache_backends import SQLiteCache
+
+
+def make_cache(path, **options):
+    return SQLiteCache(path, {'OPTIONS': options})
+
+
+def increment(path, times):
+    cache = make_cache(path)
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = make_cache(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_basic_operations(self):
+        """Базовые операции кеша"""
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(self.cache.get('key'), {'value': 1})
+        self.assertFalse(self.cache.add('key', 'other'))
+        self.assertTrue(self.cache.add('new', 'other'))
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(
+            self.cache.get_many(['a', 'b', 'missing']), {'a': 1, 'b': 2}
+        )
+        self.assertEqual(self.cache.incr('a', 5), 6)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.cache.set('expired', 1, timeout=-1)
+        self.assertFalse(self.cache.has_key('expired'))
+
+    def test_shared_between_instances(self):
+        """Две копии бэкенда видят общие данные"""
+        self.cache.set('shared', 'value')
+        self.assertEqual(make_cache(self.path).get('shared'), 'value')
+
+    def test_lru_eviction_by_entries(self):
+        """При превышении MAX_ENTRIES вытесняются давно не читавшиеся"""
+        cache = make_cache(self.path, MAX_ENTRIES=3, CULL_FREQUENCY=3)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, key)
+        cache._connection().execute(
+            "UPDATE cache SET accessed = 0 WHERE key LIKE '%a'"
+        )
+        cache.set('d', 'd')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('d'), 'd')
+
+    def test_eviction_by_size(self):
+        """Суммарный объём значений не превышает MAX_SIZE"""
+        cache = make_cache(self.path, MAX_SIZE=10000)
+        for index in range(20):
+            cache.set(index, 'x' * 1000)
+        entries, size = cache._connection().execute(
+            'SELECT entries, size FROM cache_stats'
+        ).fetchone()
+        self.assertLessEqual(size, 10000)
+        self.assertGreater(entries, 0)
+
+    def test_incr_is_process_safe(self):
+        """incr атомарен между процессами"""
+        self.cache.set('counter', 0)
+        workers = [
+            multiprocessing.Process(target=increment, args=(self.path, 50))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 200)
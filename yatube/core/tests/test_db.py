@@ -0,0 +1,71 @@
+import os
+import sqlite3
+import tempfile
+import threading
+
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase
+
+from core.db.base import DatabaseWrapper
+
+
+class PragmaTests(TestCase):
+    def test_connection_is_tuned(self):
+        """Новое соединение получает PRAGMA бэкенда"""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -64000)
+
+
+class LockRetryTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'db.sqlite3')
+        self.addCleanup(os.rmdir, directory)
+        self.addCleanup(os.remove, self.path)
+        self.blocker = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False
+        )
+        self.addCleanup(self.blocker.close)
+        self.blocker.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+
+    def make_wrapper(self, **options):
+        wrapper = DatabaseWrapper(dict(
+            connection.settings_dict, NAME=self.path, OPTIONS={
+                'pragmas': {'journal_mode': 'DELETE', 'busy_timeout': 0},
+                'lock_retry_delay': 0.02,
+                **options,
+            },
+        ), 'lock_test')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def lock_for(self, seconds):
+        self.blocker.execute('BEGIN EXCLUSIVE')
+        timer = threading.Timer(
+            seconds, self.blocker.execute, ['COMMIT']
+        )
+        timer.start()
+        self.addCleanup(timer.join)
+
+    def test_statement_is_retried_outside_transaction(self):
+        """Запрос вне транзакции дожидается снятия блокировки"""
+        wrapper = self.make_wrapper(lock_retries=5)
+        wrapper.ensure_connection()
+        self.lock_for(0.05)
+        with self.assertLogs('core.db.base', 'WARNING'):
+            with wrapper.cursor() as cursor:
+                cursor.execute('INSERT INTO item DEFAULT VALUES')
+                cursor.execute('SELECT COUNT(*) FROM item')
+                self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_lock_error_without_retries(self):
+        """Без повторов блокировка сразу даёт OperationalError"""
+        wrapper = self.make_wrapper(lock_retries=0)
+        wrapper.ensure_connection()
+        self.lock_for(0.05)
+        with self.assertRaisesMessage(OperationalError, 'locked'):
+            with wrapper.cursor() as cursor:
+                cursor.execute('INSERT INTO item DEFAULT VALUES')
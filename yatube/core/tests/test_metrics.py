@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from core import metrics
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+    def setUp(self):
+        for histogram in metrics.REGISTRY:
+            histogram.clear()
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram(
+            'test_seconds', 'Тест.', ('view',), buckets=(0.1, 1.0)
+        )
+        histogram.observe(0.05, view='a')
+        histogram.observe(0.5, view='a')
+        histogram.observe(5, view='a')
+        lines = histogram.expose()
+        self.assertIn('test_seconds_bucket{view="a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{view="a",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{view="a",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{view="a"} 3', lines)
+
+    def test_phases_do_not_overlap(self):
+        with metrics.request_timer() as timer:
+            with metrics.timed('template'):
+                with metrics.timed('db'):
+                    pass
+        total = timer.finish()
+        self.assertAlmostEqual(sum(timer.phases.values()), total, places=3)
+
+    def test_request_phases_exposed_per_view(self):
+        self.client.get('/')
+        response = self.client.get(
+            '/metrics/', HTTP_AUTHORIZATION='Bearer secret'
+        )
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn(
+            'yatube_request_seconds_count'
+            '{view="posts:index",method="GET",status="200"} 1',
+            content,
+        )
+        for phase in metrics.PHASES:
+            self.assertIn(
+                'yatube_request_phase_seconds_count'
+                '{view="posts:index",phase="%s"} 1' % phase,
+                content,
+            )
+
+    def test_metrics_hidden_without_token(self):
+        # За прокси на том же хосте любой запрос приходит с 127.0.0.1.
+        for headers in (
+            {'HTTP_X_FORWARDED_FOR': '203.0.113.7'},
+            {'HTTP_X_FORWARDED_FOR': '203.0.113.7',
+             'HTTP_AUTHORIZATION': 'Bearer wrong'},
+        ):
+            with self.subTest(headers=headers):
+                response = self.client.get(
+                    '/metrics/', REMOTE_ADDR='127.0.0.1', **headers
+                )
+                self.assertEqual(response.status_code, 404)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_metrics_disabled_without_configured_token(self):
+        response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer ')
+        self.assertEqual(response.status_code, 404)
+
+    def test_metrics_dumped_to_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'yatube-{pid}.prom')
+            with override_settings(METRICS_FILE=path):
+                self.client.get('/')
+            with open(path.format(pid=os.getpid())) as file:
+                self.assertIn('view="posts:index"', file.read())
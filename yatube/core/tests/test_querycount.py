@@ -0,0 +1,67 @@
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from core.middleware import QueryBudgetMiddleware
+from core.querycount import QueryBudgetExceeded, QueryLog, query_budget, shape
+
+User = get_user_model()
+
+
+def list_users(request):
+    # Каждый пользователь загружается отдельным запросом — N+1.
+    names = [User.objects.get(pk=pk).username
+             for pk in User.objects.values_list('pk', flat=True)]
+    return HttpResponse(', '.join(names))
+
+
+class QueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(5):
+            User.objects.create_user(username=f'user{number}')
+
+    def run_view(self, view):
+        middleware = QueryBudgetMiddleware(lambda request: view(request))
+        request = RequestFactory().get('/users/')
+        middleware.process_view(request, view, (), {})
+        return middleware(request)
+
+    def test_shape_ignores_parameters(self):
+        """Запросы с разными параметрами сводятся к одной форме"""
+        self.assertEqual(
+            shape("SELECT * FROM t WHERE id IN (%s, %s) AND name = 'a'"),
+            shape("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'b'")
+        )
+
+    def test_log_finds_repeated_queries(self):
+        """Журнал находит повторяющиеся формы запросов"""
+        with QueryLog() as log:
+            list_users(None)
+        self.assertEqual(len(log), 6)
+        [(_, count)] = log.repeated(threshold=5)
+        self.assertEqual(count, 5)
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_strict_middleware_raises_on_n_plus_one(self):
+        """В строгом режиме N+1 роняет запрос"""
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'N+1, 5 раз'):
+            self.run_view(list_users)
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_strict_middleware_raises_over_budget(self):
+        """В строгом режиме превышение бюджета вьюхи роняет запрос"""
+        view = query_budget(1)(
+            lambda request: HttpResponse(
+                [User.objects.count(), User.objects.count()]
+            )
+        )
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'бюджете 1'):
+            self.run_view(view)
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_middleware_logs_when_not_strict(self):
+        """Без строгого режима нарушение только пишется в лог"""
+        with self.assertLogs('core.middleware', 'WARNING'):
+            response = self.run_view(list_users)
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,97 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from core import replicas
+from core.cache import get_last_changed
+from core.middleware import ReplicaMiddleware
+from posts.models import Post
+
+User = get_user_model()
+
+
+@override_settings(REPLICA_DATABASES=['replica1'])
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.primary = os.path.join(self.directory, 'db.sqlite3')
+        self.replica = os.path.join(self.directory, 'replica.sqlite3')
+        connection = sqlite3.connect(self.primary)
+        connection.execute('CREATE TABLE item (name TEXT)')
+        connection.execute("INSERT INTO item VALUES ('первый')")
+        connection.commit()
+        connection.close()
+        databases = mock.patch.dict(
+            settings.DATABASES, replica1={'NAME': self.replica}
+        )
+        databases.start()
+        self.addCleanup(databases.stop)
+
+    def test_router_sends_only_reads_to_replica(self):
+        """Чтения идут в реплику, запись и пользователи — в основную"""
+        router = replicas.PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_read(Post), 'default')
+        with replicas.reading_from('replica1'):
+            self.assertEqual(router.db_for_read(Post), 'replica1')
+            self.assertEqual(router.db_for_read(User), 'default')
+            self.assertEqual(router.db_for_write(Post), 'default')
+        self.assertEqual(router.db_for_read(Post), 'default')
+        self.assertFalse(router.allow_migrate('replica1', 'posts'))
+
+    def test_sync_copies_database_and_marks_snapshot(self):
+        """sync_replicas копирует данные и ставит время снимка"""
+        self.assertIsNone(replicas.synced_at(self.replica))
+        started = replicas.sync(self.primary, self.replica)
+        self.assertEqual(replicas.synced_at(self.replica), started)
+        connection = sqlite3.connect(self.replica)
+        self.addCleanup(connection.close)
+        self.assertEqual(
+            connection.execute('SELECT name FROM item').fetchall(),
+            [('первый',)],
+        )
+
+    def test_only_fresh_replica_is_chosen(self):
+        """Реплика старее нужной записи или REPLICA_MAX_LAG не берётся"""
+        self.assertIsNone(replicas.choose_replica(0))
+        started = replicas.sync(self.primary, self.replica)
+        self.assertEqual(replicas.choose_replica(started - 1), 'replica1')
+        self.assertIsNone(replicas.choose_replica(started + 1))
+        self.assertIsNone(replicas.choose_replica(
+            0, now=started + settings.REPLICA_MAX_LAG + 1
+        ))
+
+    def test_middleware_routes_reads_and_marks_writes(self):
+        """GET вьюхи с replica_reads читает с реплики, POST ставит cookie"""
+        seen = []
+
+        @replicas.replica_reads
+        def view(request):
+            seen.append(getattr(replicas._state, 'alias', None))
+            return HttpResponse()
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = ReplicaMiddleware(get_response)
+        factory = RequestFactory()
+        get_last_changed('posts')
+        time.sleep(0.01)
+        replicas.sync(self.primary, self.replica)
+        middleware(factory.get('/'))
+        response = middleware(factory.post('/'))
+        written = response.cookies[settings.REPLICA_COOKIE_NAME].value
+        request = factory.get('/')
+        request.COOKIES[settings.REPLICA_COOKIE_NAME] = written
+        middleware(request)
+        self.assertEqual(seen, ['replica1', None, None])
+        self.assertIsNone(getattr(replicas._state, 'alias', None))
@@ -0,0 +1,11 @@
+from sorl.thumbnail.base import ThumbnailBackend
+
+from core.metrics import timed
+
+
+class TimedThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl-thumbnail, относящий свою работу к фазе `thumbnail`."""
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        with timed('thumbnail'):
+            return super().get_thumbnail(file_, geometry_string, **options)
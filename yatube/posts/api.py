@@ -0,0 +1,150 @@
+"""JSON API лент только для чтения.
+
+Ленты выбираются теми же querysets и курсорами, что и HTML-страницы,
+а посты отдаются словарями без рендеринга шаблонов. Ответы несут
+ETag и Last-Modified из поколений кеша (`core.cache`), так что опрос
+неизменившейся ленты отвечает 304 без обращения к базе.
+"""
+from django.conf import settings
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from core.cache import condition_by_generation
+from core.querycount import query_budget
+from core.replicas import replica_reads
+
+from . import feeds
+from .models import Group, User
+from .paginators import CursorPaginator
+from .signals import POSTS_NAMESPACE
+from .timeline import TimelinePaginator
+from .views import feed_namespaces
+
+POST_FIELDS = (
+    'pk', 'text', 'pub_date', 'updated', 'image', 'comments_count',
+    'author__username', 'group__slug',
+)
+
+
+def serialize_post(post):
+    return {
+        'id': post.pk,
+        'text': post.text,
+        'pub_date': post.pub_date.isoformat(),
+        'updated': post.updated.isoformat(),
+        'author': post.author.username,
+        'group': post.group.slug if post.group_id else None,
+        'image': post.image.url if post.image else None,
+        'comments_count': post.comments_count,
+        'url': reverse('api:post_detail', args=[post.pk]),
+    }
+
+
+def serialize_comment(comment):
+    return {
+        'id': comment.pk,
+        'author': comment.author.username,
+        'text': comment.text,
+        'created': comment.created.isoformat(),
+    }
+
+
+def page_links(request, page):
+    """Ссылки на соседние страницы с сохранением остальных параметров."""
+    query = request.GET.copy()
+    for name in ('page', 'after', 'before'):
+        query.pop(name, None)
+    links = {}
+    for name, key, cursor in (
+        ('next', 'after', page.next_cursor),
+        ('previous', 'before', page.previous_cursor),
+    ):
+        links[name] = None
+        if cursor is not None:
+            query[key] = cursor
+            links[name] = '%s?%s' % (request.path, query.urlencode())
+            del query[key]
+    return links
+
+
+def feed_response(request, posts, paginator_class=CursorPaginator,
+                  **kwargs):
+    paginator = paginator_class(
+        posts.only(*POST_FIELDS),
+        settings.POSTS_AMOUNT,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        **kwargs
+    )
+    page = paginator.get_page()
+    return JsonResponse({
+        'results': [serialize_post(post) for post in page],
+        **page_links(request, page),
+    })
+
+
+@query_budget(2)
+@replica_reads
+@condition_by_generation([POSTS_NAMESPACE], key_prefix='api')
+def index(request):
+    return feed_response(request, feeds.index_feed())
+
+
+@query_budget(3)
+@replica_reads
+@condition_by_generation([POSTS_NAMESPACE], key_prefix='api')
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return feed_response(request, feeds.group_feed(group))
+
+
+@query_budget(3)
+@replica_reads
+@condition_by_generation([POSTS_NAMESPACE], key_prefix='api')
+def profile(request, username):
+    author = get_object_or_404(User, username=username)
+    return feed_response(request, feeds.profile_feed(author))
+
+
+@query_budget(3)
+@replica_reads
+@condition_by_generation([POSTS_NAMESPACE], key_prefix='api')
+def post_detail(request, post_id):
+    post = get_object_or_404(
+        feeds.index_feed().only(*POST_FIELDS), pk=post_id
+    )
+    comments = CursorPaginator(
+        feeds.post_comments(post),
+        settings.COMMENTS_AMOUNT,
+        after=request.GET.get('after'),
+        ordering=feeds.COMMENT_ORDERING,
+    ).get_page()
+    next_comments = None
+    if comments.next_cursor is not None:
+        next_comments = '%s?%s' % (
+            request.path, urlencode({'after': comments.next_cursor})
+        )
+    return JsonResponse({
+        **serialize_post(post),
+        'comments': [serialize_comment(comment) for comment in comments],
+        'next_comments': next_comments,
+    })
+
+
+@query_budget(6)
+@replica_reads
+def follow_index(request):
+    # Без входа API отвечает 401, а не редиректом на форму входа.
+    if not request.user.is_authenticated:
+        return JsonResponse({'detail': 'Требуется вход.'}, status=401)
+    return _follow_index(request)
+
+
+@condition_by_generation(feed_namespaces, key_prefix='api')
+def _follow_index(request):
+    return feed_response(
+        request, feeds.follow_feed(request.user), TimelinePaginator,
+        user=request.user,
+    )
@@ -0,0 +1,505 @@
+"""Нагрузочные замеры лент и страницы поста.
+
+`seed` заполняет базу синтетическим набором данных заданного объёма:
+популярность авторов распределена по закону Ципфа, поэтому в графе
+подписок есть и «знаменитости», и читатель с глубокой лентой, а у
+нескольких свежих постов тысячи комментариев. `run` прогоняет
+сценарии через тестовый клиент Django или по HTTP на запущенный
+сервер и считает задержку p50/p99, SQL-запросы на запрос и
+пропускную способность. `compare` сверяет результат с базовым файлом,
+чтобы CI замечал регрессии. `contention` нагружает базу параллельными
+читателями ленты и авторами комментариев, чтобы сравнить настройки
+SQLite (`core.db`) с настройками по умолчанию.
+"""
+import json
+import math
+import random
+import threading
+import time
+from itertools import accumulate, count
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlencode
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import (DatabaseError, close_old_connections, connection,
+                       connections, transaction)
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from faker import Faker
+
+from core.querycount import QueryLog
+
+from . import feeds
+from .bulk import batches, explicit_dates, finish
+from .models import Comment, Follow, Group, Post, UserStats
+
+User = get_user_model()
+
+PREFIX = 'bench'
+USERNAME = PREFIX + '{:07d}'
+PASSWORD = 'benchmark'
+# Тексты берутся из заранее сгенерированного набора: Faker на каждый
+# из миллионов постов тратил бы больше времени, чем сама запись.
+TEXTS = 1000
+# Разница меньше миллисекунды — шум даже для закешированных страниц.
+LATENCY_SLACK_MS = 1.0
+# Настройки `core.db`, равные поведению стандартного бэкенда sqlite3:
+# журнал отката, полная синхронизация, отложенные транзакции, без
+# повторов.
+PLAIN_SQLITE_OPTIONS = {
+    'pragmas': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+    },
+    'transaction_mode': 'DEFERRED',
+    'lock_retries': 0,
+}
+
+# `uncached`: вьюха за `cache_page`, поэтому каждый запрос идёт по
+# новому адресу, иначе замерялись бы только попадания в кеш страниц.
+Scenario = namedtuple(
+    'Scenario', 'name url login uncached', defaults=(False,)
+)
+_samples = count()
+
+
+def _zipf(count):
+    """Накопленные веса закона Ципфа для `random.choices`."""
+    return list(accumulate(1 / rank for rank in range(1, count + 1)))
+
+
+def _sample(rng, population, cum_weights, count, exclude):
+    """`count` разных элементов с весами, без `exclude`."""
+    count = min(count, len(population) - 1)
+    chosen = set()
+    while len(chosen) < count:
+        chosen.update(rng.choices(
+            population, cum_weights=cum_weights, k=count - len(chosen)
+        ))
+        chosen.discard(exclude)
+    return chosen
+
+
+def seed(users=2000, groups=20, posts=50000, follows=50, reader_follows=500,
+         heavy_posts=5, comments=2000, days=365, batch_size=2000,
+         random_seed=0):
+    """Заполняет базу набором данных; возвращает размеры таблиц.
+
+    Первый пользователь — читатель сценария `follow_index`, он
+    подписан на `reader_follows` авторов. Сигналы при массовой
+    загрузке не срабатывают, поэтому счётчики и ленты подписок
+    пересчитываются в конце.
+    """
+    rng = random.Random(random_seed)
+    fake = Faker('ru_RU')
+    fake.seed_instance(random_seed)
+    texts = [fake.text(max_nb_chars=400) for _ in range(TEXTS)]
+    password = make_password(PASSWORD)
+    new_users = (
+        User(
+            username=USERNAME.format(number), password=password,
+            first_name=fake.first_name(), last_name=fake.last_name(),
+        )
+        for number in range(users)
+    )
+    for batch in batches(new_users, batch_size):
+        User.objects.bulk_create(batch)
+    # bulk_create в SQLite не возвращает первичные ключи.
+    user_ids = list(
+        User.objects.filter(username__startswith=PREFIX)
+        .order_by('username').values_list('pk', flat=True)
+    )
+    Group.objects.bulk_create(
+        Group(
+            title=fake.catch_phrase()[:200], slug=f'{PREFIX}-{number}',
+            description=fake.text(max_nb_chars=200),
+        )
+        for number in range(groups)
+    )
+    group_ids = list(
+        Group.objects.filter(slug__startswith=PREFIX + '-')
+        .values_list('pk', flat=True)
+    )
+    # Популярный автор и пишет больше, и читают его чаще.
+    weights = _zipf(len(user_ids))
+    group_weights = _zipf(len(group_ids))
+
+    new_follows = (
+        Follow(user_id=user_id, author_id=author_id)
+        for number, user_id in enumerate(user_ids)
+        for author_id in _sample(
+            rng, user_ids, weights,
+            reader_follows if number == 0 else follows, user_id,
+        )
+    )
+    for batch in batches(new_follows, batch_size):
+        Follow.objects.bulk_create(batch)
+
+    now = timezone.now()
+    start = now - timedelta(days=days)
+    step = (now - start) / max(posts, 1)
+
+    def make_posts():
+        for number in range(posts):
+            pub_date = start + step * number
+            yield Post(
+                text=rng.choice(texts),
+                author_id=rng.choices(user_ids, cum_weights=weights)[0],
+                group_id=(
+                    rng.choices(group_ids, cum_weights=group_weights)[0]
+                    if group_ids and rng.random() < 0.7 else None
+                ),
+                pub_date=pub_date,
+                updated=pub_date,
+            )
+
+    with explicit_dates(Post, Comment):
+        for batch in batches(make_posts(), batch_size):
+            Post.objects.bulk_create(batch)
+        heavy = Post.objects.order_by('-pub_date', '-pk')[:heavy_posts]
+
+        def make_comments():
+            for post in heavy:
+                for number in range(comments):
+                    yield Comment(
+                        post=post,
+                        author_id=rng.choice(user_ids),
+                        text=rng.choice(texts)[:200],
+                        created=post.pub_date + timedelta(seconds=number),
+                    )
+
+        for batch in batches(make_comments(), batch_size):
+            Comment.objects.bulk_create(batch)
+
+    return finish()
+
+
+def dataset():
+    """Размеры таблиц: результаты на разных данных несравнимы."""
+    return {
+        'users': User.objects.count(),
+        'posts': Post.objects.count(),
+        'comments': Comment.objects.count(),
+        'follows': Follow.objects.count(),
+    }
+
+
+def scenarios():
+    """Сценарии на самых тяжёлых объектах набора данных."""
+    group = Group.objects.order_by('-posts_count').first()
+    author = UserStats.objects.select_related('user').order_by(
+        '-posts_count'
+    ).first()
+    post = Post.objects.order_by('-comments_count').first()
+    if group is None or author is None or post is None:
+        raise ValueError('Нет данных для замеров; запустите seed_benchmark.')
+    return [
+        Scenario('posts:index', reverse('posts:index'), False, True),
+        Scenario(
+            'posts:group_list',
+            reverse('posts:group_list', args=[group.slug]), False, True,
+        ),
+        Scenario(
+            'posts:profile',
+            reverse('posts:profile', args=[author.user.username]), False,
+        ),
+        Scenario(
+            'posts:post_detail',
+            reverse('posts:post_detail', args=[post.pk]), False,
+        ),
+        Scenario('posts:follow_index', reverse('posts:follow_index'), True),
+    ]
+
+
+class ClientSession:
+    """Запросы через тестовый клиент Django в этом же процессе."""
+
+    def __init__(self, login):
+        self.client = Client()
+        if login:
+            self.client.force_login(User.objects.get(
+                username=USERNAME.format(0)
+            ))
+
+    def get(self, url):
+        with QueryLog() as log:
+            response = self.client.get(url)
+        return response.status_code, len(
+            log.counted(settings.QUERY_BUDGET_IGNORE)
+        )
+
+    def close(self):
+        close_old_connections()
+
+
+class HTTPSession:
+    """Запросы по HTTP к запущенному серверу.
+
+    Число SQL-запросов известно, только если сервер отдаёт заголовок
+    `X-Query-Count` (при `DEBUG`).
+    """
+
+    def __init__(self, base_url, login):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        if login:
+            url = self.base_url + reverse('users:login')
+            self.session.get(url)
+            self.session.post(url, data={
+                'username': USERNAME.format(0),
+                'password': PASSWORD,
+                'csrfmiddlewaretoken': self.session.cookies.get('csrftoken'),
+            })
+
+    def get(self, url):
+        response = self.session.get(self.base_url + url)
+        queries = response.headers.get('X-Query-Count')
+        return response.status_code, (
+            int(queries) if queries is not None else None
+        )
+
+    def close(self):
+        self.session.close()
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу."""
+    values = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def sample_url(scenario):
+    """Адрес очередного запроса сценария."""
+    if not scenario.uncached:
+        return scenario.url
+    # Лишний параметр вьюхи не читают, но он входит в ключ cache_page.
+    return '%s?%s' % (scenario.url, urlencode({'sample': next(_samples)}))
+
+
+def _worker(make_session, scenario, warmup, requests_count, barrier=None):
+    session = make_session(scenario.login)
+    try:
+        for _ in range(warmup):
+            session.get(sample_url(scenario))
+        if barrier is not None:
+            barrier.wait()
+        started = time.perf_counter()
+        samples = []
+        for _ in range(requests_count):
+            url = sample_url(scenario)
+            sent = time.perf_counter()
+            status, queries = session.get(url)
+            samples.append((time.perf_counter() - sent, status, queries))
+        return started, time.perf_counter(), samples
+    finally:
+        session.close()
+
+
+def measure(make_session, scenario, requests_count, warmup, concurrency):
+    """Замер одного сценария: `concurrency` потоков делят запросы."""
+    if concurrency == 1:
+        # В этом же потоке: данные незакоммиченной транзакции (например,
+        # в TestCase) видит только его соединение.
+        runs = [_worker(make_session, scenario, warmup, requests_count)]
+    else:
+        barrier = threading.Barrier(concurrency)
+        shares = [
+            requests_count // concurrency
+            + (1 if number < requests_count % concurrency else 0)
+            for number in range(concurrency)
+        ]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(
+                    _worker, make_session, scenario, warmup, share, barrier
+                )
+                for share in shares
+            ]
+            runs = [future.result() for future in futures]
+    elapsed = (
+        max(finished for _, finished, _ in runs)
+        - min(started for started, _, _ in runs)
+    )
+    samples = [sample for _, _, samples in runs for sample in samples]
+    latencies = [latency for latency, _, _ in samples]
+    queries = [count for _, _, count in samples if count is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, status, _ in samples if status != 200),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'queries': (
+            round(sum(queries) / len(queries), 1) if queries else None
+        ),
+        'rps': round(len(samples) / elapsed, 1),
+    }
+
+
+def run(requests_count=200, warmup=10, concurrency=1, base_url=None,
+        names=None):
+    """Прогоняет сценарии; возвращает результаты по имени сценария.
+
+    Без `base_url` запросы идут через тестовый клиент с `DEBUG=False`,
+    как в продакшене: с `DEBUG` Django копит каждый SQL-запрос в
+    памяти соединения.
+    """
+    if base_url:
+        def make_session(login):
+            return HTTPSession(base_url, login)
+    else:
+        make_session = ClientSession
+    results = {}
+    with override_settings(DEBUG=bool(base_url) and settings.DEBUG):
+        for scenario in scenarios():
+            if names and scenario.name not in names:
+                continue
+            results[scenario.name] = measure(
+                make_session, scenario, requests_count, warmup, concurrency
+            )
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Регрессии относительно `baseline`; пустой список — норма.
+
+    Число запросов не должно расти вовсе, p50 — больше чем в
+    `1 + tolerance` раз: время сильнее зависит от машины. Хвост p99
+    шумнее, ему допуск вдвое больше.
+    """
+    problems = []
+    for name, result in results.items():
+        if result['errors']:
+            problems.append(f'{name}: ошибок {result["errors"]}')
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if (
+            result['queries'] is not None and base['queries'] is not None
+            and result['queries'] > base['queries']
+        ):
+            problems.append(
+                f'{name}: запросов {result["queries"]} '
+                f'вместо {base["queries"]}'
+            )
+        for key, allowed in (('p50_ms', tolerance), ('p99_ms', 2 * tolerance)):
+            limit = base[key] * (1 + allowed) + LATENCY_SLACK_MS
+            if result[key] > limit:
+                problems.append(
+                    f'{name}: {key} {result[key]} при базовом {base[key]}'
+                )
+    return problems
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_baseline(path, results):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(
+            {'dataset': dataset(), 'results': results},
+            file, ensure_ascii=False, indent=2, sort_keys=True,
+        )
+        file.write('\n')
+
+
+@contextmanager
+def database_options(options):
+    """Временно подменяет `OPTIONS` базы по умолчанию.
+
+    Соединения закрываются до и после, чтобы новые открылись с
+    нужными PRAGMA; потоки открывают свои по тем же настройкам.
+    """
+    settings_dict = connection.settings_dict
+    saved = settings_dict['OPTIONS']
+    connection.close()
+    settings_dict['OPTIONS'] = options
+    try:
+        yield
+    finally:
+        connection.close()
+        settings_dict['OPTIONS'] = saved
+
+
+def _contention_worker(action, deadline, barrier):
+    latencies, errors = [], 0
+    try:
+        barrier.wait()
+        while time.perf_counter() < deadline:
+            sent = time.perf_counter()
+            try:
+                action()
+            except DatabaseError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - sent)
+        return latencies, errors
+    finally:
+        connections.close_all()
+
+
+def _role_result(runs, seconds):
+    latencies = [value for values, _ in runs for value in values]
+    return {
+        'ops': len(latencies),
+        'ops_per_s': round(len(latencies) / seconds, 1),
+        'p99_ms': (
+            round(percentile(latencies, 99) * 1000, 2) if latencies else None
+        ),
+        'errors': sum(errors for _, errors in runs),
+    }
+
+
+def contention(readers=4, writers=2, seconds=5.0, random_seed=0):
+    """Параллельные чтения ленты и записи комментариев за `seconds`.
+
+    Читатель выбирает первую страницу главной, писатель добавляет
+    комментарий в транзакции, как `add_comment`. Созданные
+    комментарии в конце удаляются.
+    """
+    rng = random.Random(random_seed)
+    post_ids = list(
+        Post.objects.order_by('-pk').values_list('pk', flat=True)[:100]
+    )
+    user_ids = list(User.objects.values_list('pk', flat=True)[:100])
+    if not post_ids or not user_ids:
+        raise ValueError('Нет данных для замеров; запустите seed_benchmark.')
+    created = []
+
+    def read():
+        list(feeds.index_feed()[:settings.POSTS_AMOUNT])
+
+    def write():
+        with transaction.atomic():
+            created.append(Comment.objects.create(
+                post_id=rng.choice(post_ids),
+                author_id=rng.choice(user_ids),
+                text='benchmark',
+            ).pk)
+
+    barrier = threading.Barrier(readers + writers)
+    deadline = time.perf_counter() + seconds
+    with ThreadPoolExecutor(max_workers=readers + writers) as executor:
+        futures = [
+            executor.submit(_contention_worker, action, deadline, barrier)
+            for action in [read] * readers + [write] * writers
+        ]
+        runs = [future.result() for future in futures]
+    for batch in batches(created, 500):
+        Comment.objects.filter(pk__in=batch).delete()
+    return {
+        'readers': _role_result(runs[:readers], seconds),
+        'writers': _role_result(runs[readers:], seconds),
+    }
@@ -0,0 +1,73 @@
+"""Счётчики ссылок на файлы картинок постов.
+
+Картинки хранятся по хешу содержимого (`core.storage`), и один файл
+может принадлежать многим постам. Сигналы `Post` увеличивают и
+уменьшают счётчик в `MediaBlob`; файл без ссылок удаляется вместе с
+миниатюрами sorl-thumbnail после коммита транзакции.
+"""
+import logging
+
+from django.apps import apps as global_apps
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from sorl.thumbnail import delete as delete_with_thumbnails
+from sorl.thumbnail.images import ImageFile
+
+from .models import MediaBlob, media_storage
+
+logger = logging.getLogger(__name__)
+
+
+def acquire(name):
+    if not name:
+        return
+    if MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1):
+        return
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(name=name, refcount=1)
+    except IntegrityError:
+        # Ту же картинку только что загрузили в другом запросе.
+        MediaBlob.objects.filter(name=name).update(
+            refcount=F('refcount') + 1
+        )
+
+
+def release(name):
+    if not name:
+        return
+    MediaBlob.objects.filter(name=name, refcount__gt=0).update(
+        refcount=F('refcount') - 1
+    )
+    transaction.on_commit(lambda: collect(name))
+
+
+def collect(name):
+    """Удаляет файл `name`, если на него больше нет ссылок."""
+    deleted, _ = MediaBlob.objects.filter(name=name, refcount=0).delete()
+    if deleted:
+        try:
+            delete_with_thumbnails(ImageFile(name, media_storage))
+        except Exception:
+            # Пост уже удалён; потерянный файл не повод для ошибки 500.
+            logger.exception('Не удалось удалить файл %s', name)
+
+
+def recount(apps=global_apps):
+    """Пересчитывает ссылки по таблице постов; возвращает число файлов.
+
+    Принимает реестр моделей, чтобы работать и из миграций.
+    """
+    Post = apps.get_model('posts', 'Post')
+    MediaBlob = apps.get_model('posts', 'MediaBlob')
+    counts = (
+        Post.objects.exclude(image='').order_by()
+        .values_list('image').annotate(refcount=Count('pk'))
+    )
+    with transaction.atomic():
+        MediaBlob.objects.all().delete()
+        blobs = MediaBlob.objects.bulk_create(
+            MediaBlob(name=name, refcount=refcount)
+            for name, refcount in counts
+        )
+    return len(blobs)
@@ -0,0 +1,63 @@
+"""Массовая запись постов в обход ORM-сигналов.
+
+`bulk_create` не отправляет `post_save`, поэтому счётчики, ссылки на
+файлы картинок, ленты подписок и поколение кеша после загрузки
+приводятся в порядок одним вызовом `finish`.
+"""
+from contextlib import contextmanager
+
+from django.db import transaction
+
+from core.cache import bump_generation
+
+from . import blobs, timeline
+from .counters import recount
+from .signals import POSTS_NAMESPACE
+
+
+@contextmanager
+def explicit_dates(*models):
+    """Не подставлять текущее время в поля `auto_now`/`auto_now_add`."""
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False)
+        or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def batches(objects, size):
+    """Списки по `size` элементов: память не растёт с размером потока.
+
+    Число строк в одном INSERT Django выбирает сам с учётом лимитов
+    SQLite на число параметров.
+    """
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def finish(author_ids=None):
+    """Пересчитывает всё, что поддерживают сигналы; возвращает размеры.
+
+    С `author_ids` ленты подписок дополняются только постами этих
+    авторов, без — перестраиваются целиком.
+    """
+    with transaction.atomic():
+        sizes = recount()
+        sizes['media_blobs'] = blobs.recount()
+        sizes['timeline_entries'] = timeline.rebuild(author_ids)
+        bump_generation(POSTS_NAMESPACE)
+    return sizes
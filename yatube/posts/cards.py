@@ -0,0 +1,104 @@
+"""Кеш отрендеренных карточек постов.
+
+Ключ карточки содержит id поста, время его последнего изменения,
+версию карточки, число комментариев и отпечаток имени автора и
+названия группы, поэтому `post_edit`, `add_comment`, удаление
+комментариев, новые варианты картинки и переименования инвалидируют
+карточку без явного удаления. Страница ленты собирается одним
+`get_many` к кешу, рендерятся только отсутствующие в нём карточки;
+последние комментарии для них читаются двумя запросами на страницу.
+"""
+import hashlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+
+from .feeds import COMMENT_ORDERING, latest_comment_ids
+from .models import Comment
+
+CARD_TEMPLATE = 'posts/includes/post_card.html'
+CARD_KEY = (
+    'post_card:{variant}:{language}:{pk}:{version}.{revision}:{comments}:'
+    '{names}'
+)
+
+
+def names_digest(post):
+    """Отпечаток показанных в карточке имён автора и группы.
+
+    У пользователей и групп нет времени изменения, а карточки живут
+    дольше страниц лент.
+    """
+    group = post.group
+    names = [
+        post.author.username, post.author.get_full_name(),
+        group.slug if group else '', group.title if group else '',
+    ]
+    return hashlib.sha1('\n'.join(names).encode()).hexdigest()[:16]
+
+
+def card_key(post, variant):
+    return CARD_KEY.format(
+        variant=variant,
+        language=get_language(),
+        pk=post.pk,
+        version=post.updated.timestamp(),
+        revision=post.revision,
+        comments=post.comments_count,
+        names=names_digest(post),
+    )
+
+
+def prefetch_latest_comments(posts):
+    """Кладёт в `post.latest_comments` последние комментарии постов."""
+    by_post = defaultdict(list)
+    with_comments = [post.pk for post in posts if post.comments_count]
+    if with_comments:
+        ids = [
+            pk for row in latest_comment_ids(
+                with_comments, settings.POST_CARD_COMMENTS
+            )
+            for pk in row if pk is not None
+        ]
+        comments = Comment.objects.filter(pk__in=ids).select_related(
+            'author'
+        ).order_by(*COMMENT_ORDERING)
+        for comment in comments:
+            by_post[comment.post_id].append(comment)
+    for post in posts:
+        post.latest_comments = by_post[post.pk]
+
+
+def attach_cards(posts, **flags):
+    """Кладёт в `post.card_html` HTML карточки каждого поста.
+
+    `flags` передаются в шаблон карточки (`profile`, `group_list`)
+    и входят в ключ кеша.
+    """
+    variant = ','.join(sorted(name for name, on in flags.items() if on))
+    keys = {card_key(post, variant or 'feed'): post for post in posts}
+    cards = cache.get_many(list(keys))
+    # Варианты картинок нужны только карточкам, которых нет в кеше.
+    prefetch_related_objects(
+        [post for key, post in keys.items()
+         if key not in cards and post.image],
+        'image_variants',
+    )
+    prefetch_latest_comments(
+        [post for key, post in keys.items() if key not in cards]
+    )
+    missing = {}
+    for key, post in keys.items():
+        if key not in cards:
+            cards[key] = missing[key] = render_to_string(
+                CARD_TEMPLATE, {'post': post, **flags}
+            )
+        post.card_html = mark_safe(cards[key])
+    if missing:
+        cache.set_many(missing, settings.POST_CARD_CACHE_TIMEOUT)
+    return posts
@@ -0,0 +1,129 @@
+"""Денормализованные счётчики постов, комментариев и подписок.
+
+Счётчики меняются UPDATE-запросами с F-выражениями в той же
+транзакции, что и сама запись, поэтому конкурентные запросы не
+затирают значения друг друга. `recount` пересчитывает всё заново.
+"""
+from django.apps import apps as global_apps
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Group, Post, UserStats
+
+
+def _bump(queryset, **deltas):
+    # Счётчик не уходит ниже нуля: расхождение исправит `recount`.
+    return queryset.filter(**{
+        '%s__gte' % field: -delta
+        for field, delta in deltas.items() if delta < 0
+    }).update(**{
+        field: F(field) + delta for field, delta in deltas.items()
+    })
+
+
+def bump_user(user_id, **deltas):
+    """Меняет счётчики пользователя; строку создаёт только при росте.
+
+    При удалении пользователя каскад стирает его UserStats раньше, чем
+    его посты и подписки, так что их уменьшения ничего не находят и
+    ничего не создают.
+    """
+    if not _bump(UserStats.objects.filter(user_id=user_id), **deltas):
+        if min(deltas.values()) > 0:
+            UserStats.objects.get_or_create(user_id=user_id)
+            _bump(UserStats.objects.filter(user_id=user_id), **deltas)
+
+
+def bump_group(group_id, delta):
+    if group_id is not None:
+        _bump(Group.objects.filter(pk=group_id), posts_count=delta)
+
+
+def post_added(post):
+    bump_user(post.author_id, posts_count=1)
+    bump_group(post.group_id, 1)
+
+
+def post_removed(post):
+    bump_user(post.author_id, posts_count=-1)
+    bump_group(post.group_id, -1)
+
+
+def post_moved(post, old_group_id):
+    if old_group_id != post.group_id:
+        bump_group(old_group_id, -1)
+        bump_group(post.group_id, 1)
+
+
+def comment_added(comment):
+    _bump(Post.objects.filter(pk=comment.post_id), comments_count=1)
+
+
+def comment_removed(comment):
+    # Версия поста входит в ключ карточки (`cards.card_key`): после
+    # удаления и нового комментария число осталось бы прежним, а превью
+    # показывало бы удалённый комментарий.
+    Post.objects.filter(pk=comment.post_id, comments_count__gte=1).update(
+        comments_count=F('comments_count') - 1, revision=F('revision') + 1
+    )
+
+
+def follow_added(follow):
+    bump_user(follow.user_id, following_count=1)
+    bump_user(follow.author_id, followers_count=1)
+
+
+def follow_removed(follow):
+    bump_user(follow.user_id, following_count=-1)
+    bump_user(follow.author_id, followers_count=-1)
+
+
+def user_stats(user):
+    """Счётчики пользователя; для новых пользователей — нули."""
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        return UserStats(user=user)
+
+
+def _count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    ), 0)
+
+
+def recount(apps=global_apps):
+    """Пересчитывает все счётчики несколькими UPDATE-запросами.
+
+    Принимает реестр моделей, чтобы работать и из миграций.
+    """
+    User = apps.get_model('auth', 'User')
+    Post = apps.get_model('posts', 'Post')
+    Group = apps.get_model('posts', 'Group')
+    Comment = apps.get_model('posts', 'Comment')
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+    UserStats.objects.bulk_create(
+        (UserStats(user_id=pk) for pk in User.objects.filter(
+            stats__isnull=True
+        ).values_list('pk', flat=True)),
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+    return {
+        'posts': Post.objects.update(
+            comments_count=_count(Comment, 'post')
+        ),
+        'groups': Group.objects.update(posts_count=_count(Post, 'group')),
+        # Первичный ключ UserStats — это user_id, поэтому OuterRef('pk')
+        # в подзапросах указывает на пользователя.
+        'users': UserStats.objects.update(
+            posts_count=_count(Post, 'author'),
+            followers_count=_count(Follow, 'author'),
+            following_count=_count(Follow, 'user'),
+        ),
+    }
@@ -0,0 +1,53 @@
+"""Запросы лент постов.
+
+Вьюхи и команда `explain_feeds` берут querysets отсюда, чтобы план
+запроса проверялся ровно для того, что выполняется на страницах.
+"""
+from django.db.models import OuterRef, Subquery
+
+from .models import Comment, Post
+
+# Комментарии листаются курсором от новых к старым по индексу
+# `comment_post_created_idx`.
+COMMENT_ORDERING = ('-created', '-pk')
+
+
+def index_feed():
+    return Post.objects.select_related('author', 'group')
+
+
+def group_feed(group):
+    return group.posts.select_related('author', 'group')
+
+
+def profile_feed(author):
+    return author.posts.select_related('author', 'group')
+
+
+def follow_feed(user):
+    return Post.objects.filter(
+        author__following__user=user
+    ).select_related('author', 'group')
+
+
+def post_comments(post):
+    return post.comments.select_related('author')
+
+
+def latest_comment_ids(post_ids, limit):
+    """Id последних `limit` комментариев каждого поста, строка на пост.
+
+    Каждый столбец — скалярный подзапрос с LIMIT 1 OFFSET n по индексу
+    `comment_post_created_idx`, так что пост с тысячами комментариев
+    стоит столько же, сколько пост с одним.
+    """
+    latest = Comment.objects.filter(post=OuterRef('pk')).order_by(
+        *COMMENT_ORDERING
+    ).values('pk')
+    columns = {
+        'comment_%s' % number: Subquery(latest[number:number + 1])
+        for number in range(limit)
+    }
+    return Post.objects.filter(pk__in=post_ids).order_by().annotate(
+        **columns
+    ).values_list(*columns)
@@ -0,0 +1,138 @@
+"""Граф подписок читателя.
+
+Множество id авторов, на которых подписан пользователь, читается
+из базы один раз и хранится в кеше под версионным ключом. Подписка
+и отписка увеличивают поколение (`core.cache`), поэтому старое
+множество просто перестаёт читаться и вытесняется кешем само.
+
+`follow` и `unfollow` меняют подписку одним запросом, без гонки
+«прочитать, затем записать»: параллельные клики упираются в
+уникальность пары (user, author). Сигналы `post_save`/`post_delete`
+отправляются вручную и только для реально изменённых строк, так что
+счётчики и ленты обновляются как при `save()`/`delete()`.
+"""
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+
+from core.cache import bump_generation, get_generation
+
+from .models import Follow, User
+
+IDS_KEY = 'follow_graph:ids:{user_id}:{version}'
+USER_ID_KEY = 'follow_graph:user_id:{username}'
+# Переименование в обход сигналов (update(), SQL) забудется само.
+USER_ID_TIMEOUT = 60 * 60
+
+
+def namespace(user_id):
+    return 'follow_graph:%s' % user_id
+
+
+def followers_namespace(author_id):
+    # Меняется, когда на автора подписываются или отписываются:
+    # от этого зависит число подписчиков в его профиле.
+    return 'followers:%s' % author_id
+
+
+def user_id(username):
+    """Id пользователя по имени или None; найденное хранится в кеше."""
+    key = USER_ID_KEY.format(username=username)
+    pk = cache.get(key)
+    if pk is None:
+        pk = User.objects.filter(username=username).values_list(
+            'pk', flat=True
+        ).first()
+        if pk is not None:
+            cache.set(key, pk, USER_ID_TIMEOUT)
+    return pk
+
+
+def forget_user(username):
+    cache.delete(USER_ID_KEY.format(username=username))
+
+
+def get_version(user_id):
+    return get_generation(namespace(user_id))
+
+
+def invalidate(user_id, author_id):
+    bump_generation(namespace(user_id), followers_namespace(author_id))
+
+
+def _execute(sql, user_id, author_id):
+    table = connection.ops.quote_name(Follow._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(sql % table, [user_id, author_id])
+        return [pk for pk, in cursor.fetchall()]
+
+
+def follow(user_id, author_id):
+    """Подписывает читателя на автора; True, если подписки не было."""
+    created = _execute(
+        'INSERT INTO %s (user_id, author_id) VALUES (%%s, %%s) '
+        'ON CONFLICT (user_id, author_id) DO NOTHING RETURNING id',
+        user_id, author_id,
+    )
+    for pk in created:
+        post_save.send(
+            sender=Follow, created=True, update_fields=None, raw=False,
+            using=connection.alias,
+            instance=Follow(pk=pk, user_id=user_id, author_id=author_id),
+        )
+    return bool(created)
+
+
+def unfollow(user_id, author_id):
+    """Отписывает читателя от автора; True, если подписка была."""
+    deleted = _execute(
+        'DELETE FROM %s WHERE user_id = %%s AND author_id = %%s '
+        'RETURNING id',
+        user_id, author_id,
+    )
+    for pk in deleted:
+        post_delete.send(
+            sender=Follow, using=connection.alias,
+            instance=Follow(pk=pk, user_id=user_id, author_id=author_id),
+        )
+    return bool(deleted)
+
+
+class FollowGraph:
+    """Подписки одного читателя, загружаемые не более раза за запрос."""
+
+    def __init__(self, user):
+        self.user = user
+        self._following_ids = None
+
+    @property
+    def following_ids(self):
+        if self._following_ids is None:
+            self._following_ids = self._load()
+        return self._following_ids
+
+    def _load(self):
+        if not self.user.is_authenticated:
+            return frozenset()
+        key = IDS_KEY.format(
+            user_id=self.user.pk, version=get_version(self.user.pk)
+        )
+        ids = cache.get(key)
+        if ids is None:
+            ids = frozenset(
+                Follow.objects.filter(user_id=self.user.pk)
+                .values_list('author_id', flat=True)
+            )
+            cache.set(key, ids, None)
+        return ids
+
+    def is_following(self, author):
+        return getattr(author, 'pk', author) in self.following_ids
+
+
+def for_request(request):
+    """Граф подписок текущего пользователя, общий для всего запроса."""
+    graph = getattr(request, '_follow_graph', None)
+    if graph is None:
+        graph = request._follow_graph = FollowGraph(request.user)
+    return graph
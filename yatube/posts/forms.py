@@ -1,6 +1,8 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
 from posts.models import Post, Comment
+from posts import uploads
 
 
 class PostForm(forms.ModelForm):
@@ -10,6 +12,12 @@ class PostForm(forms.ModelForm):
         help_texts = {'text': 'Insert text',
                       'group': 'Insert group'}
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            image = uploads.process(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
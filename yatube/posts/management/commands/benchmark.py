@@ -0,0 +1,113 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import benchmark
+
+DEFAULT_BASELINE = os.path.join(
+    settings.BASE_DIR, 'benchmarks', 'baseline.json'
+)
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку, SQL-запросы и пропускную способность '
+            'лент и страницы поста на данных seed_benchmark.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Запросов на сценарий.',
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=10,
+            help='Запросов прогрева на поток, не входят в замер.',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='Число параллельных потоков.',
+        )
+        parser.add_argument(
+            '--url',
+            help='Адрес запущенного сервера; без него запросы идут '
+                 'через тестовый клиент в этом процессе.',
+        )
+        parser.add_argument(
+            '--scenario', action='append', dest='scenarios',
+            help='Только этот сценарий (имя вьюхи, например '
+                 'posts:index); можно указать несколько раз.',
+        )
+        parser.add_argument(
+            '--baseline', default=DEFAULT_BASELINE,
+            help='Файл базовых результатов.',
+        )
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help='Записать результаты в файл базовых результатов.',
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Завершиться с ошибкой при регрессии относительно '
+                 'базовых результатов.',
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help='Допустимый относительный рост задержки при --check.',
+        )
+        parser.add_argument(
+            '--json', action='store_true',
+            help='Вывести результаты в JSON.',
+        )
+
+    def report(self, results):
+        header = '{:<22}{:>8}{:>10}{:>10}{:>9}{:>9}{:>8}'
+        row = '{:<22}{:>8}{:>10.2f}{:>10.2f}{:>9}{:>9.1f}{:>8}'
+        self.stdout.write(header.format(
+            'scenario', 'req', 'p50 ms', 'p99 ms', 'queries', 'rps', 'errors'
+        ))
+        for name, result in results.items():
+            queries = result['queries']
+            self.stdout.write(row.format(
+                name, result['requests'], result['p50_ms'],
+                result['p99_ms'], '-' if queries is None else queries,
+                result['rps'], result['errors'],
+            ))
+
+    def handle(self, *args, **options):
+        try:
+            results = benchmark.run(
+                requests_count=options['requests'],
+                warmup=options['warmup'],
+                concurrency=options['concurrency'],
+                base_url=options['url'],
+                names=options['scenarios'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.report(results)
+        if options['save_baseline']:
+            benchmark.save_baseline(options['baseline'], results)
+            self.stdout.write(f'Записано в {options["baseline"]}')
+        if options['check']:
+            self.check_baseline(options['baseline'], results,
+                                options['tolerance'])
+
+    def check_baseline(self, path, results, tolerance):
+        try:
+            baseline = benchmark.load_baseline(path)
+        except FileNotFoundError:
+            raise CommandError(f'Нет файла {path}')
+        if baseline['dataset'] != benchmark.dataset():
+            self.stdout.write(self.style.WARNING(
+                'Набор данных отличается от базового: '
+                f'{baseline["dataset"]}'
+            ))
+        problems = benchmark.compare(results, baseline['results'], tolerance)
+        for problem in problems:
+            self.stdout.write(self.style.ERROR('  ! ' + problem))
+        if problems:
+            raise CommandError('Регрессия производительности')
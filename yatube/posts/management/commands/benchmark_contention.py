@@ -0,0 +1,68 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность параллельных чтений и '
+            'записей с настройками SQLite по умолчанию и с core.db.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--readers', type=int, default=4,
+            help='Потоков, читающих главную.',
+        )
+        parser.add_argument(
+            '--writers', type=int, default=2,
+            help='Потоков, добавляющих комментарии.',
+        )
+        parser.add_argument(
+            '--seconds', type=float, default=5.0,
+            help='Длительность каждого прогона.',
+        )
+        parser.add_argument(
+            '--json', action='store_true',
+            help='Вывести результаты в JSON.',
+        )
+
+    def report(self, results):
+        header = '{:<8}{:<9}{:>8}{:>10}{:>10}{:>8}'
+        row = '{:<8}{:<9}{:>8}{:>10}{:>10}{:>8}'
+        self.stdout.write(header.format(
+            'config', 'role', 'ops', 'ops/s', 'p99 ms', 'errors'
+        ))
+        for config, roles in results.items():
+            for role, result in roles.items():
+                p99 = result['p99_ms']
+                self.stdout.write(row.format(
+                    config, role, result['ops'], result['ops_per_s'],
+                    '-' if p99 is None else p99, result['errors'],
+                ))
+
+    def handle(self, *args, **options):
+        if connection.settings_dict['ENGINE'] != 'core.db':
+            raise CommandError('Замер сравнивает настройки бэкенда core.db.')
+        if connection.settings_dict['NAME'] == ':memory:':
+            raise CommandError('Нужна база в файле, а не в памяти.')
+        configs = (
+            ('plain', benchmark.PLAIN_SQLITE_OPTIONS),
+            ('tuned', connection.settings_dict['OPTIONS']),
+        )
+        results = {}
+        try:
+            for name, config in configs:
+                with benchmark.database_options(config):
+                    results[name] = benchmark.contention(
+                        readers=options['readers'],
+                        writers=options['writers'],
+                        seconds=options['seconds'],
+                    )
+        except ValueError as error:
+            raise CommandError(error)
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.report(results)
@@ -0,0 +1,102 @@
+import re
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from posts import feeds
+from posts.models import Group, Post
+from posts.paginators import CursorPaginator, encode_cursor
+from posts.timeline import TimelinePaginator
+
+User = get_user_model()
+
+# Проход по всей таблице постов (с индексом или без) и сортировка
+# во временном B-дереве.
+SCAN = re.compile(r'\bSCAN (TABLE )?posts_\w+')
+TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+class Command(BaseCommand):
+    help = 'Печатает EXPLAIN QUERY PLAN для запросов всех лент.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Завершиться с ошибкой, если лента сканирует таблицу '
+                 'постов целиком вместо поиска по индексу.',
+        )
+
+    def get_querysets(self):
+        group, user, post = Group(pk=0), User(pk=0), Post(pk=0)
+        cursor = encode_cursor([timezone.now(), 0])
+        for name, posts in (
+            ('index', feeds.index_feed()),
+            ('group_posts', feeds.group_feed(group)),
+            ('profile', feeds.profile_feed(user)),
+            ('follow_index', feeds.follow_feed(user)),
+        ):
+            yield name, CursorPaginator(
+                posts, settings.POSTS_AMOUNT
+            ).get_queryset()
+            yield name + ' (?after=)', CursorPaginator(
+                posts, settings.POSTS_AMOUNT, after=cursor
+            ).get_queryset()
+        for name, extra in (('', {}), (' (?after=)', {'after': cursor})):
+            paginator = TimelinePaginator(
+                feeds.follow_feed(user), settings.POSTS_AMOUNT,
+                user=user, **extra
+            )
+            yield 'follow_index timeline' + name, (
+                paginator.timeline_queryset()
+            )
+            yield 'follow_index celebrities' + name, (
+                paginator.celebrity_queryset([0])
+            )
+        yield 'follow_index timeline window', TimelinePaginator(
+            feeds.follow_feed(user), settings.POSTS_AMOUNT, user=user
+        ).boundary_queryset()
+        for name, extra in (('', {}), (' (?after=)', {'after': cursor})):
+            paginator = CursorPaginator(
+                feeds.post_comments(post), settings.COMMENTS_AMOUNT,
+                ordering=feeds.COMMENT_ORDERING, **extra
+            )
+            yield 'post_detail comments' + name, paginator.get_queryset()
+        yield 'feed card comments', feeds.latest_comment_ids(
+            list(range(settings.POSTS_AMOUNT)), settings.POST_CARD_COMMENTS
+        )
+
+    def find_problems(self, plan):
+        """Полный скан без индекса или полный скан плюс сортировка."""
+        lines = [line.strip() for line in plan.splitlines()]
+        scans = [line for line in lines if SCAN.search(line)]
+        if TEMP_SORT in plan and scans:
+            return scans + [TEMP_SORT]
+        return [line for line in scans if 'USING' not in line]
+
+    def handle(self, *args, **options):
+        check = options['check'] and connection.vendor == 'sqlite'
+        failed = []
+        for name, queryset in self.get_querysets():
+            plan = queryset.explain()
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(plan)
+            if not check:
+                continue
+            problems = self.find_problems(plan)
+            for line in problems:
+                self.stdout.write(self.style.ERROR('  ! ' + line))
+            if problems:
+                failed.append(name)
+            elif TEMP_SORT in plan:
+                # Сортировка уже отобранного по индексу набора строк:
+                # допустима, но стоит внимания.
+                self.stdout.write(self.style.WARNING('  ? ' + TEMP_SORT))
+        if failed:
+            raise CommandError(
+                'Ленты с полным сканированием таблицы: '
+                + ', '.join(failed)
+            )
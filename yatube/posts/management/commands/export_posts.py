@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = 'Выгружает все посты в NDJSON или CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='Файл для записи; «-» — стандартный вывод.'
+        )
+        parser.add_argument(
+            '--format', choices=transfer.FORMATS,
+            help='Формат; по умолчанию по расширению файла.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Постов за один запрос к базе.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or transfer.detect_format(path)
+        if path == '-':
+            # В стандартный вывод идут только сами записи.
+            transfer.export_posts(self.stdout, format, options['batch_size'])
+            return
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            count = transfer.export_posts(
+                file, format, options['batch_size']
+            )
+        self.stdout.write(f'Выгружено постов: {count}')
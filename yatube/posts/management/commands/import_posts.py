@@ -0,0 +1,66 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import bulk, transfer
+
+
+class Command(BaseCommand):
+    help = ('Загружает посты из NDJSON или CSV пачками по транзакциям; '
+            'поля: text, pub_date, author, group, image.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='Файл с постами; «-» — стандартный ввод.'
+        )
+        parser.add_argument(
+            '--format', choices=transfer.FORMATS,
+            help='Формат; по умолчанию по расширению файла.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Постов в одной транзакции.',
+        )
+        parser.add_argument(
+            '--media-root',
+            help='Каталог, из которого копировать картинки; без него '
+                 'имена картинок считаются уже лежащими в MEDIA_ROOT.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Потоков для копирования картинок.',
+        )
+
+    def load(self, file, options):
+        format = options['format'] or transfer.detect_format(
+            options['path']
+        )
+        importer = transfer.Importer(
+            batch_size=options['batch_size'],
+            media_root=options['media_root'],
+            workers=options['workers'],
+        )
+        try:
+            importer.run(transfer.read_records(file, format))
+        except transfer.InvalidRecord as error:
+            raise CommandError(
+                f'{error}; загружено постов: {importer.created["posts"]}'
+            )
+        finally:
+            self.report(importer)
+
+    def report(self, importer):
+        # Пачки до ошибки уже закоммичены, а счётчики, ссылки на
+        # картинки и ленты подписок сигналы при массовой вставке не
+        # обновляли, поэтому они пересчитываются и после ошибки.
+        for name, count in importer.created.items():
+            self.stdout.write(f'создано {name}: {count}')
+        for name, count in bulk.finish(importer.author_ids).items():
+            self.stdout.write(f'пересчитано {name}: {count}')
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            self.load(sys.stdin, options)
+        else:
+            with open(options['path'], encoding='utf-8', newline='') as file:
+                self.load(file, options)
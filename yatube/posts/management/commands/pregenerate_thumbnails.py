@@ -0,0 +1,29 @@
+from functools import partial
+
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import get_executor, in_pool, prepare
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит миниатюры и адаптивные варианты картинок всех уже '
+        'опубликованных постов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='Только посты, у картинок которых ещё нет вариантов.'
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='')
+        if options['missing']:
+            posts = posts.filter(image_variants__isnull=True)
+        post_ids = posts.values_list('pk', flat=True).iterator()
+        count = sum(1 for _ in get_executor().map(
+            partial(in_pool, prepare), post_ids
+        ))
+        self.stdout.write(f'Обработано картинок: {count}')
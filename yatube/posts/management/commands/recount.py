@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import blobs
+from posts.counters import recount
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики постов, комментариев и подписок '
+            'и ссылки на файлы картинок, исправляет расхождения.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = recount()
+            updated['media_blobs'] = blobs.recount()
+        for name, count in updated.items():
+            self.stdout.write(f'{name}: {count}')
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts import benchmark
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Заполняет пустую базу синтетическими данными для '
+            'команды benchmark.')
+
+    def add_arguments(self, parser):
+        options = (
+            ('--users', 2000, 'Число пользователей.'),
+            ('--groups', 20, 'Число групп.'),
+            ('--posts', 50000, 'Число постов.'),
+            ('--follows', 50, 'Подписок у каждого пользователя.'),
+            ('--reader-follows', 500, 'Подписок у читателя follow_index.'),
+            ('--heavy-posts', 5, 'Свежих постов с комментариями.'),
+            ('--comments', 2000, 'Комментариев у каждого такого поста.'),
+            ('--days', 365, 'За сколько дней опубликованы посты.'),
+            ('--batch-size', 2000, 'Объектов в памяти за раз.'),
+            ('--random-seed', 0, 'Зерно генератора случайных чисел.'),
+        )
+        for name, default, help_text in options:
+            parser.add_argument(name, type=int, default=default,
+                                help=help_text)
+
+    def handle(self, *args, **options):
+        if Post.objects.exists():
+            raise CommandError(
+                'В базе уже есть посты; замеры делаются на отдельной '
+                'базе (например, с другим DATABASES в --settings).'
+            )
+        with transaction.atomic():
+            sizes = benchmark.seed(
+                users=options['users'],
+                groups=options['groups'],
+                posts=options['posts'],
+                follows=options['follows'],
+                reader_follows=options['reader_follows'],
+                heavy_posts=options['heavy_posts'],
+                comments=options['comments'],
+                days=options['days'],
+                batch_size=options['batch_size'],
+                random_seed=options['random_seed'],
+            )
+        for name, count in sizes.items():
+            self.stdout.write(f'{name}: {count}')
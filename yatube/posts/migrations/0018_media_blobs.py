@@ -0,0 +1,41 @@
+# Generated by Django 2.2.16 on 2026-10-17 07:36
+
+import core.storage
+from django.db import migrations, models
+
+
+def count_references(apps, schema_editor):
+    from posts.blobs import recount
+    recount(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_postimagevariant'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Имя файла')),
+                ('refcount', models.PositiveIntegerField(default=0, verbose_name='Число ссылок')),
+            ],
+            options={
+                'verbose_name': 'Файл картинки',
+                'verbose_name_plural': 'Файлы картинок',
+            },
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, storage=core.storage.ContentAddressedStorage(), upload_to='posts/', verbose_name='Картинка'),
+        ),
+        migrations.AlterField(
+            model_name='postimagevariant',
+            name='image',
+            field=models.FileField(storage=core.storage.ContentAddressedStorage(), upload_to='posts/variants/', verbose_name='Файл'),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-17 08:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_post_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='op_id',
+            field=models.UUIDField(editable=False, null=True, unique=True),
+        ),
+    ]
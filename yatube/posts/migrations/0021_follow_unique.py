@@ -0,0 +1,40 @@
+# Generated by Django 2.2.16 on 2026-10-17 08:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def drop_duplicates(apps, schema_editor):
+    """Оставляет по одной, самой ранней, подписке на каждую пару."""
+    Follow = apps.get_model('posts', 'Follow')
+    first = Follow.objects.values('user', 'author').annotate(
+        first=models.Min('pk')
+    ).values('first')
+    Follow.objects.exclude(pk__in=first).delete()
+
+
+def recount(apps, schema_editor):
+    # Дубли завышали число подписчиков и подписок.
+    from posts.counters import recount
+    recount(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0020_comment_op_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicates, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='follow',
+            name='follow_user_author_idx',
+        ),
+        migrations.AlterUniqueTogether(
+            name='follow',
+            unique_together={('user', 'author')},
+        ),
+        migrations.RunPython(recount, migrations.RunPython.noop),
+    ]
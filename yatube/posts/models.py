@@ -1,23 +1,55 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from core.fulltext import FullTextField
+from core.storage import ContentAddressedStorage
+
 User = get_user_model()
 
+# Картинки постов и их варианты хранятся по хешу содержимого.
+media_storage = ContentAddressedStorage()
+
 TEXT_LIMIT = 15
 
 
-class Group(models.Model):
+class CountersMixin:
+    """Не даёт обычному `save()` записать устаревшие счётчики.
+
+    Счётчики из `counter_fields` меняют только атомарные UPDATE
+    в `posts.counters`; полное сохранение загруженного объекта иначе
+    вернуло бы значения на момент его загрузки.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and not args
+                and kwargs.get('update_fields') is None):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class Group(CountersMixin, models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     description = models.TextField()
+    posts_count = models.PositiveIntegerField(
+        'Число постов', default=0, editable=False
+    )
+
+    counter_fields = ('posts_count',)
 
     def __str__(self):
         return self.title
 
 
-class Post(models.Model):
+class Post(CountersMixin, models.Model):
     text = models.TextField('Текст поста', help_text='Введите текст поста')
     pub_date = models.DateTimeField('Дата публикации', auto_now_add=True)
+    updated = models.DateTimeField('Дата изменения', auto_now=True)
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -35,17 +67,76 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=media_storage,
         blank=True
     )
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев', default=0, editable=False
+    )
+    # Меняется вместе с тем, что показывает карточка, но не с текстом
+    # поста: удаление комментария, новые варианты картинки.
+    revision = models.PositiveIntegerField(
+        'Версия карточки', default=0, editable=False
+    )
+
+    counter_fields = ('comments_count', 'revision')
 
     class Meta:
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='post_pub_date_idx'
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date_idx'
+            ),
+        ]
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
 
     def __str__(self):
         return self.text[:TEXT_LIMIT]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Группа на момент загрузки: по ней счётчики групп узнают,
+        # что пост перенесли в другую группу.
+        if 'group_id' in field_names:
+            instance._loaded_group_id = instance.group_id
+        # По прежнему имени картинки `posts.blobs` ведёт счётчик ссылок.
+        if 'image' in field_names:
+            instance._loaded_image = instance.image.name
+        return instance
+
+
+class PostSearchIndex(models.Model):
+    """Полнотекстовый индекс текстов постов: таблица SQLite FTS5.
+
+    Таблицу создаёт миграция, в синхроне с `Post` её держат триггеры
+    (`posts.search`). Модель нужна только для запросов: `rank` —
+    релевантность bm25, чем меньше, тем лучше; имеет смысл только
+    вместе с `text__match`.
+    """
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        related_name='search_index',
+    )
+    text = FullTextField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'posts_post_fts'
+
 
 class Comment(models.Model):
     post = models.ForeignKey(
@@ -67,9 +158,18 @@ class Comment(models.Model):
         help_text='Напишите комментарии'
     )
     created = models.DateTimeField('Дата комментария', auto_now_add=True)
+    # Id операции очереди отложенной записи (posts.writebehind):
+    # повторная доставка той же операции не создаёт дубль.
+    op_id = models.UUIDField(null=True, unique=True, editable=False)
 
     class Meta:
         ordering = ['-created']
+        indexes = [
+            models.Index(
+                fields=['post', '-created', '-id'],
+                name='comment_post_created_idx'
+            ),
+        ]
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
 
@@ -87,3 +187,114 @@ class Follow(models.Model):
         related_name='following',
         verbose_name='Тот, на кого подписываются',
     )
+
+    class Meta:
+        # Уникальный индекс заодно обслуживает поиск по (user, author).
+        unique_together = ('user', 'author')
+
+
+class TimelineEntry(models.Model):
+    """Материализованная лента подписок: пост, разосланный подписчику.
+
+    Заполняется при публикации поста (fan-out-on-write), поэтому
+    `follow_index` читает готовый индекс `(user, pub_date)` вместо
+    соединения `Follow` и `Post`.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост',
+    )
+    pub_date = models.DateTimeField('Дата публикации поста')
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_pub_date_idx'
+            ),
+        ]
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+
+
+class UserStats(models.Model):
+    """Денормализованные счётчики пользователя.
+
+    Поддерживаются сигналами в `posts.counters`, расхождения
+    исправляет команда `recount`.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь',
+    )
+    posts_count = models.PositiveIntegerField(
+        'Число постов', default=0, editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0, editable=False
+    )
+    following_count = models.PositiveIntegerField(
+        'Число подписок', default=0, editable=False
+    )
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+
+class PostImageVariant(models.Model):
+    """Уменьшенная копия картинки поста одной ширины и одного формата.
+
+    Строится в фоне (`posts.variants`) и выводится в `<picture srcset>`,
+    чтобы телефоны не скачивали картинку во всю ширину ленты.
+    """
+    FORMATS = (
+        ('avif', 'AVIF'),
+        ('webp', 'WebP'),
+        ('jpeg', 'JPEG'),
+    )
+
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='image_variants',
+        verbose_name='Пост',
+    )
+    width = models.PositiveIntegerField('Ширина')
+    height = models.PositiveIntegerField('Высота')
+    format = models.CharField('Формат', max_length=4, choices=FORMATS)
+    image = models.FileField(
+        'Файл', upload_to='posts/variants/', storage=media_storage
+    )
+
+    class Meta:
+        ordering = ['width']
+        unique_together = ('post', 'width', 'format')
+        verbose_name = 'Вариант картинки'
+        verbose_name_plural = 'Варианты картинок'
+
+
+class MediaBlob(models.Model):
+    """Файл картинки поста и число постов, которые на него ссылаются.
+
+    Одинаковые загрузки хранятся одним файлом (`core.storage`), и файл
+    удаляется вместе с миниатюрами, когда ссылок не остаётся.
+    """
+    name = models.CharField('Имя файла', max_length=100, primary_key=True)
+    refcount = models.PositiveIntegerField('Число ссылок', default=0)
+
+    class Meta:
+        verbose_name = 'Файл картинки'
+        verbose_name_plural = 'Файлы картинок'
@@ -0,0 +1,128 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+
+FEED_ORDERING = ('-pub_date', '-pk')
+
+
+def encode_cursor(values):
+    """Упаковывает значения ключа сортировки в непрозрачный токен."""
+    raw = json.dumps([
+        value.isoformat() if hasattr(value, 'isoformat') else value
+        for value in values
+    ])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Распаковывает токен; для испорченного токена возвращает None."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, json.JSONDecodeError, ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+class CursorPaginator(Paginator):
+    """Keyset-пагинация по `(pub_date, id)` без COUNT и OFFSET.
+
+    Каждая страница выбирается одним запросом вида
+    `WHERE (pub_date, id) < (:pub_date, :id) ORDER BY ... LIMIT n + 1`,
+    поэтому далёкие страницы стоят столько же, сколько первая.
+    Возвращает обычный `Page`: номера страниц условные (1 или 2),
+    а токены соседних страниц лежат в `next_cursor`/`previous_cursor`.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, per_page, after=None, before=None,
+                 ordering=FEED_ORDERING):
+        super().__init__(object_list, per_page)
+        self.num_pages = 1
+        self.ordering = ordering
+        self.after = self._parse_cursor(after)
+        self.before = None if self.after else self._parse_cursor(before)
+
+    def _fields(self):
+        opts = self.object_list.model._meta
+        annotations = self.object_list.query.annotations
+        for name in self.ordering:
+            name = name.lstrip('-')
+            if name in annotations:
+                # Например, релевантность в результатах поиска.
+                yield name, annotations[name].output_field
+            else:
+                yield name, opts.pk if name == 'pk' else opts.get_field(name)
+
+    def _parse_cursor(self, token):
+        values = decode_cursor(token) if token else None
+        if not values or len(values) != len(self.ordering):
+            return None
+        try:
+            return [
+                field.to_python(value)
+                for (_, field), value in zip(self._fields(), values)
+            ]
+        # to_python сообщает о негодном значении через ValidationError.
+        except (ValidationError, ValueError, TypeError):
+            return None
+
+    def _key(self, obj):
+        return [getattr(obj, name) for name, _ in self._fields()]
+
+    def window(self, queryset, ordering=None):
+        """Одна страница `queryset` после курсора (с лишней строкой,
+        по которой видно, есть ли следующая страница)."""
+        ordering = list(ordering or self.ordering)
+        cursor = self.after
+        if self.before is not None:
+            cursor = self.before
+            ordering = [
+                name[1:] if name.startswith('-') else '-' + name
+                for name in ordering
+            ]
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            condition, equal = Q(), {}
+            for order, value in zip(ordering, cursor):
+                name = order.lstrip('-')
+                lookup = '%s__%s' % (name, 'lt' if order[0] == '-' else 'gt')
+                condition |= Q(**equal, **{lookup: value})
+                equal[name] = value
+            queryset = queryset.filter(condition)
+        return queryset[:self.per_page + 1]
+
+    def get_queryset(self):
+        return self.window(self.object_list)
+
+    def fetch(self):
+        return list(self.get_queryset())
+
+    def page(self, number=None):
+        rows = self.fetch()
+        extra = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if self.before is not None:
+            rows.reverse()
+            has_next, has_previous = True, extra
+        else:
+            has_next, has_previous = extra, self.after is not None
+        if not rows:
+            has_next = has_previous = False
+        number = 2 if has_previous else 1
+        self.num_pages = number + 1 if has_next else number
+        page = Page(rows, number, self)
+        page.next_cursor = (
+            encode_cursor(self._key(rows[-1])) if has_next else None
+        )
+        page.previous_cursor = (
+            encode_cursor(self._key(rows[0])) if has_previous else None
+        )
+        return page
+
+    def get_page(self, number=None):
+        return self.page(number)
@@ -0,0 +1,183 @@
+"""Полнотекстовый поиск постов.
+
+Тексты индексирует внешняя (`content=`) таблица SQLite FTS5: сами
+тексты хранятся только в `posts_post`, а триггеры обновляют индекс
+при вставке, изменении и удалении постов. Токенизатор unicode61
+режет кириллицу по словам и приводит регистр, а «ё» заменяется на
+«е» и в индексе, и в запросе. Морфологии в FTS5 нет, поэтому слова
+запроса обрезаются до основы и ищутся по префиксу: «постов» находит
+и «пост», и «посты».
+"""
+import re
+from contextlib import contextmanager
+
+from django.db.models import F, Max
+
+from .models import Post, PostSearchIndex
+
+TABLE = PostSearchIndex._meta.db_table
+CONTENT = Post._meta.db_table
+SEARCH_ORDERING = ('rank', '-pk')
+
+
+def normalized(column):
+    # unicode61 не сводит «ё» к «е»: remove_diacritics работает только
+    # для латиницы.
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+CREATE_TABLE = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5('
+    f"text, content='{CONTENT}', content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2')"
+)
+INSERT = (
+    f'INSERT INTO {TABLE} (rowid, text) '
+    f'VALUES (new.id, {normalized("new.text")}); '
+)
+DELETE = (
+    f"INSERT INTO {TABLE} ({TABLE}, rowid, text) "
+    f"VALUES ('delete', old.id, {normalized('old.text')}); "
+)
+TRIGGERS = {
+    f'{TABLE}_insert': f'AFTER INSERT ON {CONTENT} BEGIN {INSERT}END',
+    f'{TABLE}_delete': f'AFTER DELETE ON {CONTENT} BEGIN {DELETE}END',
+    f'{TABLE}_update': (
+        f'AFTER UPDATE OF text ON {CONTENT} BEGIN {DELETE}{INSERT}END'
+    ),
+}
+
+WORD = re.compile(r'\w+')
+CYRILLIC = re.compile('[а-я]')
+# Окончания существительных, прилагательных и глаголов, самые
+# длинные первыми.
+ENDINGS = tuple(sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ешь', 'ишь', 'ала', 'ила', 'ыла', 'ая', 'яя', 'ое', 'ее', 'ие',
+    'ые', 'ой', 'ей', 'ий', 'ый', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях',
+    'ов', 'ев', 'ую', 'юю', 'ть', 'ти', 'ет', 'ут', 'ют', 'ит', 'ат',
+    'ят', 'ла', 'ло', 'ли', 'ал', 'ил', 'а', 'я', 'о', 'е', 'ы', 'и',
+    'у', 'ю', 'ь', 'й',
+), key=len, reverse=True))
+MIN_STEM = 3
+MAX_TERMS = 10
+
+
+def install(connection):
+    """Создаёт таблицу индекса и триггеры."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE)
+        for name, body in TRIGGERS.items():
+            cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+
+
+def repair(connection):
+    """Восстанавливает пропавшие триггеры; True, если пришлось.
+
+    SQLite удаляет триггеры вместе с таблицей, а миграции пересоздают
+    `posts_post` при изменении её полей. Изменения, сделанные без
+    триггеров, учитываются пересборкой индекса.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    names = [TABLE, *TRIGGERS]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT name FROM sqlite_master WHERE name IN (%s)'
+            % ', '.join(['%s'] * len(names)),
+            names,
+        )
+        existing = {name for name, in cursor.fetchall()}
+    if TABLE not in existing or existing.issuperset(TRIGGERS):
+        return False
+    install(connection)
+    rebuild(connection)
+    return True
+
+
+def rebuild(connection):
+    """Заново строит индекс по текстам из `posts_post`.
+
+    Встроенная команда 'rebuild' взяла бы тексты как есть, без замены
+    «ё», поэтому индекс очищается и наполняется одним INSERT.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('delete-all')")
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, text) '
+            f'SELECT id, {normalized("text")} FROM {CONTENT}'
+        )
+
+
+@contextmanager
+def suspended(connection):
+    """Массовая вставка постов без триггеров индекса.
+
+    Одна вставка в индекс после загрузки намного быстрее вставки на
+    каждую строку. Индексируются посты новее бывших до блока: правки и
+    удаления старых постов внутри блока в индекс не попадут.
+    """
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    last = Post.objects.aggregate(last=Max('pk'))['last'] or 0
+    with connection.cursor() as cursor:
+        for name in TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+    try:
+        yield
+    finally:
+        install(connection)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {TABLE} (rowid, text) '
+                f'SELECT id, {normalized("text")} FROM {CONTENT} '
+                f'WHERE id > %s',
+                [last],
+            )
+
+
+def uninstall(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name in TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+def stem(word):
+    """Грубая основа русского слова: без самого длинного окончания."""
+    word = word.replace('ё', 'е')
+    if not CYRILLIC.search(word):
+        return word
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def build_query(text):
+    """Запрос FTS5: все слова `text` как префиксы основ, через AND.
+
+    Каждое слово берётся в кавычки, поэтому операторы FTS5 из
+    пользовательского ввода не разбираются.
+    """
+    words = WORD.findall(text.lower())[:MAX_TERMS]
+    return ' '.join('"%s"*' % stem(word) for word in words)
+
+
+def search_posts(text):
+    """Посты, подходящие под запрос, с релевантностью в `rank`."""
+    query = build_query(text)
+    if not query:
+        return Post.objects.none()
+    return (
+        Post.objects.filter(search_index__text__match=query)
+        .annotate(rank=F('search_index__rank'))
+        .select_related('author', 'group')
+    )
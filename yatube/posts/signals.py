@@ -0,0 +1,131 @@
+from django.db import connections, transaction
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from core.cache import bump_generation
+
+from . import blobs, counters, follow_graph, search, timeline
+from .models import Comment, Follow, Group, Post, PostImageVariant, User
+
+# Поколение кеша страниц лент: меняется при любом изменении постов,
+# комментариев и групп.
+POSTS_NAMESPACE = 'posts'
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def posts_changed(sender, raw=False, **kwargs):
+    if not raw:
+        bump_generation(POSTS_NAMESPACE)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.post_added(instance)
+        timeline.fan_out(instance)
+    elif hasattr(instance, '_loaded_group_id'):
+        counters.post_moved(instance, instance._loaded_group_id)
+    instance._loaded_group_id = instance.group_id
+    loaded_image = getattr(instance, '_loaded_image', '')
+    if instance.image.name != loaded_image:
+        blobs.acquire(instance.image.name)
+        blobs.release(loaded_image)
+    instance._loaded_image = instance.image.name
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.post_removed(instance)
+    blobs.release(instance.image.name)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.comment_added(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.comment_removed(instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.follow_added(instance)
+        timeline.backfill(instance.user_id, instance.author_id)
+        follow_graph.invalidate(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.follow_removed(instance)
+    timeline.prune(instance.user_id, instance.author_id)
+    timeline.followers_dropped(instance.author_id)
+    follow_graph.invalidate(instance.user_id, instance.author_id)
+
+
+# Поля пользователя, которые видны в карточках и шапках лент.
+USER_DISPLAY_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Вход сохраняет только last_login, имена при этом не меняются.
+    if raw or instance.pk is None or (
+        update_fields is not None
+        and not set(update_fields) & set(USER_DISPLAY_FIELDS)
+    ):
+        return
+    instance._loaded_names = User.objects.filter(
+        pk=instance.pk
+    ).values_list(*USER_DISPLAY_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded_names', None)
+    instance._loaded_names = None
+    names = tuple(getattr(instance, name) for name in USER_DISPLAY_FIELDS)
+    if loaded and loaded != names:
+        # Закешированные страницы лент показывают прежнее имя автора.
+        bump_generation(POSTS_NAMESPACE)
+    # Имя могло раньше принадлежать другому пользователю, а старое имя
+    # переименованного пользователя может занять новый.
+    if created or (loaded and loaded[0] != instance.username):
+        follow_graph.forget_user(instance.username)
+        if loaded:
+            follow_graph.forget_user(loaded[0])
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # Имя может достаться новому пользователю с другим id.
+    follow_graph.forget_user(instance.username)
+
+
+@receiver(post_delete, sender=PostImageVariant)
+def image_variant_deleted(sender, instance, **kwargs):
+    # Файл стирается только после коммита: при откате строка вернётся.
+    # Одинаковые варианты разных постов хранятся одним файлом.
+    storage, name = instance.image.storage, instance.image.name
+
+    def delete_unused():
+        if not PostImageVariant.objects.filter(image=name).exists():
+            storage.delete(name)
+    transaction.on_commit(delete_unused)
+
+
+@receiver(post_migrate)
+def search_index_repaired(sender, using, **kwargs):
+    if sender.name == 'posts':
+        search.repair(connections[using])
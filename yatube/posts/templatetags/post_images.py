@@ -0,0 +1,43 @@
+from django import template
+
+from posts.variants import CONTENT_TYPES
+
+register = template.Library()
+
+# Карточка занимает всю ширину экрана телефона и не шире 960px.
+SIZES = '(max-width: 960px) 100vw, 960px'
+
+
+@register.inclusion_tag('posts/includes/post_picture.html')
+def post_picture(post):
+    """`<picture>` с адаптивными вариантами картинки поста.
+
+    Пока варианты не построены, выводится миниатюра sorl-thumbnail.
+    """
+    by_format = {}
+    for variant in post.image_variants.all() if post.image else ():
+        by_format.setdefault(variant.format, []).append(variant)
+    if not by_format:
+        return {'post': post}
+    # Последний по предпочтению формат (обычно JPEG) идёт в <img>.
+    formats = [name for name in CONTENT_TYPES if name in by_format]
+    fallback = by_format[formats[-1]]
+    return {
+        'post': post,
+        'sizes': SIZES,
+        'sources': [
+            {
+                'type': CONTENT_TYPES[name],
+                'srcset': _srcset(by_format[name]),
+            }
+            for name in formats[:-1]
+        ],
+        'img': fallback[-1],
+        'srcset': _srcset(fallback),
+    }
+
+
+def _srcset(variants):
+    return ', '.join(
+        '%s %sw' % (variant.image.url, variant.width) for variant in variants
+    )
@@ -0,0 +1,303 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+
+from core.cache import get_generation
+from posts import benchmark, timeline
+from posts.search import search_posts
+from posts.signals import POSTS_NAMESPACE
+from posts.models import (Comment, Follow, Group, Post, TimelineEntry,
+                          UserStats)
+
+User = get_user_model()
+
+
+class ExplainFeedsCommandTest(TestCase):
+    def test_feeds_do_not_scan_whole_table(self):
+        """Ни одна лента не сканирует таблицу постов целиком"""
+        out = StringIO()
+        call_command('explain_feeds', check=True, stdout=out)
+        self.assertIn('post_pub_date_idx', out.getvalue())
+
+
+class RecountCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-group',
+            description='Тестовое описание группы',
+        )
+        cls.post = Post.objects.create(
+            text='Тестовый пост', author=cls.author, group=cls.group
+        )
+        Comment.objects.create(
+            post=cls.post, author=cls.reader, text='Комментарий'
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def assert_counters(self):
+        self.post.refresh_from_db()
+        self.group.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertEqual(self.group.posts_count, 1)
+        stats = UserStats.objects.get(user=self.author)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.followers_count, 1)
+        self.assertEqual(
+            UserStats.objects.get(user=self.reader).following_count, 1
+        )
+
+    def test_counters_follow_writes(self):
+        """Счётчики обновляются вместе с записями"""
+        self.assert_counters()
+
+    def test_moving_post_updates_group_counters(self):
+        """Перенос поста в другую группу переносит и счётчик"""
+        other = Group.objects.create(
+            title='Другая группа', slug='other', description='Описание'
+        )
+        post = Post.objects.get(pk=self.post.pk)
+        post.group = other
+        post.save()
+        self.group.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(other.posts_count, 1)
+
+    def test_stale_save_keeps_counters(self):
+        """Сохранение загруженного раньше объекта не затирает счётчики"""
+        post = Post.objects.get(pk=self.post.pk)
+        group = Group.objects.get(pk=self.group.pk)
+        Comment.objects.create(post=post, author=self.reader, text='Ещё')
+        Post.objects.create(text='Ещё пост', author=self.author, group=group)
+        post.text = 'Исправленный текст'
+        post.save()
+        group.description = 'Новое описание'
+        group.save()
+        post.refresh_from_db()
+        group.refresh_from_db()
+        self.assertEqual(post.text, 'Исправленный текст')
+        self.assertEqual(post.comments_count, 2)
+        self.assertEqual(group.posts_count, 2)
+
+    def test_deleting_user_keeps_other_counters(self):
+        """Удаление пользователя с постами и подписками уменьшает
+        счётчики остальных и не падает"""
+        Follow.objects.create(user=self.author, author=self.reader)
+        # Объект из setUpTestData общий для тестов: удаление обнулит pk.
+        User.objects.get(pk=self.author.pk).delete()
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertFalse(UserStats.objects.filter(user=self.author).exists())
+        stats = UserStats.objects.get(user=self.reader)
+        self.assertEqual(stats.following_count, 0)
+        self.assertEqual(stats.followers_count, 0)
+
+    def test_recount_repairs_drift(self):
+        """recount исправляет разошедшиеся счётчики"""
+        Post.objects.update(comments_count=7)
+        Group.objects.update(posts_count=0)
+        UserStats.objects.all().delete()
+        call_command('recount', stdout=StringIO())
+        self.assert_counters()
+
+
+class BenchmarkCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'seed_benchmark', users=30, groups=3, posts=200, follows=5,
+            reader_follows=10, heavy_posts=1, comments=30, stdout=StringIO(),
+        )
+        cls.reader = User.objects.get(username=benchmark.USERNAME.format(0))
+
+    def test_seed_builds_consistent_dataset(self):
+        """Счётчики и ленты подписок совпадают с данными"""
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(self.reader.stats.following_count, 10)
+        followed = Follow.objects.filter(user=self.reader).values('author')
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(),
+            Post.objects.filter(author__in=followed).count(),
+        )
+        self.assertEqual(
+            Post.objects.order_by('-comments_count')[0].comments_count, 30
+        )
+        with self.assertRaises(CommandError):
+            call_command('seed_benchmark', posts=1, stdout=StringIO())
+
+    def test_benchmark_reports_and_checks_baseline(self):
+        """Результаты сверяются с базовыми, рост запросов — ошибка"""
+        out = StringIO()
+        call_command('benchmark', requests=3, warmup=1, json=True, stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual(
+            set(results), {scenario.name for scenario in benchmark.scenarios()}
+        )
+        for result in results.values():
+            self.assertEqual(result['errors'], 0)
+        # Кеш страниц не подменяет замер самих вьюх.
+        for name in ('posts:index', 'posts:group_list'):
+            self.assertGreater(results[name]['queries'], 0)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            call_command(
+                'benchmark', requests=3, warmup=1, baseline=path,
+                save_baseline=True, scenarios=['posts:post_detail'],
+                stdout=StringIO(),
+            )
+            baseline = benchmark.load_baseline(path)
+            baseline['results']['posts:post_detail']['queries'] -= 1
+            with open(path, 'w') as file:
+                json.dump(baseline, file)
+            with self.assertRaises(CommandError):
+                call_command(
+                    'benchmark', requests=3, warmup=1, baseline=path,
+                    check=True, tolerance=100,
+                    scenarios=['posts:post_detail'], stdout=StringIO(),
+                )
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class TransferCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        for number in range(5):
+            Post.objects.create(
+                author=cls.author,
+                group=cls.group if number % 2 else None,
+                text=f'Ёлочный пост {number}',
+            )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def round_trip(self, name):
+        path = os.path.join(self.directory, name)
+        call_command('export_posts', path, batch_size=2, stdout=StringIO())
+        exported = list(
+            Post.objects.order_by('pk').values_list(
+                'text', 'pub_date', 'group__slug'
+            )
+        )
+        Post.objects.all().delete()
+        call_command('import_posts', path, batch_size=2, stdout=StringIO())
+        self.assertEqual(
+            list(
+                Post.objects.order_by('pk').values_list(
+                    'text', 'pub_date', 'group__slug'
+                )
+            ),
+            exported,
+        )
+
+    def test_round_trip_keeps_posts(self):
+        """Экспорт и импорт сохраняют текст, дату и группу постов"""
+        for name in ('posts.ndjson', 'posts.csv'):
+            with self.subTest(name=name):
+                self.round_trip(name)
+
+    def test_import_creates_authors_groups_and_counters(self):
+        """Недостающие авторы и группы создаются, счётчики и поиск верны"""
+        path = os.path.join(self.directory, 'posts.ndjson')
+        with open(path, 'w', encoding='utf-8') as file:
+            for author in ('auth', 'newcomer', 'newcomer'):
+                file.write(json.dumps({
+                    'text': 'Привезённый пост', 'author': author,
+                    'group': 'imported',
+                }) + '\n')
+        call_command('import_posts', path, stdout=StringIO())
+        group = Group.objects.get(slug='imported')
+        self.assertEqual(group.posts_count, 3)
+        newcomer = User.objects.get(username='newcomer')
+        self.assertFalse(newcomer.has_usable_password())
+        self.assertEqual(newcomer.stats.posts_count, 2)
+        self.assertEqual(search_posts('привезенный').count(), 3)
+        self.assertEqual(search_posts('елочный').count(), 5)
+
+    def test_import_copies_images(self):
+        """Картинки копируются из --media-root в хранилище медиа"""
+        with open(os.path.join(self.directory, 'cat.gif'), 'wb') as file:
+            file.write(b'GIF89a')
+        path = os.path.join(self.directory, 'posts.csv')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('text,author,image\nС котом,auth,cat.gif\n')
+        call_command(
+            'import_posts', path, media_root=self.directory,
+            stdout=StringIO(),
+        )
+        post = Post.objects.get(text='С котом')
+        self.assertTrue(post.image.name.startswith('posts/'))
+        self.assertTrue(post.image.storage.exists(post.image.name))
+
+    def test_invalid_record_stops_import(self):
+        """Неверная запись прерывает загрузку с номером записи"""
+        path = os.path.join(self.directory, 'posts.ndjson')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('{"text": "", "author": "auth"}\n')
+        with self.assertRaisesMessage(CommandError, 'запись 1'):
+            call_command('import_posts', path, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 5)
+
+    def test_invalid_record_keeps_loaded_batches_consistent(self):
+        """После ошибки загруженные пачки попадают в счётчики и ленты"""
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=self.author)
+        path = os.path.join(self.directory, 'posts.ndjson')
+        with open(path, 'w', encoding='utf-8') as file:
+            for text in ('Первый', 'Второй', ''):
+                file.write(json.dumps({'text': text, 'author': 'auth'}))
+                file.write('\n')
+        generation = get_generation(POSTS_NAMESPACE)
+        with self.assertRaisesMessage(CommandError, 'запись 3'):
+            call_command(
+                'import_posts', path, batch_size=1, stdout=StringIO()
+            )
+        self.assertEqual(UserStats.objects.get(
+            user=self.author
+        ).posts_count, 7)
+        self.assertEqual(
+            TimelineEntry.objects.filter(
+                user=reader, post__text__in=['Первый', 'Второй']
+            ).count(),
+            2,
+        )
+        self.assertNotEqual(get_generation(POSTS_NAMESPACE), generation)
+
+    @override_settings(TIMELINE_BACKFILL_LIMIT=2)
+    def test_rebuild_limits_timeline_per_author(self):
+        """Пересборка лент берёт только последние посты автора"""
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=self.author)
+        TimelineEntry.objects.all().delete()
+        self.assertEqual(timeline.rebuild(), 2)
+        self.assertEqual(
+            set(reader.timeline.values_list('post', flat=True)),
+            set(Post.objects.order_by('-pub_date', '-pk')[:2].values_list(
+                'pk', flat=True
+            )),
+        )
+        self.assertEqual(timeline.rebuild([self.author.pk]), 0)
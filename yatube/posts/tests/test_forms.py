@@ -1,15 +1,24 @@
+import hashlib
 import shutil
+import struct
 import tempfile
 from http import HTTPStatus
+from io import BytesIO
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
-from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadedfile import (SimpleUploadedFile,
+                                            TemporaryUploadedFile)
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
 
+from posts import blobs, thumbnails, uploads, variants
 from posts.forms import PostForm
-from posts.models import Post, Group
+from posts.models import Group, MediaBlob, Post
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 User = get_user_model()
@@ -85,18 +94,119 @@ class PostCreateFormTests(TestCase):
             'posts:profile',
             kwargs={'username': PostCreateFormTests.author_of_post})
         )
-        self.assertTrue(
-            Post.objects.filter(
-                group=form_data['group'],
-                text=form_data['text'],
-                image="posts/small.gif",
-            ).exists(),
-            'В этом посте нет картинка'
-        )
         new_post = Post.objects.latest('id')
+        self.assertEqual(new_post.text, form_data['text'])
         self.assertEqual(new_post.author, self.author_of_post)
         self.assertEqual(new_post.group, self.group)
-        self.assertTrue(Post.objects.filter(image='posts/small.gif').exists())
+        # Картинка хранится под хешем своего содержимого.
+        with new_post.image.open('rb') as image:
+            digest = hashlib.sha256(image.read()).hexdigest()
+        self.assertEqual(
+            new_post.image.name, f'posts/{digest[:2]}/{digest}.gif',
+            'В этом посте нет картинка'
+        )
+
+    def test_thumbnails_pregenerated(self):
+        """Миниатюры картинки поста строятся заранее"""
+        post = Post.objects.create(
+            text='Пост с картинкой',
+            author=self.author_of_post,
+            image=SimpleUploadedFile(
+                name='thumb.gif',
+                content=self.small_gif,
+                content_type='image/gif'
+            )
+        )
+        source = ImageFile(post.image)
+        self.assertIsNone(default.kvstore.get(source))
+        thumbnails.prepare(post.pk)
+        self.assertIsNotNone(default.kvstore.get(source))
+        thumbnail_keys = default.kvstore._get(source.key, 'thumbnails')
+        self.assertEqual(
+            len(thumbnail_keys), len(settings.POST_THUMBNAIL_GEOMETRIES)
+        )
+        self.assertTrue(post.image_variants.exists())
+
+    def test_image_variants(self):
+        """Адаптивные варианты картинки выводятся через srcset"""
+        post = Post.objects.create(
+            text='Пост с вариантами',
+            author=self.author_of_post,
+            group=self.group,
+            image=SimpleUploadedFile(
+                name='variants.gif',
+                content=self.small_gif,
+                content_type='image/gif'
+            )
+        )
+        created = variants.generate(post)
+        refreshed = Post.objects.get(pk=post.pk)
+        self.assertEqual(refreshed.revision, post.revision + 1)
+        self.assertEqual(refreshed.updated, post.updated)
+        formats = variants.supported_formats()
+        self.assertIn('jpeg', formats)
+        # Картинка уже самой узкой ширины: растягивается только до неё.
+        self.assertEqual(
+            sorted((v.width, v.format) for v in created),
+            sorted((min(settings.POST_IMAGE_VARIANT_WIDTHS), name)
+                   for name in formats)
+        )
+        response = self.client_for_author_of_post.get(
+            reverse('posts:post_detail', args=(post.pk,))
+        )
+        jpeg = post.image_variants.get(format='jpeg')
+        self.assertContains(response, 'srcset="%s ' % jpeg.image.url)
+        self.assertEqual(jpeg.height, round(
+            jpeg.width * settings.POST_IMAGE_VARIANT_ASPECT[1]
+            / settings.POST_IMAGE_VARIANT_ASPECT[0]
+        ))
+
+        self.client_for_author_of_post.post(
+            reverse('posts:post_edit', args=(post.pk,)),
+            data={
+                'text': post.text,
+                'group': self.group.pk,
+                'image': SimpleUploadedFile(
+                    name='other.gif',
+                    content=self.small_gif,
+                    content_type='image/gif'
+                ),
+            },
+        )
+        self.assertFalse(post.image_variants.exists())
+
+    def test_duplicate_images_stored_once(self):
+        """Одинаковые картинки хранятся одним файлом со счётчиком ссылок"""
+        posts = [
+            Post.objects.create(
+                text='Репост',
+                author=self.author_of_post,
+                image=SimpleUploadedFile(
+                    name=f'copy{number}.gif',
+                    content=self.small_gif,
+                    content_type='image/gif'
+                )
+            )
+            for number in range(2)
+        ]
+        name = posts[0].image.name
+        self.assertEqual(posts[1].image.name, name)
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 2)
+        first_variants = variants.generate(posts[0])
+        copied_variants = variants.generate(posts[1])
+        self.assertEqual(
+            [variant.image.name for variant in copied_variants],
+            [variant.image.name for variant in first_variants]
+        )
+
+        posts[0].delete()
+        # В TestCase колбэки on_commit не вызываются.
+        blobs.collect(name)
+        self.assertTrue(posts[1].image.storage.exists(name))
+        posts[1].delete()
+        blobs.collect(name)
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+        self.assertFalse(posts[1].image.storage.exists(name))
 
     def test_authorized_edit_post(self):
         """Проверяем, что автор может редактировать пост"""
@@ -128,3 +238,136 @@ class PostCreateFormTests(TestCase):
         self.assertEqual(
             new_group_response.context['page_obj'].paginator.count, 1
         )
+
+
+class PostImageUploadTests(TestCase):
+    @staticmethod
+    def make_jpeg(size):
+        image = Image.new('RGB', size, 'red')
+        exif = Image.Exif()
+        exif[0x010F] = 'Камера'
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', exif=exif.tobytes())
+        return SimpleUploadedFile(
+            'photo.jpg', buffer.getvalue(), content_type='image/jpeg'
+        )
+
+    @classmethod
+    def make_mpo(cls, size):
+        """JPEG с разметкой MPF и вторым кадром, как у камер телефонов."""
+        first = cls.make_jpeg(size).read()
+        second = cls.make_jpeg((size[0] // 2, size[1] // 2)).read()
+        entries = [
+            (0xB000, 7, 4, b'0100'),
+            (0xB001, 4, 1, struct.pack('<L', 2)),
+            (0xB002, 7, 32, struct.pack('<L', 50)),
+        ]
+        ifd = struct.pack('<H', len(entries)) + b''.join(
+            struct.pack('<HHL', tag, kind, count) + value
+            for tag, kind, count, value in entries
+        ) + struct.pack('<L', 0)
+        header = b'II*\x00' + struct.pack('<L', 8) + ifd
+        segment_size = 2 + 4 + len(header) + 32
+        # Смещения кадров считаются от заголовка TIFF внутри APP2.
+        first_size = len(first) + 2 + segment_size
+        mp_entries = struct.pack(
+            '<LLLHH', 0x20030000, first_size, 0, 0, 0
+        ) + struct.pack(
+            '<LLLHH', 0x00020002, len(second), first_size - 10, 0, 0
+        )
+        app2 = (
+            b'\xff\xe2' + struct.pack('>H', segment_size) + b'MPF\x00'
+            + header + mp_entries
+        )
+        return SimpleUploadedFile(
+            'photo.jpg', first[:2] + app2 + first[2:] + second,
+            content_type='image/jpeg',
+        )
+
+    @staticmethod
+    def make_gif(size):
+        frames = [Image.new('P', size, color) for color in (1, 2)]
+        buffer = BytesIO()
+        frames[0].save(
+            buffer, 'GIF', save_all=True, append_images=frames[1:],
+            duration=50, loop=0, comment='Камера'.encode(),
+        )
+        return SimpleUploadedFile(
+            'anim.gif', buffer.getvalue(), content_type='image/gif'
+        )
+
+    def clean_image(self, upload):
+        form = PostForm(data={'text': 'Пост'}, files={'image': upload})
+        return form, form.is_valid()
+
+    @override_settings(POST_IMAGE_MAX_SIDE=100)
+    def test_large_image_downsampled_without_metadata(self):
+        """Большая картинка уменьшается и теряет EXIF"""
+        form, valid = self.clean_image(self.make_jpeg((400, 200)))
+        self.assertTrue(valid, form.errors)
+        image = form.cleaned_data['image']
+        self.assertEqual(image.name, 'photo.jpg')
+        saved = Image.open(image)
+        self.assertEqual(saved.format, 'JPEG')
+        self.assertEqual(saved.size, (100, 50))
+        self.assertNotIn('exif', saved.info)
+
+    @override_settings(POST_IMAGE_MAX_SIDE=100)
+    def test_mpo_saved_as_jpeg_without_metadata(self):
+        """Снимок MPO с телефона сохраняется как уменьшенный JPEG"""
+        upload = self.make_mpo((400, 200))
+        self.assertEqual(Image.open(upload).format, 'MPO')
+        form, valid = self.clean_image(upload)
+        self.assertTrue(valid, form.errors)
+        saved = Image.open(form.cleaned_data['image'])
+        self.assertEqual(saved.format, 'JPEG')
+        self.assertEqual(saved.size, (100, 50))
+        self.assertNotIn('exif', saved.info)
+
+    @override_settings(POST_IMAGE_MAX_SIDE=100)
+    def test_animation_resaved_without_metadata(self):
+        """Анимация пересохраняется покадрово, без комментария"""
+        form, valid = self.clean_image(self.make_gif((400, 200)))
+        self.assertTrue(valid, form.errors)
+        saved = Image.open(form.cleaned_data['image'])
+        self.assertEqual(saved.format, 'GIF')
+        self.assertEqual(saved.n_frames, 2)
+        self.assertEqual(saved.size, (100, 50))
+        self.assertNotIn('comment', saved.info)
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=100 * 100)
+    def test_too_many_pixels_rejected(self):
+        """Картинка с огромным числом пикселей отклоняется"""
+        form, valid = self.clean_image(self.make_jpeg((101, 100)))
+        self.assertFalse(valid)
+        self.assertTrue(form.has_error('image', 'too_many_pixels'))
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=100 * 100)
+    def test_rejected_temporary_file_closed(self):
+        """Отклонённая картинка из временного файла не держит дескриптор"""
+        content = self.make_jpeg((101, 100)).read()
+        upload = TemporaryUploadedFile(
+            'photo.jpg', 'image/jpeg', len(content), None
+        )
+        upload.write(content)
+        upload.seek(0)
+        opened = []
+        image_open = Image.open
+
+        def spy(*args, **kwargs):
+            opened.append(image_open(*args, **kwargs))
+            return opened[-1]
+
+        with upload, mock.patch.object(uploads.Image, 'open', spy):
+            form, valid = self.clean_image(upload)
+        self.assertFalse(valid)
+        self.assertTrue(opened)
+        for image in opened:
+            self.assertIsNone(image.fp)
+
+    @override_settings(POST_IMAGE_MAX_BYTES=10)
+    def test_too_large_file_rejected(self):
+        """Слишком большой файл отклоняется"""
+        form, valid = self.clean_image(self.make_jpeg((10, 10)))
+        self.assertFalse(valid)
+        self.assertTrue(form.has_error('image', 'file_too_large'))
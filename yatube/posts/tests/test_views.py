@@ -1,16 +1,25 @@
+import os
 import shutil
 import tempfile
+import time
+from unittest import mock
+from urllib.parse import quote
 
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.test import Client, SimpleTestCase, TestCase, override_settings
 from django.urls import reverse
 from django import forms
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.cache import cache
+from django.db import IntegrityError, transaction
 
+from core.cache import GENERATION_KEY
 from posts.forms import PostForm
-from posts.models import Post, Group, Comment, Follow
+from posts.paginators import encode_cursor
+from posts import follow_graph, writebehind
+from posts.models import (Post, Group, Comment, Follow, TimelineEntry,
+                          UserStats)
 
 User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -215,9 +224,16 @@ class PostPagesTests(TestCase):
         self.assertNotContains(response, comments['text'])
 
     def test_cache_index(self):
-        """Тест, который проверяют работу кеша на главной странице"""
+        """Главная страница берётся из кеша, пока данные не менялись,
+        и обновляется сразу после создания поста"""
         response = self.client_for_author_of_post.get(reverse('posts:index'))
         count_of_orig_resp = response.content
+        # update() не шлёт сигналов, поэтому поколение кеша не меняется.
+        Post.objects.filter(pk=self.post.pk).update(text='Изменённый пост')
+        response_from_cache = self.client_for_author_of_post.get(
+            reverse('posts:index')
+        )
+        self.assertEqual(count_of_orig_resp, response_from_cache.content)
         Post.objects.create(
             text="Ещё один пост",
             author=self.author_of_post
@@ -225,19 +241,104 @@ class PostPagesTests(TestCase):
         response_after_create_new_post = self.client_for_author_of_post.get(
             reverse('posts:index')
         )
-        self.assertEqual(
+        self.assertNotEqual(
             count_of_orig_resp,
             response_after_create_new_post.content
         )
+        self.assertContains(response_after_create_new_post, 'Ещё один пост')
+
+
+class PostCardCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='CardAuthor')
+        cls.post = Post.objects.create(text='Старый текст', author=cls.author)
+
+    def setUp(self):
         cache.clear()
-        new_pesponse = self.client_for_author_of_post.get(
-            reverse('posts:index')
+        self.client_for_author = Client()
+        self.client_for_author.force_login(self.author)
+        self.profile_url = reverse(
+            'posts:profile', kwargs={'username': self.author.username}
         )
-        new_count_of_posts = new_pesponse.content
-        self.assertNotEqual(
-            count_of_orig_resp,
-            new_count_of_posts
+
+    def test_card_rendered_once(self):
+        """Карточка поста рендерится один раз и дальше берётся из кеша"""
+        response = self.client.get(self.profile_url)
+        self.assertTemplateUsed(response, 'posts/includes/post_card.html')
+        response = self.client.get(self.profile_url)
+        self.assertTemplateNotUsed(
+            response, 'posts/includes/post_card.html'
+        )
+        self.assertContains(response, self.post.text)
+
+    def test_post_edit_refreshes_card(self):
+        """Редактирование поста обновляет закешированную карточку"""
+        self.client.get(self.profile_url)
+        self.client_for_author.post(
+            reverse('posts:post_edit', args=(self.post.pk,)),
+            data={'text': 'Новый текст'},
         )
+        response = self.client.get(self.profile_url)
+        self.assertContains(response, 'Новый текст')
+        self.assertNotContains(response, 'Старый текст')
+
+    def test_deleted_comment_leaves_card_preview(self):
+        """Удалённый комментарий пропадает из превью, даже если число
+        комментариев вернулось прежним"""
+        comment = Comment.objects.create(
+            post=self.post, author=self.author, text='Удалённая реплика'
+        )
+        self.assertContains(
+            self.client.get(self.profile_url), 'Удалённая реплика'
+        )
+        updated = Post.objects.get(pk=self.post.pk).updated
+        comment.delete()
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Новая реплика'
+        )
+        response = self.client.get(self.profile_url)
+        self.assertContains(response, 'Новая реплика')
+        self.assertNotContains(response, 'Удалённая реплика')
+        # Удаление комментария не считается правкой поста.
+        self.assertEqual(Post.objects.get(pk=self.post.pk).updated, updated)
+
+    def test_card_shows_username_and_follows_renames(self):
+        """Карточка показывает логин автора без имени и обновляется
+        после переименования автора и группы"""
+        group = Group.objects.create(
+            title='Старая группа', slug='cards', description='Описание'
+        )
+        Post.objects.filter(pk=self.post.pk).update(group=group)
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'Автор: CardAuthor')
+        self.assertContains(response, '#Старая группа')
+        User.objects.filter(pk=self.author.pk).update(first_name='Новое')
+        group.title = 'Новая группа'
+        group.save()
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'Автор: Новое')
+        self.assertContains(response, '#Новая группа')
+
+    def test_card_shows_latest_comments(self):
+        """Карточка показывает число и последние комментарии поста"""
+        for number in range(settings.POST_CARD_COMMENTS + 1):
+            Comment.objects.create(
+                post=self.post, author=self.author, text=f'Реплика {number}'
+            )
+        self.client.get(self.profile_url)
+        self.client_for_author.post(
+            reverse('posts:add_comment', args=(self.post.pk,)),
+            data={'text': 'Свежая реплика'},
+        )
+        response = self.client.get(self.profile_url)
+        self.assertContains(
+            response,
+            'Комментариев: %s' % (settings.POST_CARD_COMMENTS + 2),
+        )
+        self.assertContains(response, 'Свежая реплика')
+        self.assertContains(response, 'Реплика 2')
+        self.assertNotContains(response, 'Реплика 1')
 
 
 class PaginatorViewsTest(TestCase):
@@ -306,6 +407,136 @@ class PaginatorViewsTest(TestCase):
                     )
                     self.assertEqual(len(response.context['page_obj']), count)
 
+    def test_cursor_pages_walk_forward_and_back(self):
+        """Курсорные страницы листаются вперёд и назад без потерь"""
+        url = reverse('posts:group_list', args=(self.group.slug,))
+        first = self.client_for_author_of_post.get(url).context['page_obj']
+        self.assertEqual(len(first), settings.POSTS_AMOUNT)
+        self.assertTrue(first.has_next())
+        self.assertFalse(first.has_previous())
+        second = self.client_for_author_of_post.get(
+            url, {'after': first.next_cursor}
+        ).context['page_obj']
+        self.assertEqual(len(second), settings.POSTS_AMOUNT2)
+        self.assertFalse(second.has_next())
+        self.assertEqual(
+            set(first) | set(second),
+            set(Post.objects.filter(group=self.group))
+        )
+        back = self.client_for_author_of_post.get(
+            url, {'before': second.previous_cursor}
+        ).context['page_obj']
+        self.assertEqual(list(back), list(first))
+
+    def test_broken_cursor_returns_first_page(self):
+        """Испорченный курсор открывает первую страницу"""
+        for cursor in ('not-a-cursor', encode_cursor(['вчера', 'x'])):
+            with self.subTest(cursor=cursor):
+                response = self.client_for_author_of_post.get(
+                    reverse('posts:index'), {'after': cursor}
+                )
+                self.assertEqual(
+                    len(response.context['page_obj']), settings.POSTS_AMOUNT
+                )
+
+
+@override_settings(COMMENTS_AMOUNT=3)
+class CommentPagesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.post = Post.objects.create(
+            text='Пост с обсуждением',
+            author=User.objects.create_user(username='Commented'),
+            group=Group.objects.create(
+                title='Обсуждения', slug='talks', description='Обсуждения'
+            ),
+        )
+        for number in range(5):
+            Comment.objects.create(
+                post=cls.post,
+                author=User.objects.create_user(username=f'reader{number}'),
+                text=f'Комментарий {number}',
+            )
+
+    def test_comments_paged_and_loaded_by_fragment(self):
+        """Комментарии листаются курсором, продолжение — фрагментом"""
+        response = self.client.get(
+            reverse('posts:post_detail', args=(self.post.pk,))
+        )
+        first = response.context['comments']
+        self.assertEqual(
+            [comment.text for comment in first],
+            ['Комментарий 4', 'Комментарий 3', 'Комментарий 2']
+        )
+        self.assertTrue(first.has_next())
+        fragment_url = reverse('posts:post_comments', args=(self.post.pk,))
+        self.assertContains(response, fragment_url)
+        # Автор каждого комментария загружается тем же запросом.
+        with self.assertNumQueries(2):
+            rest = self.client.get(
+                fragment_url, {'after': first.next_cursor}
+            )
+        self.assertTemplateNotUsed(rest, 'base.html')
+        self.assertEqual(
+            [comment.text for comment in rest.context['comments']],
+            ['Комментарий 1', 'Комментарий 0']
+        )
+        self.assertContains(rest, 'reader0')
+        self.assertNotContains(rest, fragment_url)
+
+    def test_comments_fragment_for_missing_post(self):
+        """Фрагмент комментариев несуществующего поста — 404"""
+        response = self.client.get(reverse('posts:post_comments', args=(0,)))
+        self.assertEqual(response.status_code, 404)
+
+
+class QueryBudgetTests(TestCase):
+    """Страницы с наполненной базой укладываются в бюджет запросов.
+
+    Тесты запускаются `core.testing.QueryBudgetRunner`, поэтому
+    превышение бюджета или N+1 во вьюхе роняет запрос исключением.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.group = Group.objects.create(
+            title='Бюджет', slug='budget', description='Бюджет'
+        )
+        for number in range(settings.POSTS_AMOUNT):
+            author = User.objects.create_user(username=f'writer{number}')
+            Follow.objects.create(user=cls.reader, author=author)
+            post = Post.objects.create(
+                text=f'Пост {number}', author=author, group=cls.group
+            )
+            Comment.objects.create(
+                post=post, author=author, text=f'Комментарий {number}'
+            )
+            Comment.objects.create(
+                post=post, author=cls.reader, text=f'Ответ {number}'
+            )
+        cls.post = post
+        for author in User.objects.filter(username__startswith='writer'):
+            Comment.objects.create(post=post, author=author, text='Ещё')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def test_pages_within_query_budget(self):
+        """Ленты, профиль и пост не делают запросов на каждую строку"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.post.author.username,)),
+            reverse('posts:follow_index'),
+            reverse('posts:post_detail', args=(self.post.pk,)),
+            reverse('posts:post_comments', args=(self.post.pk,)),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
 
 class FollowTests(TestCase):
     @classmethod
@@ -373,3 +604,524 @@ class FollowTests(TestCase):
             reverse('posts:follow_index')
         )
         self.assertNotContains(response, new_post.text)
+
+    def test_timeline_filled_and_pruned(self):
+        """Подписка заполняет ленту, новый пост рассылается,
+        отписка очищает ленту"""
+        Follow.objects.create(user=self.follower, author=self.bloogger)
+        new_post = Post.objects.create(
+            text='Пост после подписки',
+            author=self.bloogger,
+        )
+        self.assertEqual(
+            set(self.follower.timeline.values_list('post', flat=True)),
+            {self.post.pk, new_post.pk}
+        )
+        self.authorized_client_follower.get(
+            reverse('posts:profile_unfollow',
+                    kwargs={'username': self.bloogger.username})
+        )
+        self.assertFalse(self.follower.timeline.exists())
+
+    @override_settings(TIMELINE_CELEBRITY_FOLLOWERS=0)
+    def test_celebrity_posts_read_without_fan_out(self):
+        """Посты знаменитостей не рассылаются, но попадают в ленту"""
+        Follow.objects.create(user=self.follower, author=self.bloogger)
+        new_post = Post.objects.create(
+            text='Пост знаменитости',
+            author=self.bloogger,
+        )
+        self.assertFalse(TimelineEntry.objects.exists())
+        response = self.authorized_client_follower.get(
+            reverse('posts:follow_index')
+        )
+        self.assertEqual(
+            list(response.context['page_obj']), [new_post, self.post]
+        )
+
+    @override_settings(TIMELINE_CELEBRITY_FOLLOWERS=1)
+    def test_former_celebrity_posts_fanned_out(self):
+        """Посты бывшей знаменитости раскладываются по лентам"""
+        other = User.objects.create_user(username='TestOther')
+        Follow.objects.create(user=other, author=self.bloogger)
+        Follow.objects.create(user=self.follower, author=self.bloogger)
+        new_post = Post.objects.create(
+            text='Пост знаменитости', author=self.bloogger
+        )
+        self.assertFalse(self.follower.timeline.exists())
+        Follow.objects.filter(user=other).delete()
+        self.assertEqual(
+            set(self.follower.timeline.values_list('post', flat=True)),
+            {self.post.pk, new_post.pk}
+        )
+
+    @override_settings(TIMELINE_BACKFILL_LIMIT=3, POSTS_AMOUNT=2)
+    def test_pages_past_timeline_window(self):
+        """Посты старше окна ленты читаются и после подписки"""
+        posts = [self.post] + [
+            Post.objects.create(text=f'Пост {number}', author=self.bloogger)
+            for number in range(4)
+        ]
+        Follow.objects.create(user=self.follower, author=self.bloogger)
+        self.assertEqual(self.follower.timeline.count(), 3)
+        seen, params = [], {}
+        while True:
+            page = self.authorized_client_follower.get(
+                reverse('posts:follow_index'), params
+            ).context['page_obj']
+            seen.extend(page)
+            if not page.next_cursor:
+                break
+            params = {'after': page.next_cursor}
+        self.assertEqual(seen, posts[::-1])
+
+    def test_profile_following_flag(self):
+        """Флаг подписки в профиле учитывает только подписки читателя
+        и сбрасывается после отписки"""
+        profile_url = reverse(
+            'posts:profile', kwargs={'username': self.bloogger.username}
+        )
+        Follow.objects.create(user=self.bloogger, author=self.follower)
+        response = self.authorized_client_follower.get(profile_url)
+        self.assertFalse(response.context['following'])
+        self.authorized_client_follower.get(
+            reverse('posts:profile_follow',
+                    kwargs={'username': self.bloogger.username})
+        )
+        response = self.authorized_client_follower.get(profile_url)
+        self.assertTrue(response.context['following'])
+        self.authorized_client_follower.get(
+            reverse('posts:profile_unfollow',
+                    kwargs={'username': self.bloogger.username})
+        )
+        response = self.authorized_client_follower.get(profile_url)
+        self.assertFalse(response.context['following'])
+
+    def test_repeated_follow_is_idempotent(self):
+        """Повторная подписка не создаёт дубль и не меняет счётчики"""
+        follow_url = reverse(
+            'posts:profile_follow',
+            kwargs={'username': self.bloogger.username}
+        )
+        self.authorized_client_follower.get(follow_url)
+        self.authorized_client_follower.get(follow_url)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(UserStats.objects.get(
+            user=self.bloogger
+        ).followers_count, 1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.follower, author=self.bloogger)
+
+    def test_follow_unknown_author(self):
+        """Подписка и отписка от несуществующего автора — 404"""
+        for name in ('posts:profile_follow', 'posts:profile_unfollow'):
+            with self.subTest(name=name):
+                response = self.authorized_client_follower.get(
+                    reverse(name, kwargs={'username': 'nobody'})
+                )
+                self.assertEqual(response.status_code, 404)
+
+
+@override_settings(POSTS_AMOUNT=2)
+class SearchViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.kittens = Post.objects.create(
+            author=cls.author, text='Котята и ёлка во дворе'
+        )
+        cls.kitten = Post.objects.create(
+            author=cls.author, text='Котёнок спит. Котёнок, котёнок!'
+        )
+        cls.other = Post.objects.create(
+            author=cls.author, text='Совсем другая запись'
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query, **params):
+        return self.client.get(
+            reverse('posts:search'), {'q': query, **params}
+        )
+
+    def test_russian_word_forms_match(self):
+        """Поиск находит другие формы слова и не различает ё и е"""
+        response = self.search('ДВОРОМ')
+        self.assertEqual(list(response.context['page_obj']), [self.kittens])
+        response = self.search('елки')
+        self.assertEqual(list(response.context['page_obj']), [self.kittens])
+
+    def test_results_ranked_and_paged_by_cursor(self):
+        """Результаты идут по релевантности и листаются курсором"""
+        Post.objects.create(author=self.author, text='Один котёнок')
+        Post.objects.create(author=self.author, text='Ещё котёнок')
+        page = self.search('котенок').context['page_obj']
+        self.assertEqual(page[0], self.kitten)
+        self.assertTrue(page.has_next())
+        response = self.search('котенок', after=page.next_cursor)
+        self.assertEqual(len(response.context['page_obj']), 1)
+        self.assertContains(response, '?q=%s&amp;before=' % quote('котенок'))
+
+    def test_index_follows_edits_and_deletes(self):
+        """Индекс обновляется при изменении и удалении постов"""
+        self.other.text = 'Теперь тоже во дворе'
+        self.other.save()
+        Post.objects.filter(pk=self.kittens.pk).delete()
+        response = self.search('двор')
+        self.assertEqual(list(response.context['page_obj']), [self.other])
+
+    def test_query_syntax_is_not_interpreted(self):
+        """Операторы FTS5 в запросе не ломают поиск"""
+        response = self.search('"котята*" ^(')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['page_obj']), [self.kittens])
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        for number in range(settings.POSTS_AMOUNT + 2):
+            Post.objects.create(
+                author=cls.author, group=cls.group, text=f'Пост {number}'
+            )
+        cls.post = Post.objects.latest('pk')
+        Comment.objects.create(post=cls.post, author=cls.reader, text='Да')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_feeds_return_compact_json(self):
+        """Ленты отдают посты JSON с курсором следующей страницы"""
+        urls = (
+            reverse('api:index'),
+            reverse('api:group_list', args=[self.group.slug]),
+            reverse('api:profile', args=[self.author.username]),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                data = self.client.get(url).json()
+                self.assertEqual(
+                    len(data['results']), settings.POSTS_AMOUNT
+                )
+                self.assertEqual(data['results'][0]['id'], self.post.pk)
+                self.assertEqual(data['results'][0]['author'], 'auth')
+                self.assertIsNone(data['previous'])
+                rest = self.client.get(data['next']).json()['results']
+                self.assertEqual(len(rest), 2)
+
+    def test_post_detail_includes_comments(self):
+        """Пост отдаётся с первой страницей комментариев"""
+        data = self.client.get(
+            reverse('api:post_detail', args=[self.post.pk])
+        ).json()
+        self.assertEqual(data['text'], self.post.text)
+        self.assertEqual(data['comments'][0]['text'], 'Да')
+        self.assertIsNone(data['next_comments'])
+
+    def test_follow_index_requires_login(self):
+        """Лента подписок без входа — 401, со входом — посты авторов"""
+        url = reverse('api:follow_index')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        data = self.reader_client.get(url).json()
+        self.assertEqual(data['results'][0]['id'], self.post.pk)
+
+    def test_unchanged_feed_answers_not_modified(self):
+        """Неизменившаяся лента отвечает 304 без SQL, новый пост — 200"""
+        url = reverse('api:index')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(
+            self.client.get(url + '?after=x')['ETag'], etag
+        )
+        Post.objects.create(author=self.author, text='Новый пост')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_follow_changes_follow_feed_etag(self):
+        """ETag ленты подписок меняется при отписке"""
+        url = reverse('api:follow_index')
+        etag = self.reader_client.get(url)['ETag']
+        Follow.objects.filter(user=self.reader).delete()
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [])
+
+
+class ConditionalFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        Post.objects.create(author=cls.author, group=cls.group, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_feeds_answer_not_modified(self):
+        """Неизменившиеся ленты отвечают 304, новый пост меняет ETag"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+        etag = self.client.get(urls[0])['ETag']
+        Post.objects.create(author=self.author, text='Новый пост')
+        response = self.client.get(urls[0], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_cache_control_depends_on_user(self):
+        """Анонимам страница кешируется публично, вошедшим — приватно"""
+        url = reverse('posts:index')
+        anonymous = self.client.get(url)
+        self.assertIn('public', anonymous['Cache-Control'])
+        self.assertIn(
+            'max-age=%s' % settings.FEED_HTTP_MAX_AGE,
+            anonymous['Cache-Control'],
+        )
+        self.assertFalse(anonymous.has_header('Expires'))
+        reader = self.reader_client.get(url)
+        self.assertIn('private', reader['Cache-Control'])
+        self.assertIn('no-cache', reader['Cache-Control'])
+        self.assertNotEqual(reader['ETag'], anonymous['ETag'])
+
+    def test_follow_changes_profile_etag(self):
+        """Новый подписчик меняет ETag профиля автора"""
+        url = reverse('posts:profile', args=[self.author.username])
+        etag = self.client.get(url)['ETag']
+        self.reader_client.get(
+            reverse('posts:profile_follow', args=[self.author.username])
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Подписчиков: 1')
+
+    def test_renamed_username_maps_to_new_owner(self):
+        """Освободившееся имя не указывает на прежнего владельца"""
+        old_name = self.author.username
+        self.assertEqual(follow_graph.user_id(old_name), self.author.pk)
+        author = User.objects.get(pk=self.author.pk)
+        author.username = 'renamed'
+        author.save()
+        newcomer = User.objects.create_user(username=old_name)
+        self.assertEqual(follow_graph.user_id(old_name), newcomer.pk)
+        self.assertEqual(follow_graph.user_id('renamed'), self.author.pk)
+        author.last_login = newcomer.date_joined
+        with self.assertNumQueries(1):
+            author.save(update_fields=['last_login'])
+
+    def test_author_rename_refreshes_cached_index(self):
+        """Новое имя автора сразу видно на закешированной главной"""
+        url = reverse('posts:index')
+        etag = self.client.get(url)['ETag']
+        author = User.objects.get(pk=self.author.pk)
+        author.first_name, author.last_name = 'Лев', 'Толстой'
+        author.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Лев Толстой')
+
+    def test_cached_page_not_shared_between_users(self):
+        """Равные номера поколений подписок не смешивают страницы"""
+        other = User.objects.create_user(username='other_reader')
+        other_client = Client()
+        other_client.force_login(other)
+        for user in (self.reader, other):
+            cache.set(
+                GENERATION_KEY.format(
+                    namespace=follow_graph.namespace(user.pk)
+                ),
+                1, None,
+            )
+        url = reverse('posts:index')
+        self.assertContains(self.reader_client.get(url), 'reader')
+        response = other_client.get(url)
+        self.assertContains(response, 'other_reader')
+
+
+@override_settings(
+    WRITE_BEHIND_ENABLED=True, WRITE_BEHIND_AUTOFLUSH=False,
+    WRITE_BEHIND_SPOOL=None,
+)
+class WriteBehindTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='Queued')
+        cls.author = User.objects.create_user(username='QueueAuthor')
+        cls.post = Post.objects.create(text='Пост', author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        writebehind.flush()
+        self.client.force_login(self.reader)
+
+    def test_comment_and_follow_applied_on_flush(self):
+        """Комментарий и подписка ждут в очереди до сброса"""
+        self.client.post(
+            reverse('posts:add_comment', args=(self.post.pk,)),
+            {'text': 'Отложенный'},
+        )
+        self.client.get(reverse('posts:profile_follow', args=('QueueAuthor',)))
+        self.assertEqual(writebehind.pending(), 2)
+        self.assertFalse(Comment.objects.exists())
+        writebehind.flush()
+        self.assertEqual(writebehind.pending(), 0)
+        self.assertEqual(
+            Comment.objects.get(post=self.post).text, 'Отложенный'
+        )
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertTrue(Follow.objects.filter(
+            user=self.reader, author=self.author
+        ).exists())
+        self.assertEqual(UserStats.objects.get(
+            user=self.author
+        ).followers_count, 1)
+
+    def test_repeated_batch_creates_no_duplicates(self):
+        """Повторное применение пачки не дублирует записи"""
+        writebehind.add_comment(self.reader, self.post, 'Один раз')
+        writebehind.follow(self.reader.pk, self.author.pk)
+        batch = writebehind.get_spool().claim(10)
+        writebehind.apply([operation for _, operation in batch])
+        writebehind.apply([operation for _, operation in batch])
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(Follow.objects.count(), 1)
+
+    def test_unfollow_after_follow_in_one_batch(self):
+        """Подписка и отписка в одной пачке дают итог — без подписки"""
+        writebehind.follow(self.reader.pk, self.author.pk)
+        writebehind.unfollow(self.reader.pk, self.author.pk)
+        writebehind.flush()
+        self.assertFalse(Follow.objects.exists())
+
+    def test_operations_for_deleted_post_are_skipped(self):
+        """Комментарий к удалённому посту не ломает пачку"""
+        post = Post.objects.create(text='Удалят', author=self.author)
+        writebehind.add_comment(self.reader, post, 'Опоздал')
+        writebehind.follow(self.reader.pk, self.author.pk)
+        post.delete()
+        writebehind.flush()
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(Follow.objects.count(), 1)
+
+    def test_failing_operation_moved_out_of_queue(self):
+        """Падающая операция не держит очередь и после
+        WRITE_BEHIND_MAX_ATTEMPTS попыток убирается из неё"""
+        poison = writebehind.enqueue(
+            writebehind.COMMENT, user_id=self.reader.pk,
+            post_id=self.post.pk, text=None,
+        )
+        writebehind.follow(self.reader.pk, self.author.pk)
+        spool = writebehind.get_spool()
+        with self.assertLogs('posts.writebehind', 'ERROR'):
+            for _ in range(settings.WRITE_BEHIND_MAX_ATTEMPTS):
+                writebehind.flush_batch(spool)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertNotIn(poison, spool)
+        self.assertEqual(writebehind.pending(), 0)
+        self.assertEqual([op['text'] for op in spool.failed], [None])
+
+    def test_wait_applied(self):
+        """Запрос дожидается своей операции только до таймаута"""
+        pk = writebehind.follow(self.reader.pk, self.author.pk)
+        self.assertFalse(writebehind.wait_applied(pk, 0.02))
+        writebehind.flush()
+        self.assertTrue(writebehind.wait_applied(pk, 0))
+
+    def test_no_wait_by_default(self):
+        """По умолчанию запрос не ждёт сброса своей операции"""
+        pk = writebehind.follow(self.reader.pk, self.author.pk)
+        with mock.patch.object(writebehind.transaction, 'on_commit') as hook:
+            writebehind.wait_on_commit(pk)
+            hook.assert_not_called()
+            with override_settings(WRITE_BEHIND_WAIT=0.5):
+                writebehind.wait_on_commit(pk)
+            hook.assert_called_once()
+
+    def test_disk_spool_flush(self):
+        """Файловая очередь применяется так же, как очередь в памяти"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(
+            WRITE_BEHIND_SPOOL=os.path.join(directory, 'spool.sqlite3')
+        ):
+            self.addCleanup(writebehind.get_spool().close)
+            writebehind.add_comment(self.reader, self.post, 'С диска')
+            self.assertEqual(writebehind.pending(), 1)
+            writebehind.flush()
+            self.assertEqual(writebehind.pending(), 0)
+        self.assertEqual(Comment.objects.get().text, 'С диска')
+
+
+@override_settings(WRITE_BEHIND_MAX_ATTEMPTS=2)
+class DiskSpoolTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'spool.sqlite3')
+        # Два экземпляра над одним файлом — как два процесса узла.
+        self.first = writebehind.DiskSpool(path)
+        self.second = writebehind.DiskSpool(path)
+        self.addCleanup(self.first.close)
+        self.addCleanup(self.second.close)
+        self.ids = [self.first.put({'number': number}) for number in range(3)]
+
+    def numbers(self, batch):
+        return [operation['number'] for _, operation in batch]
+
+    def test_lease_and_ack(self):
+        """Пачку держит только один сбрасыватель, ack убирает её"""
+        batch = self.first.claim(2)
+        self.assertEqual(self.numbers(batch), [0, 1])
+        self.assertIn(self.ids[0], self.second)
+        self.assertEqual(self.second.claim(2), [])
+        self.first.ack(pk for pk, _ in batch)
+        self.assertNotIn(self.ids[0], self.second)
+        self.assertEqual(self.numbers(self.second.claim(2)), [2])
+        self.assertEqual(len(self.first), 1)
+
+    def test_expired_lease_recovered(self):
+        """Пачку умершего сбрасывателя после аренды забирает другой"""
+        self.first.claim(2)
+        self.first.close()
+        later = time.time() + writebehind.LEASE_SECONDS + 1
+        with mock.patch('posts.writebehind.time.time', return_value=later):
+            self.assertEqual(self.numbers(self.second.claim(2)), [0, 1])
+
+    def test_release_returns_batch_to_queue(self):
+        """Снятая аренда сразу отдаёт пачку, попытки копятся до списка
+        неудачных"""
+        self.first.claim(2)
+        self.assertEqual(self.first.release([self.ids[0]], failed=True), [])
+        self.first.ack([self.ids[1]])
+        self.assertEqual(self.numbers(self.second.claim(1)), [0])
+        self.assertEqual(
+            self.second.release([self.ids[0]], failed=True), [{'number': 0}]
+        )
+        self.assertEqual(self.first.failed, [{'number': 0}])
+        self.assertEqual(self.numbers(self.first.claim(5)), [2])
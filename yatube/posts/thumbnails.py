@@ -0,0 +1,83 @@
+"""Фоновая подготовка миниатюр картинок постов.
+
+После сохранения поста его картинка ставится в очередь локального
+пула потоков, который заранее строит миниатюры всех размеров из
+`settings.POST_THUMBNAIL_GEOMETRIES` и адаптивные варианты
+(`posts.variants`). Страницы ленты затем только находят готовые файлы.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from sorl.thumbnail import get_thumbnail
+from sorl.thumbnail.images import ImageFile
+
+from core.querycount import uncounted
+
+from . import variants
+from .models import Post, media_storage
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails',
+            )
+    return _executor
+
+
+def _thumbnails(name):
+    # Ключ sorl-thumbnail включает хранилище: оно должно совпадать
+    # с хранилищем поля, которое видят шаблоны.
+    source = ImageFile(name, media_storage)
+    for geometry, options in settings.POST_THUMBNAIL_GEOMETRIES:
+        get_thumbnail(source, geometry, **options)
+
+
+def prepare(post_id):
+    """Строит миниатюры и адаптивные варианты картинки поста."""
+    try:
+        post = Post.objects.filter(pk=post_id).first()
+        if post is None or not post.image:
+            return
+        _thumbnails(post.image.name)
+        variants.generate(post)
+    except Exception:
+        logger.exception('Не удалось построить варианты поста %s', post_id)
+
+
+def in_pool(func, *args):
+    """Задача пула; поток живёт дольше запроса, соединение с БД — нет."""
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def inline(func, *args):
+    """Задача пула, выполненная на месте: не входит в бюджет вьюхи."""
+    with uncounted():
+        return func(*args)
+
+
+def schedule(post):
+    """Ставит картинку поста в очередь после коммита транзакции."""
+    if not post.image:
+        return
+    post_id = post.pk
+    if settings.THUMBNAIL_PREGENERATE_SYNC:
+        transaction.on_commit(lambda: inline(prepare, post_id))
+    else:
+        transaction.on_commit(
+            lambda: get_executor().submit(in_pool, prepare, post_id)
+        )
@@ -0,0 +1,235 @@
+"""Лента подписок: гибрид fan-out-on-write и fan-out-on-read.
+
+Посты обычных авторов при публикации раскладываются в `TimelineEntry`
+каждого подписчика. Посты «знаменитостей» (больше
+`settings.TIMELINE_CELEBRITY_FOLLOWERS` подписчиков) не рассылаются,
+а подмешиваются при чтении ленты из индекса `(author, pub_date)`.
+Когда автор перестаёт быть знаменитостью, его последние посты
+раскладываются по лентам всех подписчиков (`followers_dropped`).
+
+Подписка добавляет в ленту только `TIMELINE_BACKFILL_LIMIT` последних
+постов автора, поэтому материализованная лента точна лишь в окне из
+первых `TIMELINE_BACKFILL_LIMIT` записей: в нём у каждого автора есть
+все посты. Страницы дальше окна читаются запросом Follow⋈Post.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+
+from . import follow_graph
+from .models import Follow, Post, TimelineEntry, UserStats
+from .paginators import CursorPaginator
+
+TIMELINE_ORDERING = ('-pub_date', '-post_id')
+
+
+class RawSubquery(RawSQL):
+    """RawSQL для `__in`: скобки ставит сам IN, а двойные SQLite
+    прочитал бы как скалярный подзапрос — первое значение."""
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def celebrity_ids(author_ids):
+    """Авторы из `author_ids`, посты которых читаются без рассылки."""
+    return set(UserStats.objects.filter(
+        user__in=author_ids,
+        followers_count__gt=settings.TIMELINE_CELEBRITY_FOLLOWERS,
+    ).values_list('user_id', flat=True))
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if celebrity_ids([post.author_id]):
+        return
+    followers = set(
+        Follow.objects.filter(author_id=post.author_id)
+        .values_list('user_id', flat=True)
+    )
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+            for user_id in followers
+        ),
+        batch_size=settings.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту последние посты автора после подписки."""
+    if celebrity_ids([author_id]):
+        return
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        'pk', 'pub_date'
+    )[:settings.TIMELINE_BACKFILL_LIMIT]
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+            for pk, pub_date in posts
+        ),
+        batch_size=settings.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def followers_dropped(author_id):
+    """Раскладывает посты автора, который перестал быть знаменитостью.
+
+    Посты, которые он написал, и подписки на него, сделанные, пока он
+    был знаменитостью, в ленты не попадали. Автору, ставшему знаменитостью,
+    ничего делать не нужно: его посты читаются напрямую, а уже
+    разосланные записи не мешают.
+    """
+    if UserStats.objects.filter(
+        user_id=author_id,
+        followers_count=settings.TIMELINE_CELEBRITY_FOLLOWERS,
+    ).exists():
+        rebuild([author_id])
+
+
+def prune(user_id, author_id):
+    """Убирает из ленты посты автора после отписки."""
+    TimelineEntry.objects.filter(
+        user_id=user_id,
+        post__in=Post.objects.filter(author_id=author_id).values('pk'),
+    ).delete()
+
+
+def rebuild(author_ids=None):
+    """Раскладывает посты по лентам; возвращает число новых записей.
+
+    Как и `backfill`, берёт не больше `TIMELINE_BACKFILL_LIMIT`
+    последних постов каждого автора и пропускает знаменитостей; нужна
+    после массовой загрузки постов и подписок в обход сигналов. Без
+    `author_ids` ленты сначала очищаются, с ними — только дополняются
+    постами этих авторов.
+    """
+    entries, follows, posts, stats = (
+        connection.ops.quote_name(model._meta.db_table)
+        for model in (TimelineEntry, Follow, Post, UserStats)
+    )
+    if author_ids is None:
+        chunks = [None]
+    else:
+        author_ids = sorted(author_ids)
+        chunks = [
+            author_ids[start:start + settings.TIMELINE_BATCH_SIZE]
+            for start in range(0, len(author_ids),
+                               settings.TIMELINE_BATCH_SIZE)
+        ]
+    created = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        if author_ids is None:
+            TimelineEntry.objects.all().delete()
+        for chunk in chunks:
+            authors = '' if chunk is None else 'WHERE author_id IN (%s)' % (
+                ', '.join('%s' for _ in chunk)
+            )
+            cursor.execute(
+                f'INSERT INTO {entries} (user_id, post_id, pub_date) '
+                f'SELECT follow.user_id, post.id, post.pub_date '
+                f'FROM {follows} follow JOIN ('
+                f'SELECT id, author_id, pub_date, ROW_NUMBER() OVER ('
+                f'PARTITION BY author_id ORDER BY pub_date DESC, id DESC'
+                f') AS position FROM {posts} {authors}'
+                f') post ON post.author_id = follow.author_id '
+                f'WHERE post.position <= %s AND follow.author_id NOT IN ('
+                f'SELECT user_id FROM {stats} WHERE followers_count > %s) '
+                f'ON CONFLICT DO NOTHING',
+                [
+                    *(chunk or []),
+                    settings.TIMELINE_BACKFILL_LIMIT,
+                    settings.TIMELINE_CELEBRITY_FOLLOWERS,
+                ],
+            )
+            created += cursor.rowcount
+    return created
+
+
+class TimelinePaginator(CursorPaginator):
+    """Курсорная пагинация ленты подписок.
+
+    `object_list` — все посты ленты (`feeds.follow_feed`); из него
+    напрямую читаются только посты знаменитостей, остальное берётся
+    из материализованной ленты, и обе выборки сливаются по ключу.
+    """
+
+    def __init__(self, object_list, per_page, after=None, before=None,
+                 user=None):
+        super().__init__(object_list, per_page, after=after, before=before)
+        self.user = user
+
+    def timeline_queryset(self):
+        return self.window(
+            TimelineEntry.objects.filter(user=self.user).select_related(
+                'post__author', 'post__group'
+            ),
+            ordering=TIMELINE_ORDERING,
+        )
+
+    def boundary_queryset(self):
+        """Последняя запись окна, в котором лента точна."""
+        limit = settings.TIMELINE_BACKFILL_LIMIT
+        return TimelineEntry.objects.filter(user=self.user).order_by(
+            *TIMELINE_ORDERING
+        ).values_list('pub_date', 'post_id')[limit - 1:limit]
+
+    def celebrity_queryset(self, author_ids):
+        """Посты знаменитостей для страницы.
+
+        С `author__in` SQLite сортировал бы все посты всех знаменитостей;
+        вместо этого каждая берёт своё окно по индексу
+        `(author, pub_date)`, и окна склеиваются через UNION ALL.
+        """
+        windows = [
+            self.window(Post.objects.filter(author_id=author_id).values(
+                'pk'
+            )).query.sql_with_params()
+            for author_id in sorted(author_ids)
+        ]
+        ids = RawSubquery(
+            ' UNION ALL '.join(
+                'SELECT * FROM (%s)' % sql for sql, _ in windows
+            ),
+            [param for _, params in windows for param in params],
+        )
+        return self.window(
+            Post.objects.filter(pk__in=ids).select_related('author', 'group')
+        )
+
+    def in_window(self, rows):
+        """Точна ли страница `rows`, собранная из ленты."""
+        first_page = self.after is None and self.before is None
+        if first_page and self.per_page < settings.TIMELINE_BACKFILL_LIMIT:
+            # Первая страница вместе с лишней строкой умещается в окне.
+            return True
+        boundary = self.boundary_queryset().first()
+        if boundary is None:
+            return True
+        # Страница назад лежит между курсором и началом ленты, вперёд —
+        # между курсором и последней строкой (или концом ленты).
+        if self.before is not None:
+            oldest = self.before
+        elif len(rows) > self.per_page:
+            oldest = self._key(rows[-1])
+        else:
+            return False
+        return tuple(oldest) >= boundary
+
+    def fetch(self):
+        posts = {entry.post.pk: entry.post
+                 for entry in self.timeline_queryset()}
+        celebrities = celebrity_ids(
+            follow_graph.FollowGraph(self.user).following_ids
+        )
+        if celebrities:
+            for post in self.celebrity_queryset(celebrities):
+                posts.setdefault(post.pk, post)
+        rows = sorted(
+            posts.values(), key=self._key, reverse=self.before is None
+        )[:self.per_page + 1]
+        if not self.in_window(rows):
+            return super().fetch()
+        return rows
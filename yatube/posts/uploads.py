@@ -0,0 +1,134 @@
+"""Приём картинок постов с ограниченным расходом памяти.
+
+Загрузка крупнее `FILE_UPLOAD_MAX_MEMORY_SIZE` уже лежит во временном
+файле. Размер картинки читается из заголовка без декодирования, и
+слишком большие файлы отклоняются до того, как Pillow выделит память
+под пиксели. Остальные картинки уменьшаются до
+`POST_IMAGE_MAX_SIDE` (JPEG — ещё при декодировании, через `draft`)
+и пересохраняются без метаданных: EXIF с координатами съёмки не
+попадает в медиа. Многокадровые MPO с камер телефонов сохраняются как
+JPEG из первого кадра, анимации (GIF, WebP, APNG) — покадрово, тоже
+без метаданных.
+"""
+import os
+import tempfile
+
+from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageOps, ImageSequence
+
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 90, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 90},
+}
+# Режимы, которые JPEG сохраняет без преобразования.
+JPEG_MODES = ('RGB', 'L', 'CMYK')
+# Форматы, из которых сохраняется только первый кадр: во втором кадре
+# MPO лежит превью или снимок для стереопары.
+SAVE_AS = {'MPO': 'JPEG'}
+# Сведения кадра, нужные для воспроизведения анимации. Остальные
+# (комментарии, XMP, EXIF) Pillow записал бы в файл.
+FRAME_INFO = (
+    'duration', 'transparency', 'background', 'disposal', 'icc_profile',
+)
+
+
+def _open(data):
+    if hasattr(data, 'temporary_file_path'):
+        return Image.open(data.temporary_file_path())
+    data.seek(0)
+    return Image.open(data)
+
+
+def check_limits(data, image):
+    """Отклоняет файл по размеру и по числу пикселей из заголовка."""
+    if data.size > settings.POST_IMAGE_MAX_BYTES:
+        raise forms.ValidationError(
+            'Файл больше %(limit)s.',
+            code='file_too_large',
+            params={'limit': filesizeformat(settings.POST_IMAGE_MAX_BYTES)},
+        )
+    width, height = image.size
+    frames = 1 if image.format in SAVE_AS else getattr(image, 'n_frames', 1)
+    if width * height * frames > settings.POST_IMAGE_MAX_PIXELS:
+        raise forms.ValidationError(
+            'Картинка %(width)s×%(height)s слишком большая.',
+            code='too_many_pixels',
+            params={'width': width, 'height': height},
+        )
+
+
+def normalize(image):
+    """Уменьшенная до допустимого размера картинка без метаданных."""
+    max_side = settings.POST_IMAGE_MAX_SIDE
+    # Для JPEG декодер сразу уменьшает картинку в 2–8 раз.
+    image.draft(image.mode, (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    return image
+
+
+def _save(image, image_format, data, **extra):
+    options = dict(SAVE_OPTIONS.get(image_format, {}), **extra)
+    icc_profile = image.info.get('icc_profile')
+    if icc_profile:
+        # Цветовой профиль — не персональные данные, без него
+        # меняются цвета.
+        options['icc_profile'] = icc_profile
+    if image_format == 'JPEG' and image.mode not in JPEG_MODES:
+        image = image.convert('RGB')
+    # Безымянный временный файл: хранилище скопирует его по частям.
+    file = tempfile.TemporaryFile()
+    image.save(file, image_format, **options)
+    size = file.tell()
+    file.seek(0)
+    return UploadedFile(
+        file, os.path.basename(data.name), data.content_type, size,
+        data.charset
+    )
+
+
+def _save_animation(source, image_format, data):
+    max_side = settings.POST_IMAGE_MAX_SIDE
+    frames = []
+    for frame in ImageSequence.Iterator(source):
+        info = {
+            key: value for key, value in frame.info.items()
+            if key in FRAME_INFO
+        }
+        frame = frame.copy()
+        frame.info = info
+        frame.thumbnail((max_side, max_side), Image.LANCZOS)
+        frames.append(frame)
+    return _save(
+        frames[0], image_format, data,
+        save_all=True,
+        append_images=frames[1:],
+        duration=[frame.info.get('duration', 100) for frame in frames],
+        loop=source.info.get('loop', 0),
+    )
+
+
+def process(data):
+    """Проверяет загруженную картинку и готовит её к сохранению.
+
+    Вызывается после стандартной проверки `forms.ImageField`.
+    """
+    # Открытая по пути картинка держит дескриптор временного файла.
+    with _open(data) as source:
+        check_limits(data, source)
+        image_format = SAVE_AS.get(source.format, source.format)
+        if image_format not in Image.SAVE:
+            data.seek(0)
+            return data
+        if (getattr(source, 'is_animated', False)
+                and source.format not in SAVE_AS):
+            return _save_animation(source, image_format, data)
+        # exif_transpose возвращает копию, она переживёт закрытие.
+        image = normalize(source)
+    result = _save(image, image_format, data)
+    result.image = image
+    return result
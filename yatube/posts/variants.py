@@ -0,0 +1,125 @@
+"""Адаптивные варианты картинок постов.
+
+Картинка поста обрезается под пропорции карточки и сохраняется в
+нескольких ширинах и форматах (`settings.POST_IMAGE_VARIANT_*`).
+Варианты записываются в `PostImageVariant`, а шаблонный тег
+`post_picture` выводит их как `<picture>` с `srcset`: браузер сам
+выбирает самый лёгкий подходящий файл.
+"""
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from PIL import Image, ImageOps
+
+from core.cache import bump_generation
+from core.metrics import timed
+
+from .models import Post, PostImageVariant
+from .signals import POSTS_NAMESPACE
+
+CONTENT_TYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+EXTENSIONS = {'jpeg': 'jpg'}
+
+
+def supported_formats():
+    """Форматы из настроек, которые умеет сохранять установленный Pillow."""
+    Image.init()
+    return [
+        name for name in settings.POST_IMAGE_VARIANT_FORMATS
+        if name.upper() in Image.SAVE
+    ]
+
+
+def _widths(source_width):
+    # Растягивать картинку шире оригинала бессмысленно, но хотя бы
+    # один вариант нужен всегда.
+    widths = sorted(settings.POST_IMAGE_VARIANT_WIDTHS)
+    return [width for width in widths if width <= source_width] or widths[:1]
+
+
+def _encode(image, name):
+    buffer = io.BytesIO()
+    options = {'quality': settings.POST_IMAGE_VARIANT_QUALITY.get(name, 80)}
+    if name == 'jpeg':
+        options.update(optimize=True, progressive=True)
+    image.save(buffer, name.upper(), **options)
+    return buffer.getvalue()
+
+
+def _open(post):
+    with post.image.open('rb') as file:
+        image = Image.open(file)
+        image.load()
+    # У анимаций берётся первый кадр, как и у sorl-thumbnail.
+    return ImageOps.exif_transpose(image).convert('RGB')
+
+
+def _encode_variants(post):
+    source = _open(post)
+    aspect_width, aspect_height = settings.POST_IMAGE_VARIANT_ASPECT
+    variants = []
+    for width in _widths(source.width):
+        height = round(width * aspect_height / aspect_width)
+        frame = ImageOps.fit(source, (width, height), Image.LANCZOS)
+        for name in supported_formats():
+            variant = PostImageVariant(
+                post=post, width=width, height=height, format=name
+            )
+            # Имя файла задаёт хранилище по хешу содержимого.
+            variant.image.save(
+                'variant.%s' % EXTENSIONS.get(name, name),
+                ContentFile(_encode(frame, name)),
+                save=False,
+            )
+            variants.append(variant)
+    return variants
+
+
+def _copy_variants(post):
+    """Варианты той же картинки, уже построенные для другого поста."""
+    twin_id = (
+        PostImageVariant.objects
+        .filter(post__image=post.image.name)
+        .exclude(post_id=post.pk)
+        .values_list('post_id', flat=True)
+        .first()
+    )
+    if twin_id is None:
+        return []
+    return [
+        PostImageVariant(
+            post=post, width=variant.width, height=variant.height,
+            format=variant.format, image=variant.image.name,
+        )
+        for variant in PostImageVariant.objects.filter(post_id=twin_id)
+    ]
+
+
+def generate(post):
+    """Строит варианты картинки `post` и заменяет ими прежние.
+
+    Одинаковые картинки хранятся одним файлом, поэтому варианты
+    дубликата не кодируются заново, а копируются у другого поста.
+    """
+    variants = []
+    if post.image:
+        variants = _copy_variants(post)
+        if not variants:
+            with timed('thumbnail'):
+                variants = _encode_variants(post)
+    with transaction.atomic():
+        # Файлы удалённых вариантов стирает сигнал после коммита.
+        for variant in PostImageVariant.objects.filter(post=post):
+            variant.delete()
+        PostImageVariant.objects.bulk_create(variants)
+        # Новая версия меняет ключ кеша карточки поста.
+        Post.objects.filter(pk=post.pk).update(revision=F('revision') + 1)
+        bump_generation(POSTS_NAMESPACE)
+    return variants
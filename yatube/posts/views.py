@@ -2,33 +2,89 @@ from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, get_object_or_404, redirect
 from django.core.paginator import Paginator
 from django.conf import settings
-from django.views.decorators.cache import cache_page
+from django.db import transaction
 from django.urls import reverse
+from django.utils.http import urlencode
+
+from core.cache import (cache_control_by_user, cache_page_by_generation,
+                        condition_by_generation)
+from core.querycount import query_budget
+from core.replicas import replica_reads
 
 from posts.forms import PostForm, CommentForm
-from .models import Post, Group, User, Follow
+from . import (counters, feeds, follow_graph, search, thumbnails,
+               writebehind)
+from .cards import attach_cards
+from .models import Post, Group, User
+from .paginators import CursorPaginator
+from .signals import POSTS_NAMESPACE
+from .timeline import TimelinePaginator
+
+
+def feed_namespaces(request, *args, **kwargs):
+    # Страница зависит от постов и, через значки «вы подписаны»
+    # и шапку, от подписок текущего пользователя.
+    if request.user.is_authenticated:
+        return [POSTS_NAMESPACE, follow_graph.namespace(request.user.pk)]
+    return [POSTS_NAMESPACE]
+
 
+def profile_namespaces(request, username):
+    # Шапка профиля показывает подписки и подписчиков автора.
+    names = feed_namespaces(request)
+    author_id = follow_graph.user_id(username)
+    if author_id is not None:
+        names += [
+            follow_graph.namespace(author_id),
+            follow_graph.followers_namespace(author_id),
+        ]
+    return names
 
-def get_page_object(request, posts):
-    paginator = Paginator(posts, settings.POSTS_AMOUNT)
+
+def get_page_object(request, posts, paginator_class=CursorPaginator,
+                    **kwargs):
+    # Старые ссылки вида ?page=N продолжают работать через OFFSET,
+    # всё остальное листается курсорами ?after=/?before=.
     page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+    if page_number is not None:
+        return Paginator(posts, settings.POSTS_AMOUNT).get_page(page_number)
+    paginator = paginator_class(
+        posts,
+        settings.POSTS_AMOUNT,
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        **kwargs
+    )
+    return paginator.get_page()
 
 
-@cache_page(20, key_prefix="index_page")
+@query_budget(7)
+@replica_reads
+@cache_control_by_user(settings.FEED_HTTP_MAX_AGE)
+@condition_by_generation(feed_namespaces, key_prefix='index_page')
+@cache_page_by_generation(
+    settings.FEED_CACHE_TIMEOUT, feed_namespaces, key_prefix='index_page'
+)
 def index(request):
-    posts = Post.objects.select_related('author', 'group')
-    page_obj = get_page_object(request, posts)
+    posts = feeds.index_feed()
+    page_obj = attach_cards(get_page_object(request, posts))
     context = {
         'page_obj': page_obj,
     }
     return render(request, 'posts/index.html', context)
 
 
+@query_budget(8)
+@replica_reads
+@cache_control_by_user(settings.FEED_HTTP_MAX_AGE)
+@condition_by_generation(feed_namespaces, key_prefix='group_page')
+@cache_page_by_generation(
+    settings.FEED_CACHE_TIMEOUT, feed_namespaces, key_prefix='group_page'
+)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.select_related('author')
-    page_obj = get_page_object(request, posts)
+    posts = feeds.group_feed(group)
+    page_obj = attach_cards(get_page_object(request, posts), group_list=True)
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -36,28 +92,49 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@query_budget(9)
+@replica_reads
+@cache_control_by_user(settings.FEED_HTTP_MAX_AGE)
+@condition_by_generation(profile_namespaces, key_prefix='profile_page')
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    user_posts = author.posts.all()
-    page_obj = get_page_object(request, user_posts)
-    if request.user.is_authenticated and request.user != author:
-        following = Follow.objects.select_related(
-            'user', 'author'
-        ).exists()
-    else:
-        following = False
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    user_posts = feeds.profile_feed(author)
+    page_obj = attach_cards(
+        get_page_object(request, user_posts), profile=True
+    )
+    stats = counters.user_stats(author)
+    following = (
+        request.user != author
+        and follow_graph.for_request(request).is_following(author)
+    )
     context = {
         'author': author,
         'user_posts': user_posts,
         'page_obj': page_obj,
         'following': following,
+        'stats': stats,
+        'posts_count': stats.posts_count,
     }
     return render(request, 'posts/profile.html', context)
 
 
+def get_comments_page(request, post):
+    paginator = CursorPaginator(
+        feeds.post_comments(post),
+        settings.COMMENTS_AMOUNT,
+        after=request.GET.get('after'),
+        ordering=feeds.COMMENT_ORDERING,
+    )
+    return paginator.get_page()
+
+
+@query_budget(8)
+@replica_reads
 def post_detail(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
-    comments = post.comments.all()
+    comments = get_comments_page(request, post)
     form = CommentForm(request.POST or None)
     context = {
         'post': post,
@@ -67,7 +144,21 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+@query_budget(3)
+@replica_reads
+def post_comments(request, post_id):
+    """Следующая порция комментариев для кнопки «Показать ещё»."""
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    context = {
+        'post': post,
+        'comments': get_comments_page(request, post),
+    }
+    return render(request, 'posts/includes/comment_list.html', context)
+
+
+@query_budget(16)
 @login_required
+@transaction.atomic
 def post_create(request):
     form = PostForm(
         request.POST or None,
@@ -78,10 +169,13 @@ def post_create(request):
     post = form.save(commit=False)
     post.author = request.user
     post.save()
+    thumbnails.schedule(post)
     return redirect('posts:profile', post.author)
 
 
+@query_budget(14)
 @login_required
+@transaction.atomic
 def post_edit(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     if post.author != request.user:
@@ -94,16 +188,26 @@ def post_edit(request, post_id):
     context = {'form': form}
     if not form.is_valid():
         return render(request, 'posts/create.html', context)
-    form.save()
+    post = form.save()
+    if 'image' in form.changed_data:
+        # Варианты прежней картинки не должны показываться вместо новой.
+        post.image_variants.all().delete()
+        thumbnails.schedule(post)
     return redirect('posts:post_detail', post.id)
 
 
+@query_budget(8)
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
     # Получите пост и сохраните его в переменную post.
     post = get_object_or_404(Post, pk=post_id)
     form = CommentForm(request.POST or None)
-    if form.is_valid():
+    if form.is_valid() and settings.WRITE_BEHIND_ENABLED:
+        writebehind.wait_on_commit(writebehind.add_comment(
+            request.user, post, form.cleaned_data['text']
+        ))
+    elif form.is_valid():
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
@@ -111,28 +215,66 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@query_budget(8)
+@replica_reads
 @login_required
+@cache_control_by_user(settings.FEED_HTTP_MAX_AGE)
+@condition_by_generation(feed_namespaces, key_prefix='follow_page')
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
-    page_obj = get_page_object(request, posts)
+    posts = feeds.follow_feed(request.user)
+    page_obj = attach_cards(get_page_object(
+        request, posts, TimelinePaginator, user=request.user
+    ))
     context = {
         'page_obj': page_obj
     }
     return render(request, 'posts/follow.html', context)
 
 
+@query_budget(7)
+@replica_reads
+def post_search(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    if query:
+        page_obj = attach_cards(get_page_object(
+            request, search.search_posts(query),
+            ordering=search.SEARCH_ORDERING,
+        ))
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        # Курсорные ссылки паджинатора должны сохранять запрос.
+        'page_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@query_budget(20)
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     # Подписаться на автора
-    author = User.objects.get(username=username)
-    if request.user != author:
-        Follow.objects.get_or_create(user=request.user, author=author)
+    author = get_object_or_404(User, username=username)
+    if request.user != author and settings.WRITE_BEHIND_ENABLED:
+        writebehind.wait_on_commit(
+            writebehind.follow(request.user.pk, author.pk)
+        )
+    elif request.user != author:
+        follow_graph.follow(request.user.pk, author.pk)
     return redirect(reverse('posts:profile', args=[username]))
 
 
+@query_budget(12)
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     # Отписаться
     author = get_object_or_404(User, username=username)
-    Follow.objects.filter(user=request.user, author=author).delete()
+    if settings.WRITE_BEHIND_ENABLED:
+        writebehind.wait_on_commit(
+            writebehind.unfollow(request.user.pk, author.pk)
+        )
+    else:
+        follow_graph.unfollow(request.user.pk, author.pk)
     return redirect('posts:profile', username=author)
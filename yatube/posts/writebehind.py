@@ -0,0 +1,455 @@
+"""Отложенная запись комментариев и подписок.
+
+При `WRITE_BEHIND_ENABLED` вьюхи `add_comment`, `profile_follow` и
+`profile_unfollow` не пишут в базу сами: проверенная операция
+кладётся в очередь, и запрос сразу отвечает. Поток-сбрасыватель
+забирает операции пачками и применяет каждую пачку одной транзакцией,
+через `save()` комментариев и `follow_graph.follow`/`unfollow`, чтобы
+сработали сигналы счётчиков, лент и кеша. Во время всплеска
+комментариев базу держит один писатель с короткими транзакциями
+вместо десятков запросов в очереди на блокировку.
+
+Доставка «хотя бы один раз»: пачка удаляется из очереди только после
+коммита. Повтор не создаёт дублей: у комментария есть уникальный
+`op_id`, а подписка и отписка задают итоговое состояние пары.
+Пачка, которая не применилась, сразу возвращается в очередь. Если
+база занята или недоступна, пачка повторяется целиком. При другой
+ошибке операции применяются по одной, и операция, которая упала
+`WRITE_BEHIND_MAX_ATTEMPTS` раз, уходит в список неудачных и в лог.
+
+Запрос не ждёт применения своей операции: страница после редиректа
+может ещё не показать запись, она появится после ближайшего сброса,
+через `WRITE_BEHIND_FLUSH_INTERVAL`. Применение меняет поколения кеша,
+так что закешированная страница её не скроет, а cookie
+`ReplicaMiddleware` не пускает чтения автора на реплики старше его
+запроса. Если запись нужно показать сразу, `WRITE_BEHIND_WAIT` задаёт,
+сколько секунд вьюха после коммита ждёт своей операции
+(`wait_on_commit`); пока она ждёт, поток занят и всплеск записей уже
+не гасится очередью.
+
+Очередь в памяти (`MemorySpool`) теряется вместе с процессом. Очередь
+в файле SQLite (`DiskSpool`, путь в `WRITE_BEHIND_SPOOL`) переживает
+перезапуск и общая для процессов узла: пачку с арендой забирает
+только один сбрасыватель за раз, так что порядок операций сохраняется.
+"""
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+
+from . import follow_graph
+from .models import Comment, Post, User
+
+logger = logging.getLogger(__name__)
+
+COMMENT, FOLLOW, UNFOLLOW = 'comment', 'follow', 'unfollow'
+# Пачка, взятая сбрасывателем, который затем умер, через столько
+# секунд достаётся другому.
+LEASE_SECONDS = 30
+# Как часто `wait_applied` проверяет очередь, в секундах.
+WAIT_STEP = 0.01
+
+_spool = None
+_flusher = None
+_lock = threading.Lock()
+
+
+class MemorySpool:
+    """Очередь операций в памяти процесса."""
+
+    def __init__(self):
+        self._items = deque()
+        self._attempts = {}
+        self._next_id = 0
+        self._ready = threading.Condition()
+        self.failed = []
+
+    def put(self, operation):
+        with self._ready:
+            self._next_id += 1
+            self._items.append((self._next_id, operation))
+            self._ready.notify()
+            return self._next_id
+
+    def claim(self, limit):
+        """Первые `limit` операций; из очереди их убирает `ack`."""
+        with self._ready:
+            return list(self._items)[:limit]
+
+    def ack(self, ids):
+        ids = set(ids)
+        with self._ready:
+            self._items = deque(
+                item for item in self._items if item[0] not in ids
+            )
+            for pk in ids:
+                self._attempts.pop(pk, None)
+
+    def release(self, ids, failed=False):
+        """Возвращает операции в очередь; с `failed` считает попытку.
+
+        Возвращает операции, исчерпавшие попытки и убранные из очереди.
+        """
+        if not failed:
+            return []
+        ids = set(ids)
+        with self._ready:
+            dead = []
+            for pk, operation in self._items:
+                if pk in ids:
+                    self._attempts[pk] = self._attempts.get(pk, 0) + 1
+                    if (self._attempts[pk]
+                            >= settings.WRITE_BEHIND_MAX_ATTEMPTS):
+                        dead.append((pk, operation))
+            self.failed.extend(operation for _, operation in dead)
+        self.ack(pk for pk, _ in dead)
+        return [operation for _, operation in dead]
+
+    def wait(self, timeout):
+        with self._ready:
+            if not self._items:
+                self._ready.wait(timeout)
+
+    def __contains__(self, pk):
+        with self._ready:
+            return any(item[0] == pk for item in self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskSpool:
+    """Очередь операций в отдельном файле SQLite, вне основной базы."""
+
+    SCHEMA = (
+        '''
+        CREATE TABLE IF NOT EXISTS spool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            operation TEXT NOT NULL,
+            claimed REAL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS failed (
+            id INTEGER PRIMARY KEY,
+            operation TEXT NOT NULL,
+            failed REAL NOT NULL
+        )
+        ''',
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._ready = threading.Event()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def put(self, operation):
+        pk = self._connection().execute(
+            'INSERT INTO spool (operation) VALUES (?)',
+            [json.dumps(operation)],
+        ).lastrowid
+        self._ready.set()
+        return pk
+
+    def claim(self, limit):
+        """Берёт в аренду голову очереди, если её не держит другой."""
+        now = time.time()
+        rows = self._connection().execute(
+            'UPDATE spool SET claimed = ? '
+            'WHERE id IN (SELECT id FROM spool ORDER BY id LIMIT ?) '
+            'AND NOT EXISTS (SELECT 1 FROM spool WHERE claimed > ?) '
+            'RETURNING id, operation',
+            [now, limit, now - LEASE_SECONDS],
+        ).fetchall()
+        return sorted((pk, json.loads(operation)) for pk, operation in rows)
+
+    def _in(self, ids):
+        ids = list(ids)
+        return '(%s)' % ', '.join('?' * len(ids)), ids
+
+    def ack(self, ids):
+        placeholders, ids = self._in(ids)
+        self._connection().execute(
+            'DELETE FROM spool WHERE id IN %s' % placeholders, ids
+        )
+
+    def release(self, ids, failed=False):
+        """Снимает аренду; с `failed` считает попытку.
+
+        Возвращает операции, исчерпавшие попытки и перенесённые
+        в таблицу `failed`.
+        """
+        placeholders, ids = self._in(ids)
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                'UPDATE spool SET claimed = NULL, attempts = attempts + ? '
+                'WHERE id IN %s' % placeholders,
+                [int(failed), *ids],
+            )
+            dead = connection.execute(
+                'DELETE FROM spool WHERE id IN %s AND attempts >= ? '
+                'RETURNING id, operation' % placeholders,
+                [*ids, settings.WRITE_BEHIND_MAX_ATTEMPTS],
+            ).fetchall()
+            connection.executemany(
+                'INSERT INTO failed (id, operation, failed) VALUES (?, ?, ?)',
+                [(pk, operation, time.time()) for pk, operation in dead],
+            )
+        return [json.loads(operation) for _, operation in dead]
+
+    @property
+    def failed(self):
+        return [
+            json.loads(operation)
+            for operation, in self._connection().execute(
+                'SELECT operation FROM failed ORDER BY id'
+            )
+        ]
+
+    def wait(self, timeout):
+        # Операции других процессов видны только опросом.
+        self._ready.wait(timeout)
+        self._ready.clear()
+
+    def __contains__(self, pk):
+        return self._connection().execute(
+            'SELECT 1 FROM spool WHERE id = ?', [pk]
+        ).fetchone() is not None
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM spool'
+        ).fetchone()[0]
+
+
+def get_spool():
+    global _spool
+    with _lock:
+        path = settings.WRITE_BEHIND_SPOOL
+        if _spool is None or getattr(_spool, 'path', None) != path:
+            _spool = DiskSpool(path) if path else MemorySpool()
+    return _spool
+
+
+def _final_follows(operations):
+    """Итоговое состояние каждой пары (читатель, автор) в пачке."""
+    final = {}
+    for operation in operations:
+        if operation['kind'] in (FOLLOW, UNFOLLOW):
+            pair = (operation['user_id'], operation['author_id'])
+            final[pair] = operation['kind'] == FOLLOW
+    return final
+
+
+def _apply_comments(operations, users):
+    comments = [op for op in operations if op['kind'] == COMMENT]
+    if not comments:
+        return
+    done = {
+        op_id.hex for op_id in Comment.objects.filter(
+            op_id__in=[op['op_id'] for op in comments]
+        ).values_list('op_id', flat=True)
+    }
+    posts = set(Post.objects.filter(
+        pk__in={op['post_id'] for op in comments}
+    ).values_list('pk', flat=True))
+    for op in comments:
+        if (
+            op['op_id'] not in done and op['post_id'] in posts
+            and op['user_id'] in users
+        ):
+            Comment(
+                post_id=op['post_id'], author_id=op['user_id'],
+                text=op['text'], op_id=op['op_id'],
+            ).save()
+            done.add(op['op_id'])
+
+
+def _apply_follows(operations, users):
+    for (user_id, author_id), following in _final_follows(
+        operations
+    ).items():
+        if not following:
+            follow_graph.unfollow(user_id, author_id)
+        elif {user_id, author_id} <= users and user_id != author_id:
+            follow_graph.follow(user_id, author_id)
+
+
+def apply(operations):
+    """Применяет пачку операций одной транзакцией."""
+    # Пост или пользователя могли удалить, пока операция ждала в
+    # очереди; такие операции пропускаются.
+    referenced = {op['user_id'] for op in operations} | {
+        op['author_id'] for op in operations if 'author_id' in op
+    }
+    with transaction.atomic():
+        users = set(User.objects.filter(pk__in=referenced).values_list(
+            'pk', flat=True
+        ))
+        _apply_comments(operations, users)
+        _apply_follows(operations, users)
+
+
+def _apply_one_by_one(spool, batch):
+    """Применяет операции упавшей пачки по одной, сохраняя порядок."""
+    for number, (pk, operation) in enumerate(batch):
+        try:
+            apply([operation])
+        except OperationalError:
+            spool.release([item for item, _ in batch[number:]])
+            raise
+        except Exception:
+            logger.exception('Не применилась операция очереди записи')
+            for dead in spool.release([pk], failed=True):
+                logger.error('Операция убрана из очереди записи: %s', dead)
+        else:
+            spool.ack([pk])
+
+
+def flush_batch(spool):
+    """Применяет одну пачку; возвращает число операций в ней."""
+    batch = spool.claim(settings.WRITE_BEHIND_BATCH_SIZE)
+    if not batch:
+        return 0
+    ids = [pk for pk, _ in batch]
+    try:
+        apply([operation for _, operation in batch])
+    except OperationalError:
+        # База занята или недоступна: пачка вернётся в очередь целиком.
+        spool.release(ids)
+        raise
+    except Exception:
+        logger.exception('Пачка очереди записи применяется по одной')
+        _apply_one_by_one(spool, batch)
+    else:
+        spool.ack(ids)
+    return len(batch)
+
+
+def flush():
+    """Применяет всё, что есть в очереди, в текущем потоке."""
+    spool = get_spool()
+    while flush_batch(spool):
+        pass
+
+
+class Flusher(threading.Thread):
+    """Поток, сбрасывающий очередь в базу."""
+
+    def __init__(self, spool):
+        super().__init__(name='write-behind', daemon=True)
+        self.spool = spool
+
+    def run(self):
+        delay = settings.WRITE_BEHIND_FLUSH_INTERVAL
+        while True:
+            try:
+                if not flush_batch(self.spool):
+                    self.spool.wait(settings.WRITE_BEHIND_POLL_INTERVAL)
+                    continue
+                delay = settings.WRITE_BEHIND_FLUSH_INTERVAL
+                # Пауза копит следующую пачку и пропускает читателей.
+                time.sleep(delay)
+            except Exception:
+                # Пачка осталась в очереди и будет применена снова.
+                logger.exception('Не удалось сбросить очередь записи')
+                delay = min(delay * 2 or 0.1, 10)
+                time.sleep(delay)
+            finally:
+                close_old_connections()
+
+
+def _start_flusher(spool):
+    global _flusher
+    with _lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = Flusher(spool)
+            _flusher.start()
+            if isinstance(spool, MemorySpool):
+                atexit.register(_drain, spool)
+
+
+def _drain(spool):
+    """При остановке процесса дописывает очередь в памяти."""
+    try:
+        while flush_batch(spool):
+            pass
+    except Exception:
+        logger.exception('Потеряно операций очереди записи: %s', len(spool))
+
+
+def enqueue(kind, **fields):
+    """Кладёт проверенную операцию в очередь; возвращает её номер."""
+    operation = {'op_id': uuid.uuid4().hex, 'kind': kind, **fields}
+    spool = get_spool()
+    pk = spool.put(operation)
+    if settings.WRITE_BEHIND_AUTOFLUSH:
+        _start_flusher(spool)
+    return pk
+
+
+def wait_applied(pk, timeout):
+    """Ждёт, пока операция `pk` уйдёт из очереди; True, если ушла."""
+    spool = get_spool()
+    deadline = time.monotonic() + timeout
+    while pk in spool:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(WAIT_STEP)
+    return True
+
+
+def wait_on_commit(pk):
+    """После коммита запроса ждёт применения его операции.
+
+    Внутри транзакции ждать нельзя: с BEGIN IMMEDIATE запрос держит
+    блокировку записи, и сбрасыватель не смог бы применить пачку.
+    """
+    timeout = settings.WRITE_BEHIND_WAIT
+    if timeout:
+        transaction.on_commit(lambda: wait_applied(pk, timeout))
+
+
+def add_comment(user, post, text):
+    return enqueue(COMMENT, user_id=user.pk, post_id=post.pk, text=text)
+
+
+def follow(user_id, author_id):
+    return enqueue(FOLLOW, user_id=user_id, author_id=author_id)
+
+
+def unfollow(user_id, author_id):
+    return enqueue(UNFOLLOW, user_id=user_id, author_id=author_id)
+
+
+def pending():
+    return len(get_spool())
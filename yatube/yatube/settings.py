@@ -51,6 +51,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
+    'core.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,7 +68,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.template_backends.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -75,6 +78,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'core.context_processors.year.year',
+                'core.context_processors.following.following',
             ],
         },
     },
@@ -86,13 +90,36 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# core.db — sqlite3 с WAL, настроенными PRAGMA, BEGIN IMMEDIATE и
+# повтором запросов при «database is locked». Соединение живёт
+# между запросами, а не открывается на каждый.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'core.db',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 60 * 10,
     }
 }
 
+# Реплики для чтения (core.replicas): YATUBE_REPLICAS=N добавляет N
+# копий базы в файлах рядом с основной; обновляет их sync_replicas.
+for number in range(1, int(os.environ.get('YATUBE_REPLICAS', 0)) + 1):
+    DATABASES['replica%s' % number] = {
+        **DATABASES['default'],
+        'NAME': os.path.join(BASE_DIR, 'db.replica%s.sqlite3' % number),
+        'TEST': {'MIRROR': 'default'},
+    }
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['core.replicas.PrimaryReplicaRouter']
+# Читаются только из основной базы: сессии и пользователи нужны
+# свежими сразу после входа, ключи миниатюр — после их создания.
+REPLICA_PRIMARY_APPS = ('auth', 'contenttypes', 'sessions', 'thumbnail')
+# Реплика старше этого числа секунд не используется, и столько же
+# живёт cookie со временем последней записи читателя.
+REPLICA_MAX_LAG = 60
+REPLICA_FRESHNESS_NAMESPACES = ('posts',)
+REPLICA_COOKIE_NAME = 'last_write'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -144,14 +171,120 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 POSTS_AMOUNT = 10
 POSTS_AMOUNT2 = 3
+COMMENTS_AMOUNT = 20
+
+# Лента подписок: авторы с большим числом подписчиков не рассылают
+# посты по лентам, а подмешиваются при чтении.
+TIMELINE_CELEBRITY_FOLLOWERS = 1000
+TIMELINE_BACKFILL_LIMIT = 500
+TIMELINE_BATCH_SIZE = 500
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
+# Бюджет SQL-запросов на запрос (core.middleware.QueryBudgetMiddleware).
+# Вьюхи объявляют свой бюджет декоратором core.querycount.query_budget;
+# форма запроса, повторённая QUERY_REPEAT_THRESHOLD раз, считается N+1.
+# В тестах нарушения падают исключением (core.testing).
+QUERY_BUDGET_ENABLED = True
+QUERY_BUDGET_STRICT = False
+QUERY_BUDGET_DEFAULT = 30
+QUERY_REPEAT_THRESHOLD = 5
+# Не учитываются запросы хранилища ключей sorl-thumbnail: они идут
+# только при первой отрисовке ещё не построенной миниатюры, дальше
+# ключи читаются из кеша.
+QUERY_BUDGET_IGNORE = ('"thumbnail_kvstore"',)
+TEST_RUNNER = 'core.testing.QueryBudgetRunner'
+
+# Гистограммы времени запросов по фазам (core.metrics). Отдаются на
+# /metrics/ только с заголовком «Authorization: Bearer METRICS_TOKEN»
+# (адрес клиента за прокси всегда 127.0.0.1 и ничего не доказывает);
+# без токена /metrics/ выключен. При заданном METRICS_FILE (например,
+# для textfile-коллектора node_exporter) каждый воркер раз
+# в METRICS_DUMP_INTERVAL секунд пишет их в файл.
+METRICS_ENABLED = True
+METRICS_TOKEN = os.environ.get('YATUBE_METRICS_TOKEN')
+METRICS_FILE = os.environ.get('YATUBE_METRICS_FILE')
+METRICS_DUMP_INTERVAL = 60
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Загрузки крупнее этого размера пишутся во временный файл на диске,
+# а не держатся в памяти воркера.
+FILE_UPLOAD_MAX_MEMORY_SIZE = 512 * 1024
+# Ограничения картинки поста: размер файла, число пикселей по
+# заголовку (проверяется до декодирования) и длинная сторона, до
+# которой уменьшается сохраняемый оригинал.
+POST_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+POST_IMAGE_MAX_SIDE = 2048
+
+# Главная и страницы групп сбрасываются из кеша при изменении данных
+# (core.cache), таймаут лишь вытесняет давно не открывавшиеся страницы.
+FEED_CACHE_TIMEOUT = 60 * 60 * 4
+
+# Сколько секунд браузер и прокси могут показывать страницу ленты
+# анонимному читателю без перепроверки. Вошедшим страницы отдаются
+# как private и перепроверяются по ETag каждый раз.
+FEED_HTTP_MAX_AGE = 60
+
+# Карточки постов инвалидируются по времени изменения поста, таймаут
+# только ограничивает устаревание имени автора и названия группы.
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+# Сколько последних комментариев показывает карточка поста в ленте.
+POST_CARD_COMMENTS = 3
+
+# Отложенная запись комментариев и подписок (posts.writebehind). Без
+# пути к файлу очередь живёт в памяти процесса и теряется с ним.
+WRITE_BEHIND_ENABLED = bool(os.environ.get('YATUBE_WRITE_BEHIND'))
+WRITE_BEHIND_SPOOL = os.environ.get('YATUBE_WRITE_BEHIND_SPOOL')
+WRITE_BEHIND_BATCH_SIZE = 500
+# Пауза между пачками и период опроса пустой очереди, в секундах.
+WRITE_BEHIND_FLUSH_INTERVAL = 0.05
+WRITE_BEHIND_POLL_INTERVAL = 1.0
+# Запускать поток-сбрасыватель; в тестах очередь сбрасывают вручную.
+WRITE_BEHIND_AUTOFLUSH = True
+# Сколько раз повторять операцию, которая падает не из-за занятой
+# базы, прежде чем убрать её из очереди в список неудачных.
+WRITE_BEHIND_MAX_ATTEMPTS = 5
+# Сколько секунд запрос после коммита ждёт применения своей операции,
+# чтобы страница после редиректа её уже показала. По умолчанию не ждёт:
+# запрос отвечает сразу, запись появится после ближайшего сброса.
+WRITE_BEHIND_WAIT = float(os.environ.get('YATUBE_WRITE_BEHIND_WAIT', 0))
+
+# Размеры миниатюр картинок постов; должны совпадать с параметрами
+# тега {% thumbnail %} в шаблонах posts/.
+POST_THUMBNAIL_GEOMETRIES = (
+    ('960x339', {'crop': 'center', 'upscale': True}),
+)
+# Адаптивные варианты картинок постов для <picture srcset>: ширины,
+# пропорции кадра и форматы в порядке предпочтения. Форматы, которые
+# не умеет сохранять установленный Pillow, пропускаются.
+POST_IMAGE_VARIANT_WIDTHS = (320, 640, 960)
+POST_IMAGE_VARIANT_ASPECT = (960, 339)
+POST_IMAGE_VARIANT_FORMATS = ('avif', 'webp', 'jpeg')
+POST_IMAGE_VARIANT_QUALITY = {'avif': 50, 'webp': 75, 'jpeg': 80}
+# Миниатюры новых картинок строятся заранее в фоновом пуле потоков.
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_PREGENERATE_SYNC = False
+THUMBNAIL_BACKEND = 'core.thumbnail_backends.TimedThumbnailBackend'
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache_backends.TimedLocMemCache',
     }
 }
+
+# Общий для всех процессов узла кеш в файле SQLite (core.cache_backends)
+# вместо отдельного LocMemCache в каждом воркере.
+SHARED_CACHE_LOCATION = os.environ.get('YATUBE_SHARED_CACHE')
+if SHARED_CACHE_LOCATION:
+    CACHES['default'] = {
+        'BACKEND': 'core.cache_backends.SQLiteCache',
+        'LOCATION': SHARED_CACHE_LOCATION,
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_SIZE': 256 * 2 ** 20,
+        },
+    }